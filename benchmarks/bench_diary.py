@@ -0,0 +1,300 @@
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from diary import DatabaseManager
+
+DEFAULT_SIZES = [1000, 10000]
+SEARCH_QUERIES = ['the', 'morning', 'coff', 'river walk', 'zzzq']
+
+# Synthetic text
+
+def build_vocabulary(rng, size=20000):
+    syllables = ['ka', 'lo', 'mi', 'ne', 'ra', 'to', 'su', 'vi', 'an', 'el', 'or', 'ing', 'er', 'st']
+    common = ['the', 'and', 'to', 'of', 'a', 'i', 'in', 'was', 'it', 'my', 'today', 'morning',
+              'coffee', 'river', 'walk', 'evening', 'work', 'friend', 'family', 'rain']
+    words = list(common)
+    seen = set(words)
+    while len(words) < size:
+        word = ''.join(rng.choice(syllables) for _ in range(rng.randint(1, 4)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    # Zipf-like frequencies, as in natural text
+    weights = [1.0 / (rank + 1) for rank in range(len(words))]
+    return words, weights
+
+def generate_entries(count, seed=1):
+    # Yields (title, content, created_at, utc_offset). Body length follows a
+    # log-normal distribution: most entries are a few paragraphs, a few run
+    # to thousands of words.
+    rng = random.Random(seed)
+    words, weights = build_vocabulary(rng)
+    cumulative = []
+    total = 0.0
+    for weight in weights:
+        total += weight
+        cumulative.append(total)
+    
+    created_at = 1420070400  # 2015-01-01
+    for index in range(count):
+        created_at += rng.randint(600, 86400 * 2)
+        title = ' '.join(rng.choices(words, cum_weights=cumulative, k=rng.randint(2, 8))).capitalize()
+        length = min(int(rng.lognormvariate(5.0, 0.8)) + 5, 20000)
+        body = rng.choices(words, cum_weights=cumulative, k=length)
+        paragraphs = []
+        while body:
+            size = rng.randint(40, 120)
+            paragraphs.append(' '.join(body[:size]).capitalize() + '.')
+            body = body[size:]
+        yield title, '\n\n'.join(paragraphs), created_at, rng.choice([0, 3600, 7200, -18000])
+
+def prepare_database(data_dir, size, seed):
+    # Generated diaries are cached per size and seed; runs work on a copy
+    path = os.path.join(data_dir, 'diary-{}-{}.db'.format(size, seed))
+    if not os.path.exists(path):
+        print('Generating {} entries into {}'.format(size, path), file=sys.stderr)
+        partial_path = path + '.partial'
+        db = DatabaseManager(partial_path)
+        db.import_entries(generate_entries(size, seed), batch_size=5000)
+        db.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        db.close()
+        os.replace(partial_path, path)
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists(partial_path + suffix):
+                os.remove(partial_path + suffix)
+    return path
+
+# Timing
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        'runs': len(samples),
+        'min_ms': samples[0] * 1000,
+        'median_ms': statistics.median(samples) * 1000,
+        'p95_ms': samples[min(len(samples) - 1, int(math.ceil(len(samples) * 0.95)) - 1)] * 1000,
+        'mean_ms': statistics.mean(samples) * 1000,
+    }
+
+def time_calls(function, arguments):
+    samples = []
+    for args in arguments:
+        started = time.perf_counter()
+        function(*args)
+        samples.append(time.perf_counter() - started)
+    return summarize(samples)
+
+def bench_data_layer(path, runs, rng):
+    db = DatabaseManager(path)
+    results = {}
+    ids = [row[0] for row in db.conn.execute('SELECT id FROM diary_entries')]
+    samples = [entry for entry in generate_entries(runs, seed=rng.random())]
+    
+    results['get_entries_page_first'] = time_calls(
+        lambda: db.get_entries_page(limit=50), [()] * runs
+    )
+    anchors = [db.get_entry_summary(rng.choice(ids)) for _ in range(runs)]
+    results['get_entries_page_deep'] = time_calls(
+        lambda entry: db.get_entries_page(entry.created_at, entry.id, 50),
+        [(entry,) for entry in anchors]
+    )
+    results['get_entry'] = time_calls(db.get_entry, [(rng.choice(ids),) for _ in range(runs)])
+    cache_stats = db.cache_stats()
+    for query in SEARCH_QUERIES:
+        results['search[{}]'.format(query)] = time_calls(
+            lambda: db.search_entries(query, limit=50), [()] * runs
+        )
+    results['add_entry'] = time_calls(
+        db.add_entry, [(title, content) for title, content, created_at, offset in samples]
+    )
+    results['update_entry'] = time_calls(
+        db.update_entry,
+        [(rng.choice(ids), title, content) for title, content, created_at, offset in samples]
+    )
+    results['delete_entry'] = time_calls(
+        db.delete_entry, [(entry_id,) for entry_id in rng.sample(ids, min(runs, len(ids)))]
+    )
+    db.close()
+    return results, cache_stats
+
+def bench_ui(path, runs):
+    # HomeScreen reads diary.db from the working directory through the
+    # shared worker, so run it from the directory holding the copy. Kivy
+    # is only imported here, so --no-ui runs need no display.
+    os.environ.setdefault('KIVY_NO_ARGS', '1')
+    os.environ.setdefault('KIVY_NO_CONSOLELOG', '1')
+    import main
+    from kivy.clock import Clock
+    
+    def pump_until(condition, timeout=30):
+        deadline = time.perf_counter() + timeout
+        while not condition():
+            if time.perf_counter() > deadline:
+                raise RuntimeError('timed out waiting for the home screen')
+            Clock.tick()
+    
+    results = {}
+    previous_dir = os.getcwd()
+    os.chdir(os.path.dirname(path))
+    worker = main.AppDatabaseWorker.shared()
+    try:
+        home = main.HomeScreen(name='home')
+        
+        def load_first_page():
+            home.load_entries()
+            pump_until(lambda: home.page_request is None)
+        
+        results['home_load_entries'] = time_calls(load_first_page, [()] * runs)
+        
+        def load_pages(count):
+            home.load_entries()
+            pump_until(lambda: home.page_request is None)
+            for _ in range(count):
+                if not home.has_more_entries:
+                    break
+                home.load_next_page()
+                pump_until(lambda: home.page_request is None)
+        
+        results['home_scroll_10_pages'] = time_calls(load_pages, [(10,)] * max(1, runs // 10))
+        
+        page = worker_page(path)
+        results['entry_view_data_page'] = time_calls(
+            lambda: [home.entry_view_data(entry) for entry in page], [()] * runs
+        )
+        
+        list_view = home.entries_view
+        data = [home.entry_view_data(entry) for entry in page]
+        
+        def build_cards():
+            for index, row in enumerate(data):
+                card = main.EntryCard()
+                card.refresh_view_attrs(list_view, index, row)
+        
+        results['entry_card_build_page'] = time_calls(build_cards, [()] * max(1, runs // 5))
+        
+        card = main.EntryCard()
+        
+        def rebind_card():
+            for index, row in enumerate(data):
+                card.refresh_view_attrs(list_view, index, row)
+        
+        results['entry_card_rebind_page'] = time_calls(rebind_card, [()] * runs)
+    finally:
+        worker.stop()
+        os.chdir(previous_dir)
+    return results
+
+def worker_page(path):
+    db = DatabaseManager(path)
+    try:
+        return db.get_entries_page(limit=50)
+    finally:
+        db.close()
+
+# Commands
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_command(args):
+    os.makedirs(args.data_dir, exist_ok=True)
+    rng = random.Random(args.seed)
+    report = {
+        'revision': git_revision(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'machine': platform.machine(),
+        'runs': args.runs,
+        'sizes': {},
+    }
+    for size in args.sizes:
+        source = prepare_database(args.data_dir, size, args.seed)
+        workdir = tempfile.mkdtemp(prefix='diary-bench-')
+        try:
+            path = os.path.join(workdir, 'diary.db')
+            shutil.copyfile(source, path)
+            print('Benchmarking {} entries'.format(size), file=sys.stderr)
+            timings, cache_stats = bench_data_layer(path, args.runs, rng)
+            results = {'data': timings, 'entry_cache': cache_stats}
+            if not args.no_ui:
+                results['ui'] = bench_ui(path, args.runs)
+            results['file_bytes'] = os.path.getsize(source)
+            report['sizes'][str(size)] = results
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+    
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2, sort_keys=True)
+    print('Wrote {}'.format(args.output), file=sys.stderr)
+
+def compare_command(args):
+    with open(args.baseline) as source:
+        baseline = json.load(source)
+    with open(args.current) as source:
+        current = json.load(source)
+    
+    print('{:<10} {:<34} {:>10} {:>10} {:>8}'.format('size', 'benchmark', 'before', 'after', 'change'))
+    regressions = 0
+    for size, groups in sorted(current['sizes'].items(), key=lambda item: int(item[0])):
+        for group in ('data', 'ui'):
+            for name, stats in sorted(groups.get(group, {}).items()):
+                before = baseline.get('sizes', {}).get(size, {}).get(group, {}).get(name)
+                if before is None:
+                    continue
+                change = stats['median_ms'] / before['median_ms'] - 1 if before['median_ms'] else 0
+                flag = ''
+                if change > args.threshold:
+                    flag = '  <-- slower'
+                    regressions += 1
+                print('{:<10} {:<34} {:>8.2f}ms {:>8.2f}ms {:>+7.0%}{}'.format(
+                    size, group + '.' + name, before['median_ms'], stats['median_ms'], change, flag
+                ))
+    return 1 if regressions else 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Personal Diary benchmarks')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    
+    run_parser = commands.add_parser('run', help='time the data layer and home list')
+    run_parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                            help='diary sizes to test, e.g. 1000 10000 100000 1000000')
+    run_parser.add_argument('--runs', type=int, default=50, help='samples per benchmark')
+    run_parser.add_argument('--seed', type=int, default=1)
+    run_parser.add_argument('--data-dir', default=os.path.join(ROOT, 'benchmarks', 'data'),
+                            help='where generated diaries are cached')
+    run_parser.add_argument('--output', default='benchmark_results.json')
+    run_parser.add_argument('--no-ui', action='store_true', help='skip the Kivy widget benchmarks')
+    run_parser.set_defaults(handler=run_command)
+    
+    compare_parser = commands.add_parser('compare', help='compare two result files')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.2,
+                                help='flag medians this much slower (default 0.2 = 20%%)')
+    compare_parser.set_defaults(handler=compare_command)
+    return parser
+
+if __name__ == '__main__':
+    arguments = build_parser().parse_args()
+    sys.exit(arguments.handler(arguments) or 0)
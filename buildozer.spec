@@ -4,8 +4,9 @@ package.name = personaldiary
 package.domain = com.tangsabas.personaldiary
 source.dir = .
 source.include_exts = py,png,jpg,kv,atlas,txt,db
+source.exclude_dirs = tests
 version = 1.0
-requirements = python3,kivy
+requirements = python3,kivy,cryptography,pillow
 orientation = portrait
 fullscreen = 0
 
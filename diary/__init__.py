@@ -0,0 +1,25 @@
+# Storage, queries and the entry model of Personal Diary, without any
+# Kivy dependency; main.py builds the screens on top of this package.
+from diary.attachments import (
+    CARD_THUMBNAIL_SIZE, VIEW_THUMBNAIL_SIZE, AttachmentStore, ThumbnailCache, attachments_dir,
+    thumbnails_dir
+)
+from diary.backup import (
+    BACKUP_INTERVAL, BACKUP_KEEP, BackupStore, DiaryInUse, UnencryptedBackup, backup_encrypted,
+    backups_dir, verify_database
+)
+from diary.crypto import DiaryLocked, EntryCipher, encryption_available
+from diary.entries import (
+    BODY_ENCRYPTED, BODY_ZLIB, CHUNK_LENGTH, COMPRESS_THRESHOLD, MATCH_END, MATCH_START,
+    PREVIEW_LENGTH, Entry, count_words, current_timestamp, encode_body, entry_body,
+    format_timestamp, iso_to_timestamp, iso_to_utc_offset, make_preview, parse_tags,
+    split_into_chunks, timestamp_to_iso
+)
+from diary.database import ENTRY_CACHE_BYTES, DatabaseManager, EntryCache
+from diary.sync import (
+    SYNC_PORT, SyncRefused, export_file, file_sealed, import_file, new_pairing_code, sync_connect,
+    sync_serve
+)
+from diary.worker import (
+    AttachmentWorker, BackupWorker, DatabaseRequest, DatabaseWorker, Worker
+)
@@ -0,0 +1,153 @@
+import hashlib
+import os
+import shutil
+from collections import OrderedDict
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp')
+
+# Longest side in pixels of the thumbnails on list cards and in open entries
+CARD_THUMBNAIL_SIZE = 160
+VIEW_THUMBNAIL_SIZE = 1024
+
+# Disk space the thumbnail cache may use before old thumbnails are deleted
+THUMBNAIL_CACHE_BYTES = 32 * 1024 * 1024
+
+def attachments_dir(db_path):
+    # Attachments live next to the diary database
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), 'attachments')
+
+def thumbnails_dir(db_path):
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), 'thumbnails')
+
+def attachment_path(directory, name):
+    # Files are spread over subdirectories by the first two hex digits of
+    # their hash so no directory grows too large
+    return os.path.join(directory, name[:2], name)
+
+class ThumbnailCache:
+    # Thumbnail files of at most max_bytes in total; the least recently used
+    # ones are deleted first. File modification times record the last use,
+    # so the order survives restarts. Used from one thread only.
+    def __init__(self, directory, max_bytes=THUMBNAIL_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.files = OrderedDict()
+        self.size = 0
+        os.makedirs(directory, exist_ok=True)
+        found = []
+        for item in os.scandir(directory):
+            if not item.is_file():
+                continue
+            if item.name.endswith('.partial'):
+                os.remove(item.path)
+                continue
+            stat = item.stat()
+            found.append((stat.st_mtime, item.name, stat.st_size))
+        for modified, name, size in sorted(found):
+            self.files[name] = size
+            self.size += size
+    
+    def path(self, name):
+        return os.path.join(self.directory, name)
+    
+    def get(self, name):
+        if name not in self.files:
+            return None
+        path = self.path(name)
+        try:
+            os.utime(path)
+        except OSError:
+            self.discard(name)
+            return None
+        self.files.move_to_end(name)
+        return path
+    
+    def put(self, name):
+        # Records a thumbnail just written to path(name)
+        size = os.path.getsize(self.path(name))
+        self.size += size - self.files.pop(name, 0)
+        self.files[name] = size
+        while self.size > self.max_bytes and len(self.files) > 1:
+            self.discard(next(iter(self.files)))
+        return self.path(name)
+    
+    def discard(self, name):
+        self.size -= self.files.pop(name, 0)
+        try:
+            os.remove(self.path(name))
+        except OSError:
+            pass
+
+class AttachmentStore:
+    # Attached files named by the SHA-256 of their content plus extension,
+    # so the same photo attached twice is stored once, and their thumbnails.
+    # Its methods do file work and are meant for AttachmentWorker's thread.
+    def __init__(self, directory, thumbnail_directory, thumbnail_bytes=THUMBNAIL_CACHE_BYTES):
+        self.directory = directory
+        self.thumbnails = ThumbnailCache(thumbnail_directory, thumbnail_bytes)
+    
+    def import_file(self, source):
+        # Copies source into the store; returns (name, size in bytes)
+        extension = os.path.splitext(source)[1].lower()
+        if extension not in IMAGE_EXTENSIONS:
+            raise ValueError('{} is not a supported image'.format(os.path.basename(source)))
+        digest = hashlib.sha256()
+        with open(source, 'rb') as data:
+            for block in iter(lambda: data.read(1024 * 1024), b''):
+                digest.update(block)
+        name = digest.hexdigest() + extension
+        path = attachment_path(self.directory, name)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            shutil.copyfile(source, path + '.partial')
+            os.replace(path + '.partial', path)
+        return name, os.path.getsize(path)
+    
+    def file_path(self, name):
+        return attachment_path(self.directory, name)
+    
+    def thumbnail(self, name, size):
+        # Path of a JPEG at most size pixels on its longest side, made on
+        # first use; the attachment itself if it cannot be made
+        thumbnail_name = '{}-{}.jpg'.format(name.split('.')[0], size)
+        path = self.thumbnails.get(thumbnail_name)
+        if path is not None:
+            return path
+        source = self.file_path(name)
+        if not os.path.exists(source):
+            return source
+        try:
+            # Imported on first use rather than with the package; loading
+            # Pillow takes longer than the rest of diary put together
+            from PIL import Image, ImageOps
+        except ImportError:  # without Pillow, screens show the attached files as they are
+            return source
+        target = self.thumbnails.path(thumbnail_name)
+        with Image.open(source) as image:
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((size, size))
+            image.convert('RGB').save(target + '.partial', 'JPEG', quality=85)
+        os.replace(target + '.partial', target)
+        return self.thumbnails.put(thumbnail_name)
+    
+    def keep_only(self, names):
+        # Deletes stored files, and their thumbnails, whose names are not in
+        # names; returns how many were deleted
+        names = set(names)
+        removed = 0
+        if not os.path.isdir(self.directory):
+            return 0
+        for folder in os.scandir(self.directory):
+            if not folder.is_dir():
+                continue
+            for item in os.scandir(folder.path):
+                if item.name in names:
+                    continue
+                os.remove(item.path)
+                removed += 1
+                digest = item.name.split('.')[0]
+                for thumbnail_name in [key for key in self.thumbnails.files if key.startswith(digest)]:
+                    self.thumbnails.discard(thumbnail_name)
+            if not os.listdir(folder.path):
+                os.rmdir(folder.path)
+        return removed
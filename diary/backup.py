@@ -0,0 +1,170 @@
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+# Pages copied per backup step (4 KB each by default), and the pause after
+# each step that leaves the disk to the app in between
+BACKUP_STEP_PAGES = 256
+BACKUP_STEP_PAUSE = 0.005
+
+# Backups kept; older ones are deleted once a new one is complete
+BACKUP_KEEP = 7
+
+# Seconds after the newest backup before the app makes another one
+BACKUP_INTERVAL = 24 * 60 * 60
+
+BACKUP_NAME = 'diary-%Y%m%d-%H%M%S.db'
+
+class BackupCancelled(Exception):
+    pass
+
+class UnencryptedBackup(ValueError):
+    # Restoring the backup would turn the encryption of a diary off
+    pass
+
+class DiaryInUse(ValueError):
+    # Another connection has the diary open, so it cannot be restored
+    pass
+
+def backups_dir(db_path):
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), 'backups')
+
+def verify_database(path):
+    # Raises ValueError unless path holds an intact diary database
+    if not os.path.isfile(path):
+        raise ValueError('{} does not exist'.format(path))
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute('PRAGMA query_only = ON')
+        problems = [row[0] for row in conn.execute('PRAGMA integrity_check')]
+        is_diary = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'diary_entries'"
+        ).fetchone() is not None
+    except sqlite3.DatabaseError as error:
+        raise ValueError('{} is not a readable database: {}'.format(path, error))
+    finally:
+        conn.close()
+    if problems != ['ok']:
+        raise ValueError('{} is damaged: {}'.format(path, problems[0]))
+    if not is_diary:
+        raise ValueError('{} is not a diary database'.format(path))
+
+def backup_encrypted(path):
+    # Whether encryption was turned on in the diary database at path
+    conn = sqlite3.connect(path)
+    try:
+        if conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'settings'"
+        ).fetchone() is None:
+            return False
+        return conn.execute(
+            "SELECT 1 FROM settings WHERE key = 'encryption_salt'"
+        ).fetchone() is not None
+    finally:
+        conn.close()
+
+class BackupStore:
+    # Dated copies of one diary database in a folder. Its methods do file
+    # work and are meant for BackupWorker's thread; restoring goes through
+    # DatabaseManager.restore_backup on the database thread.
+    def __init__(self, db_path, directory=None, keep=BACKUP_KEEP):
+        self.db_path = db_path
+        self.directory = directory or backups_dir(db_path)
+        self.keep = keep
+        # Set from another thread to stop a backup between two steps
+        self.cancelled = False
+    
+    def list_backups(self):
+        # [(path, made at, size in bytes)], newest first
+        if not os.path.isdir(self.directory):
+            return []
+        backups = []
+        for item in os.scandir(self.directory):
+            try:
+                made_at = datetime.strptime(item.name, BACKUP_NAME)
+            except ValueError:
+                continue
+            backups.append((item.path, int(made_at.timestamp()), item.stat().st_size))
+        backups.sort(key=lambda backup: backup[1], reverse=True)
+        return backups
+    
+    def backup_due(self, interval=BACKUP_INTERVAL):
+        backups = self.list_backups()
+        return not backups or time.time() - backups[0][1] >= interval
+    
+    def create(self, pages=BACKUP_STEP_PAGES, pause=BACKUP_STEP_PAUSE, progress=None):
+        # Copies the database a few pages at a time over a connection of
+        # its own, then rotates; returns the path of the new backup.
+        # progress(copied pages, total pages) is called after each step.
+        # Raises BackupCancelled, leaving no file behind, once cancelled.
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, datetime.now().strftime(BACKUP_NAME))
+        partial = path + '.partial'
+        if os.path.exists(partial):
+            os.remove(partial)
+        
+        def step(status, remaining, total):
+            if self.cancelled:
+                raise BackupCancelled('backup of {} cancelled'.format(self.db_path))
+            if progress is not None:
+                progress(total - remaining, total)
+            time.sleep(pause)
+        
+        source = sqlite3.connect(self.db_path, isolation_level=None)
+        target = sqlite3.connect(partial)
+        try:
+            # A read transaction held across every step pins one snapshot.
+            # In WAL mode the app keeps writing meanwhile; its commits land
+            # in the next backup instead of making this one start over.
+            source.execute('BEGIN')
+            source.execute('SELECT count(*) FROM sqlite_master').fetchone()
+            source.backup(target, pages=pages, progress=step)
+            source.execute('COMMIT')
+            # A single self-contained file, without -wal and -shm companions
+            target.execute('PRAGMA journal_mode = DELETE')
+        except Exception:
+            target.close()
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+        finally:
+            target.close()
+            source.close()
+        os.replace(partial, path)
+        self.rotate()
+        return path
+    
+    def replace_all(self):
+        # Makes a backup and deletes every older one; for after the diary
+        # has been encrypted, since those still hold its text unencrypted
+        # (or, while encrypting, in the search index and free pages)
+        path = self.create()
+        for older, made_at, size in self.list_backups():
+            if older != path:
+                os.remove(older)
+        return path
+    
+    def attachment_names(self):
+        # Names of the attachments the kept backups refer to; they stay on
+        # disk as long as a backup that would bring them back is kept
+        names = set()
+        for path, made_at, size in self.list_backups():
+            conn = sqlite3.connect(path)
+            try:
+                if conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'attachments'"
+                ).fetchone() is not None:
+                    names.update(name for (name,) in conn.execute('SELECT name FROM attachments'))
+            except sqlite3.DatabaseError:
+                pass  # a damaged backup cannot be restored anyway
+            finally:
+                conn.close()
+        return names
+    
+    def rotate(self):
+        # Deletes all but the newest keep backups; returns how many
+        removed = self.list_backups()[self.keep:]
+        for path, made_at, size in removed:
+            os.remove(path)
+        return len(removed)
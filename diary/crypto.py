@@ -0,0 +1,69 @@
+import hashlib
+import os
+from importlib.util import find_spec
+
+# scrypt cost: n * r * 128 bytes of memory (16 MB) for each derivation,
+# which is what makes guessing passphrases expensive
+KDF_N = 2 ** 14
+KDF_R = 8
+KDF_P = 1
+KEY_LENGTH = 32
+SALT_LENGTH = 16
+NONCE_LENGTH = 12
+
+# Encrypted with the key to tell a wrong passphrase from a right one
+CHECK_TEXT = b'personal-diary'
+
+class DiaryLocked(Exception):
+    # Encrypted rows were read before the diary was unlocked
+    pass
+
+def encryption_available():
+    # Without importing it: cryptography is only loaded by EntryCipher,
+    # so diaries that are not encrypted never pay for it
+    return find_spec('cryptography') is not None
+
+def row_field(field, *keys):
+    # Associated data for one field of one row, e.g. b'title:42'; a value
+    # copied into another row then fails to decrypt like a tampered one
+    return b':'.join([field] + [str(key).encode('ascii') for key in keys])
+
+def derive_key(passphrase, salt, n=KDF_N, r=KDF_R, p=KDF_P):
+    # The slow part of unlocking. Not cached: a cache would keep the
+    # passphrase itself in memory for as long as the process runs.
+    return hashlib.scrypt(passphrase.encode('utf-8'), salt=salt, n=n, r=r, p=p,
+                          maxmem=n * r * 256, dklen=KEY_LENGTH)
+
+class EntryCipher:
+    # AES-256-GCM. Every value gets a fresh random nonce, stored in front of
+    # its ciphertext, and is authenticated together with associated data
+    # naming its field and row (see row_field) so values cannot be swapped
+    # between fields or rows unnoticed.
+    def __init__(self, key):
+        try:
+            from cryptography.exceptions import InvalidTag
+            from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+        except ImportError:
+            raise RuntimeError('Encrypted diaries need the cryptography package')
+        self.aead = AESGCM(key)
+        self.invalid_tag = InvalidTag
+    
+    @classmethod
+    def from_passphrase(cls, passphrase, salt, n=KDF_N, r=KDF_R, p=KDF_P):
+        return cls(derive_key(passphrase, salt, n, r, p))
+    
+    def encrypt(self, data, field):
+        nonce = os.urandom(NONCE_LENGTH)
+        return nonce + self.aead.encrypt(nonce, data, field)
+    
+    def decrypt(self, blob, field):
+        try:
+            return self.aead.decrypt(blob[:NONCE_LENGTH], blob[NONCE_LENGTH:], field)
+        except self.invalid_tag:
+            raise ValueError('could not decrypt {}: wrong key or damaged data'.format(field.decode()))
+    
+    def encrypt_text(self, text, field):
+        return self.encrypt(text.encode('utf-8'), field)
+    
+    def decrypt_text(self, blob, field):
+        return self.decrypt(blob, field).decode('utf-8')
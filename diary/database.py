@@ -0,0 +1,1736 @@
+import hashlib
+import os
+import re
+import sqlite3
+import time
+import uuid
+from collections import OrderedDict
+from datetime import date, timedelta
+from itertools import islice
+
+from diary.attachments import attachment_path, attachments_dir
+from diary.backup import DiaryInUse, UnencryptedBackup, backup_encrypted, verify_database
+from diary.crypto import (
+    CHECK_TEXT, KDF_N, KDF_P, KDF_R, SALT_LENGTH, DiaryLocked, EntryCipher, row_field
+)
+from diary.entries import (
+    BODY_ENCRYPTED, BODY_ZLIB, MATCH_END, MATCH_START, Entry, count_words, current_timestamp,
+    encode_body, entry_body, entry_factory, iso_to_timestamp, iso_to_utc_offset, make_preview,
+    timestamp_to_iso
+)
+from diary.profiling import ProfiledConnection, profiler
+from diary.revisions import (
+    REVISION_DELTA, REVISION_SNAPSHOT, SNAPSHOT_INTERVAL, apply_delta, make_delta
+)
+
+def row_uid(entry_id, created_at, title, content):
+    # Sync uid of an entry that predates the change journal, from its row
+    # as stored (encrypted or compressed values are hashed as they are)
+    digest = hashlib.sha256()
+    for value in (entry_id, created_at, title, content):
+        if not isinstance(value, bytes):
+            value = str(value).encode('utf-8')
+        digest.update(len(value).to_bytes(4, 'big'))
+        digest.update(value)
+    return digest.hexdigest()[:32]
+
+class EntryCache:
+    # Full entries by id for DatabaseManager.get_entry. The least recently
+    # used ones are dropped once their titles and stored bodies add up to
+    # more than max_bytes. Only the database thread touches it. Entries go
+    # in and come out as copies, so text a caller decodes is never held
+    # here uncounted and releasing it never touches another caller's entry.
+    ENTRY_OVERHEAD = 200
+    
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+    
+    def entry_size(self, entry):
+        return len(entry.title) + len(entry.body) + self.ENTRY_OVERHEAD
+    
+    def get(self, entry_id):
+        entry = self.entries.get(entry_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(entry_id)
+        return entry.copy()
+    
+    def peek(self, entry_id):
+        # Like get, without counting or refreshing the entry; returns the
+        # cached Entry itself, which must only be read
+        return self.entries.get(entry_id)
+    
+    def put(self, entry):
+        self.discard(entry.id)
+        size = self.entry_size(entry)
+        if size > self.max_bytes:
+            return
+        self.entries[entry.id] = entry.copy()
+        self.size += size
+        while self.size > self.max_bytes:
+            entry_id, evicted = self.entries.popitem(last=False)
+            self.size -= self.entry_size(evicted)
+    
+    def discard(self, entry_id):
+        entry = self.entries.pop(entry_id, None)
+        if entry is not None:
+            self.size -= self.entry_size(entry)
+    
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self.entries),
+            'bytes': self.size,
+        }
+
+# Bytes of entry text kept in memory by EntryCache
+ENTRY_CACHE_BYTES = 2 * 1024 * 1024
+
+# Local calendar day ('YYYY-MM-DD') and month-day ('MM-DD') of an entry row,
+# as SQL expressions over created_at and utc_offset. The month-day one must
+# match the indexed expression exactly for the index to be used.
+LOCAL_DAY = "date({0}created_at + {0}utc_offset, 'unixepoch')"
+LOCAL_MONTH_DAY = "strftime('%m-%d', {0}created_at + {0}utc_offset, 'unixepoch')"
+
+# Column lists for the two shapes of Entry rows
+SUMMARY_COLUMNS = (
+    'id, title, preview, created_at, utc_offset, word_count, content_flags AS body_flags, cover'
+)
+ENTRY_COLUMNS = SUMMARY_COLUMNS + ', content AS body'
+
+# Full-text index triggers. They use nothing but SQL, so plain rows stay
+# writable from connections without this module's functions, and index
+# plain rows only: compressed rows are indexed by DatabaseManager itself
+# (index_compressed, unindex_compressed), encrypted rows never.
+FTS_INSERT_TRIGGER = '''
+    CREATE TRIGGER diary_entries_fts_insert AFTER INSERT ON diary_entries
+    WHEN new.content_flags = 0 BEGIN
+        INSERT INTO entries_fts (rowid, title, content) VALUES (new.id, new.title, new.content);
+    END
+'''
+FTS_DELETE_TRIGGER = '''
+    CREATE TRIGGER diary_entries_fts_delete AFTER DELETE ON diary_entries
+    WHEN old.content_flags = 0 BEGIN
+        INSERT INTO entries_fts (entries_fts, rowid, title, content)
+        VALUES ('delete', old.id, old.title, old.content);
+    END
+'''
+FTS_UPDATE_TRIGGER = '''
+    CREATE TRIGGER diary_entries_fts_update
+    AFTER UPDATE OF title, content, content_flags ON diary_entries
+    WHEN old.content_flags = 0 OR new.content_flags = 0 BEGIN
+        INSERT INTO entries_fts (entries_fts, rowid, title, content)
+        SELECT 'delete', old.id, old.title, old.content WHERE old.content_flags = 0;
+        INSERT INTO entries_fts (rowid, title, content)
+        SELECT new.id, new.title, new.content WHERE new.content_flags = 0;
+    END
+'''
+
+# Connections without entry_body() (the sqlite3 shell, a DB browser) would
+# change compressed or encrypted rows behind index_compressed's back and
+# leave the index out of step, so these make them fail instead
+FTS_GUARD_CONDITION = (
+    "NOT EXISTS (SELECT 1 FROM pragma_function_list WHERE name = 'entry_body')"
+)
+FTS_GUARD_MESSAGE = "'only Personal Diary can change compressed or encrypted entries'"
+FTS_GUARD_TRIGGERS = [
+    '''
+    CREATE TRIGGER diary_entries_fts_guard_insert BEFORE INSERT ON diary_entries
+    WHEN new.content_flags != 0 AND {0} BEGIN
+        SELECT RAISE(ABORT, {1});
+    END
+    ''',
+    '''
+    CREATE TRIGGER diary_entries_fts_guard_delete BEFORE DELETE ON diary_entries
+    WHEN old.content_flags != 0 AND {0} BEGIN
+        SELECT RAISE(ABORT, {1});
+    END
+    ''',
+    '''
+    CREATE TRIGGER diary_entries_fts_guard_update
+    BEFORE UPDATE OF title, content, content_flags ON diary_entries
+    WHEN (old.content_flags != 0 OR new.content_flags != 0) AND {0} BEGIN
+        SELECT RAISE(ABORT, {1});
+    END
+    ''',
+]
+
+class DatabaseManager:
+    def __init__(self, db_path='diary.db', cache_bytes=ENTRY_CACHE_BYTES):
+        self.db_path = db_path
+        self.cache = EntryCache(cache_bytes)
+        # Keep one connection open for the lifetime of the store; sqlite3
+        # caches compiled statements per connection, keyed by the SQL text.
+        self.conn = sqlite3.connect(
+            self.db_path,
+            cached_statements=128,
+            factory=sqlite3.Connection if profiler is None else ProfiledConnection
+        )
+        self.listeners = []
+        self.configure_connection()
+        self.init_database()
+    
+    def configure_connection(self):
+        cursor = self.conn.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute('PRAGMA temp_store=MEMORY')
+        cursor.execute('PRAGMA cache_size=-8000')
+        cursor.execute('PRAGMA busy_timeout=5000')
+        self.conn.create_function('make_preview', 1, make_preview, deterministic=True)
+        self.conn.create_function('count_words', 1, count_words, deterministic=True)
+        self.conn.create_function('iso_to_timestamp', 1, iso_to_timestamp, deterministic=True)
+        self.conn.create_function('iso_to_utc_offset', 1, iso_to_utc_offset, deterministic=True)
+        self.conn.create_function('entry_body', 2, entry_body, deterministic=True)
+    
+    def init_database(self):
+        with self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS diary_entries (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    title TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    date TEXT NOT NULL
+                )
+            ''')
+        self.upgrade_schema()
+        self.compress_threshold = int(self.get_setting('compress_threshold', 0))
+        self.compressed_up_to = 0
+        # Set by unlock() or enable_encryption(); only ever held in memory
+        self.cipher = None
+        self.encrypted = self.get_setting('encryption_salt') is not None
+        self.encrypted_up_to = 0
+        if self.encrypted:
+            # Overwrite freed pages so deleted text does not linger in the file
+            self.conn.execute('PRAGMA secure_delete = ON')
+        self.has_search_index = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'entries_fts'"
+        ).fetchone() is not None
+        self.device_id = self.get_setting('device_id')
+        self.clock_floor = int(self.get_setting('clock_floor', 0))
+    
+    def upgrade_schema(self):
+        # Each step runs once, in order; PRAGMA user_version records how
+        # many have been applied to this database file.
+        migrations = [
+            self.create_date_index,
+            self.create_search_index,
+            self.add_preview_columns,
+            self.add_timestamp_columns,
+            self.create_drafts_table,
+            self.add_body_compression,
+            self.create_daily_stats,
+            self.create_tags_tables,
+            self.exclude_encrypted_from_search,
+            self.create_revisions_table,
+            self.create_attachment_tables,
+            self.create_change_log,
+            self.index_without_functions,
+            self.guard_indexed_rows,
+        ]
+        version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+        for number, migrate in enumerate(migrations[version:], version + 1):
+            with self.conn:
+                self.conn.execute('BEGIN')
+                migrate()
+                self.conn.execute('PRAGMA user_version = {}'.format(number))
+    
+    def create_date_index(self):
+        self.conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_diary_entries_date '
+            'ON diary_entries (date DESC, id DESC)'
+        )
+    
+    def create_search_index(self):
+        # External-content FTS5 table: the text lives only in diary_entries
+        # and the triggers below keep the index in step with it.
+        try:
+            self.conn.execute('''
+                CREATE VIRTUAL TABLE entries_fts USING fts5(
+                    title,
+                    content,
+                    content='diary_entries',
+                    content_rowid='id',
+                    tokenize='unicode61',
+                    prefix='2 3'
+                )
+            ''')
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5; search_entries falls back to LIKE
+            return
+        self.conn.execute('''
+            CREATE TRIGGER diary_entries_fts_insert AFTER INSERT ON diary_entries BEGIN
+                INSERT INTO entries_fts (rowid, title, content)
+                VALUES (new.id, new.title, new.content);
+            END
+        ''')
+        self.conn.execute('''
+            CREATE TRIGGER diary_entries_fts_delete AFTER DELETE ON diary_entries BEGIN
+                INSERT INTO entries_fts (entries_fts, rowid, title, content)
+                VALUES ('delete', old.id, old.title, old.content);
+            END
+        ''')
+        self.conn.execute('''
+            CREATE TRIGGER diary_entries_fts_update AFTER UPDATE OF title, content ON diary_entries BEGIN
+                INSERT INTO entries_fts (entries_fts, rowid, title, content)
+                VALUES ('delete', old.id, old.title, old.content);
+                INSERT INTO entries_fts (rowid, title, content)
+                VALUES (new.id, new.title, new.content);
+            END
+        ''')
+        self.conn.execute("INSERT INTO entries_fts (entries_fts) VALUES ('rebuild')")
+    
+    def add_preview_columns(self):
+        # The list only needs a short preview and a word count, so keep them
+        # next to the row instead of reading every full body to cut it down.
+        self.conn.execute("ALTER TABLE diary_entries ADD COLUMN preview TEXT NOT NULL DEFAULT ''")
+        self.conn.execute('ALTER TABLE diary_entries ADD COLUMN word_count INTEGER NOT NULL DEFAULT 0')
+        self.conn.execute(
+            'UPDATE diary_entries SET preview = make_preview(content), word_count = count_words(content)'
+        )
+    
+    def add_timestamp_columns(self):
+        # Order and page by integer epoch seconds instead of ISO text. The
+        # offset keeps the wall-clock time the entry was written at, and the
+        # date column is still filled in for older readers of the file.
+        self.conn.execute('ALTER TABLE diary_entries ADD COLUMN created_at INTEGER NOT NULL DEFAULT 0')
+        self.conn.execute('ALTER TABLE diary_entries ADD COLUMN utc_offset INTEGER NOT NULL DEFAULT 0')
+        self.conn.execute(
+            'UPDATE diary_entries SET created_at = iso_to_timestamp(date), '
+            'utc_offset = iso_to_utc_offset(date)'
+        )
+        self.conn.execute('DROP INDEX IF EXISTS idx_diary_entries_date')
+        self.conn.execute(
+            'CREATE INDEX idx_diary_entries_created_at '
+            'ON diary_entries (created_at DESC, id DESC)'
+        )
+    
+    def create_drafts_table(self):
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS drafts (
+                entry_id INTEGER PRIMARY KEY,
+                title TEXT NOT NULL,
+                content TEXT NOT NULL,
+                updated_at INTEGER NOT NULL
+            )
+        ''')
+    
+    def add_body_compression(self):
+        # Bodies above the compress_threshold setting may be stored as zlib
+        # BLOBs, marked in content_flags. Full-text search reads them through
+        # a view that undoes the compression, so the index itself is rebuilt
+        # against that view; previews and word counts stay plain.
+        self.conn.execute('ALTER TABLE diary_entries ADD COLUMN content_flags INTEGER NOT NULL DEFAULT 0')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS settings (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            )
+        ''')
+        self.conn.execute('''
+            CREATE VIEW diary_entries_text AS
+            SELECT id, title, entry_body(content, content_flags) AS content FROM diary_entries
+        ''')
+        if self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'entries_fts'"
+        ).fetchone() is None:
+            return
+        
+        self.conn.execute('DROP TRIGGER diary_entries_fts_insert')
+        self.conn.execute('DROP TRIGGER diary_entries_fts_delete')
+        self.conn.execute('DROP TRIGGER diary_entries_fts_update')
+        self.conn.execute('DROP TABLE entries_fts')
+        self.conn.execute('''
+            CREATE VIRTUAL TABLE entries_fts USING fts5(
+                title,
+                content,
+                content='diary_entries_text',
+                content_rowid='id',
+                tokenize='unicode61',
+                prefix='2 3'
+            )
+        ''')
+        self.conn.execute('''
+            CREATE TRIGGER diary_entries_fts_insert AFTER INSERT ON diary_entries BEGIN
+                INSERT INTO entries_fts (rowid, title, content)
+                VALUES (new.id, new.title, entry_body(new.content, new.content_flags));
+            END
+        ''')
+        self.conn.execute('''
+            CREATE TRIGGER diary_entries_fts_delete AFTER DELETE ON diary_entries BEGIN
+                INSERT INTO entries_fts (entries_fts, rowid, title, content)
+                VALUES ('delete', old.id, old.title, entry_body(old.content, old.content_flags));
+            END
+        ''')
+        # Compressing a row in place leaves its text, and so the index, alone
+        self.conn.execute('''
+            CREATE TRIGGER diary_entries_fts_update AFTER UPDATE OF title, content ON diary_entries
+            WHEN old.title IS NOT new.title
+                OR entry_body(old.content, old.content_flags) IS NOT entry_body(new.content, new.content_flags)
+            BEGIN
+                INSERT INTO entries_fts (entries_fts, rowid, title, content)
+                VALUES ('delete', old.id, old.title, entry_body(old.content, old.content_flags));
+                INSERT INTO entries_fts (rowid, title, content)
+                VALUES (new.id, new.title, entry_body(new.content, new.content_flags));
+            END
+        ''')
+        self.conn.execute("INSERT INTO entries_fts (entries_fts) VALUES ('rebuild')")
+    
+    def create_daily_stats(self):
+        # One row per local day with entries, kept current by triggers, so
+        # calendars and streaks read a few hundred rows at most instead of
+        # scanning every entry.
+        self.conn.execute('''
+            CREATE TABLE daily_stats (
+                day TEXT PRIMARY KEY,
+                entry_count INTEGER NOT NULL,
+                word_count INTEGER NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        new_day = LOCAL_DAY.format('new.')
+        old_day = LOCAL_DAY.format('old.')
+        self.conn.execute('''
+            CREATE TRIGGER diary_entries_stats_insert AFTER INSERT ON diary_entries BEGIN
+                INSERT OR IGNORE INTO daily_stats (day, entry_count, word_count)
+                VALUES ({new_day}, 0, 0);
+                UPDATE daily_stats
+                SET entry_count = entry_count + 1, word_count = word_count + new.word_count
+                WHERE day = {new_day};
+            END
+        '''.format(new_day=new_day))
+        self.conn.execute('''
+            CREATE TRIGGER diary_entries_stats_delete AFTER DELETE ON diary_entries BEGIN
+                UPDATE daily_stats
+                SET entry_count = entry_count - 1, word_count = word_count - old.word_count
+                WHERE day = {old_day};
+                DELETE FROM daily_stats WHERE day = {old_day} AND entry_count <= 0;
+            END
+        '''.format(old_day=old_day))
+        self.conn.execute('''
+            CREATE TRIGGER diary_entries_stats_update
+            AFTER UPDATE OF created_at, utc_offset, word_count ON diary_entries BEGIN
+                UPDATE daily_stats
+                SET entry_count = entry_count - 1, word_count = word_count - old.word_count
+                WHERE day = {old_day};
+                DELETE FROM daily_stats WHERE day = {old_day} AND entry_count <= 0;
+                INSERT OR IGNORE INTO daily_stats (day, entry_count, word_count)
+                VALUES ({new_day}, 0, 0);
+                UPDATE daily_stats
+                SET entry_count = entry_count + 1, word_count = word_count + new.word_count
+                WHERE day = {new_day};
+            END
+        '''.format(old_day=old_day, new_day=new_day))
+        self.conn.execute(
+            'CREATE INDEX idx_diary_entries_month_day ON diary_entries ({}, created_at)'.format(
+                LOCAL_MONTH_DAY.format('')
+            )
+        )
+        self.fill_daily_stats()
+    
+    def fill_daily_stats(self):
+        self.conn.execute(
+            'INSERT INTO daily_stats (day, entry_count, word_count) '
+            'SELECT {0}, count(*), sum(word_count) FROM diary_entries GROUP BY {0}'.format(
+                LOCAL_DAY.format('')
+            )
+        )
+    
+    def create_tags_tables(self):
+        # Tags are stored once and linked to entries through entry_tags,
+        # indexed both ways: (entry_id, tag_id) for an entry's tags and
+        # (tag_id, entry_id) for a tag's entries. Triggers keep entry_count
+        # current so the tag picker never counts links.
+        self.conn.execute('''
+            CREATE TABLE tags (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL UNIQUE COLLATE NOCASE,
+                entry_count INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        self.conn.execute('''
+            CREATE TABLE entry_tags (
+                entry_id INTEGER NOT NULL,
+                tag_id INTEGER NOT NULL,
+                PRIMARY KEY (entry_id, tag_id)
+            ) WITHOUT ROWID
+        ''')
+        self.conn.execute('CREATE INDEX idx_entry_tags_tag ON entry_tags (tag_id, entry_id)')
+        self.conn.execute('''
+            CREATE TRIGGER entry_tags_insert AFTER INSERT ON entry_tags BEGIN
+                UPDATE tags SET entry_count = entry_count + 1 WHERE id = new.tag_id;
+            END
+        ''')
+        self.conn.execute('''
+            CREATE TRIGGER entry_tags_delete AFTER DELETE ON entry_tags BEGIN
+                UPDATE tags SET entry_count = entry_count - 1 WHERE id = old.tag_id;
+            END
+        ''')
+        self.conn.execute('''
+            CREATE TRIGGER diary_entries_tags_delete AFTER DELETE ON diary_entries BEGIN
+                DELETE FROM entry_tags WHERE entry_id = old.id;
+            END
+        ''')
+    
+    def exclude_encrypted_from_search(self):
+        # Encrypted rows must never reach the full-text index, which would
+        # hold their words in plain text. The index view and triggers skip
+        # them; encrypting a row removes it from the index.
+        if self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'entries_fts'"
+        ).fetchone() is None:
+            return
+        self.conn.execute('DROP VIEW diary_entries_text')
+        self.conn.execute('''
+            CREATE VIEW diary_entries_text AS
+            SELECT id, title, entry_body(content, content_flags) AS content FROM diary_entries
+            WHERE content_flags & {0} = 0
+        '''.format(BODY_ENCRYPTED))
+        self.conn.execute('DROP TRIGGER diary_entries_fts_insert')
+        self.conn.execute('DROP TRIGGER diary_entries_fts_delete')
+        self.conn.execute('DROP TRIGGER diary_entries_fts_update')
+        self.conn.execute('''
+            CREATE TRIGGER diary_entries_fts_insert AFTER INSERT ON diary_entries
+            WHEN new.content_flags & {0} = 0 BEGIN
+                INSERT INTO entries_fts (rowid, title, content)
+                VALUES (new.id, new.title, entry_body(new.content, new.content_flags));
+            END
+        '''.format(BODY_ENCRYPTED))
+        self.conn.execute('''
+            CREATE TRIGGER diary_entries_fts_delete AFTER DELETE ON diary_entries
+            WHEN old.content_flags & {0} = 0 BEGIN
+                INSERT INTO entries_fts (entries_fts, rowid, title, content)
+                VALUES ('delete', old.id, old.title, entry_body(old.content, old.content_flags));
+            END
+        '''.format(BODY_ENCRYPTED))
+        # The CASE keeps entry_body() away from encrypted values
+        self.conn.execute('''
+            CREATE TRIGGER diary_entries_fts_update
+            AFTER UPDATE OF title, content, content_flags ON diary_entries
+            WHEN CASE
+                WHEN old.content_flags & {0} AND new.content_flags & {0} THEN 0
+                WHEN (old.content_flags | new.content_flags) & {0} THEN 1
+                ELSE old.title IS NOT new.title
+                    OR entry_body(old.content, old.content_flags) IS NOT entry_body(new.content, new.content_flags)
+            END
+            BEGIN
+                INSERT INTO entries_fts (entries_fts, rowid, title, content)
+                SELECT 'delete', old.id, old.title, entry_body(old.content, old.content_flags)
+                WHERE old.content_flags & {0} = 0;
+                INSERT INTO entries_fts (rowid, title, content)
+                SELECT new.id, new.title, entry_body(new.content, new.content_flags)
+                WHERE new.content_flags & {0} = 0;
+            END
+        '''.format(BODY_ENCRYPTED))
+    
+    def create_revisions_table(self):
+        # Earlier versions of entries, stored newest to oldest as deltas
+        # against the next newer version, with periodic full snapshots.
+        # replaced_at is when a version was overwritten; data is encoded as
+        # described in diary.revisions, flags as content_flags.
+        self.conn.execute('''
+            CREATE TABLE entry_revisions (
+                entry_id INTEGER NOT NULL,
+                revision INTEGER NOT NULL,
+                replaced_at INTEGER NOT NULL,
+                title TEXT NOT NULL,
+                word_count INTEGER NOT NULL,
+                kind INTEGER NOT NULL,
+                flags INTEGER NOT NULL DEFAULT 0,
+                data BLOB NOT NULL,
+                PRIMARY KEY (entry_id, revision)
+            ) WITHOUT ROWID
+        ''')
+        self.conn.execute('''
+            CREATE TRIGGER diary_entries_revisions_delete AFTER DELETE ON diary_entries BEGIN
+                DELETE FROM entry_revisions WHERE entry_id = old.id;
+            END
+        ''')
+    
+    def create_attachment_tables(self):
+        # Attached files live in an AttachmentStore next to the database;
+        # rows only name them (content hash plus extension). cover repeats
+        # the first attachment of an entry so list pages need no join.
+        self.conn.execute('''
+            CREATE TABLE attachments (
+                name TEXT PRIMARY KEY,
+                size INTEGER NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        self.conn.execute('''
+            CREATE TABLE entry_attachments (
+                entry_id INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                PRIMARY KEY (entry_id, position)
+            ) WITHOUT ROWID
+        ''')
+        self.conn.execute('CREATE INDEX idx_entry_attachments_name ON entry_attachments (name)')
+        self.conn.execute('ALTER TABLE diary_entries ADD COLUMN cover TEXT')
+        self.conn.execute('''
+            CREATE TRIGGER diary_entries_attachments_delete AFTER DELETE ON diary_entries BEGIN
+                DELETE FROM entry_attachments WHERE entry_id = old.id;
+            END
+        ''')
+    
+    def create_change_log(self):
+        # Sync identifies entries by a random uid, since ids are only local.
+        # change_log keeps the newest change of every entry ever written
+        # here, deletes included: seq orders the rows for "everything since",
+        # and (clock, device) decides which of two changes to an entry wins.
+        # sync_peers records how far each other device is known to be.
+        self.conn.execute('ALTER TABLE diary_entries ADD COLUMN uid TEXT')
+        # Existing entries get uids derived from their rows rather than
+        # random ones, so two copies of one diary file that are upgraded
+        # apart agree on them and their first sync pairs the entries up
+        # instead of duplicating every one
+        self.conn.executemany(
+            'UPDATE diary_entries SET uid = ? WHERE id = ?',
+            [(row_uid(*row), row[0]) for row in self.conn.execute(
+                'SELECT id, created_at, title, content FROM diary_entries'
+            ).fetchall()]
+        )
+        self.conn.execute('CREATE UNIQUE INDEX idx_diary_entries_uid ON diary_entries (uid)')
+        self.conn.execute('''
+            CREATE TABLE change_log (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                uid TEXT NOT NULL UNIQUE,
+                op TEXT NOT NULL,
+                clock INTEGER NOT NULL,
+                device TEXT NOT NULL
+            )
+        ''')
+        self.conn.execute('CREATE INDEX idx_change_log_clock ON change_log (clock)')
+        self.conn.execute('''
+            CREATE TABLE sync_peers (
+                device TEXT PRIMARY KEY,
+                received INTEGER NOT NULL,
+                acknowledged INTEGER NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        self.conn.execute(
+            "INSERT OR IGNORE INTO settings (key, value) VALUES ('device_id', ?)",
+            (uuid.uuid4().hex[:16],)
+        )
+        # Entries written before the journal count as one change each
+        self.conn.execute(
+            "INSERT INTO change_log (uid, op, clock, device) "
+            "SELECT uid, 'put', 1, (SELECT value FROM settings WHERE key = 'device_id') "
+            "FROM diary_entries ORDER BY id"
+        )
+    
+    def index_without_functions(self):
+        # The earlier triggers called entry_body(), so any connection
+        # without it (the sqlite3 shell, a DB browser) failed to write
+        if self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'entries_fts'"
+        ).fetchone() is None:
+            return
+        self.conn.execute('DROP TRIGGER diary_entries_fts_insert')
+        self.conn.execute('DROP TRIGGER diary_entries_fts_delete')
+        self.conn.execute('DROP TRIGGER diary_entries_fts_update')
+        self.conn.execute(FTS_INSERT_TRIGGER)
+        self.conn.execute(FTS_DELETE_TRIGGER)
+        self.conn.execute(FTS_UPDATE_TRIGGER)
+    
+    def guard_indexed_rows(self):
+        if self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'entries_fts'"
+        ).fetchone() is None:
+            return
+        for trigger in FTS_GUARD_TRIGGERS:
+            self.conn.execute(trigger.format(FTS_GUARD_CONDITION, FTS_GUARD_MESSAGE))
+    
+    def rebuild_daily_stats(self):
+        # Recount everything, should daily_stats ever drift from the entries
+        with self.conn:
+            self.conn.execute('DELETE FROM daily_stats')
+            self.fill_daily_stats()
+    
+    def get_month_stats(self, year, month):
+        # [(day 'YYYY-MM-DD', entry_count, word_count)] for the days of the
+        # month that have entries
+        prefix = '{:04d}-{:02d}-'.format(year, month)
+        cursor = self.conn.execute(
+            'SELECT day, entry_count, word_count FROM daily_stats '
+            'WHERE day >= ? AND day <= ? ORDER BY day',
+            (prefix + '01', prefix + '31')
+        )
+        return cursor.fetchall()
+    
+    def get_year_stats(self, year):
+        # [(month 'YYYY-MM', entry_count, word_count)] from at most 366 rows
+        cursor = self.conn.execute(
+            'SELECT substr(day, 1, 7), sum(entry_count), sum(word_count) FROM daily_stats '
+            'WHERE day >= ? AND day <= ? GROUP BY substr(day, 1, 7) ORDER BY 1',
+            ('{:04d}-01-01'.format(year), '{:04d}-12-31'.format(year))
+        )
+        return cursor.fetchall()
+    
+    def get_writing_stats(self, today=None):
+        # Totals and streaks (consecutive local days with at least one
+        # entry). The current streak counts if the last entry was written
+        # today or yesterday.
+        today = today or date.today()
+        totals = {
+            'entries': 0,
+            'words': 0,
+            'days': 0,
+            'current_streak': 0,
+            'longest_streak': 0,
+        }
+        previous = None
+        streak = 0
+        for (day,) in self.conn.execute('SELECT day FROM daily_stats ORDER BY day'):
+            day = date.fromisoformat(day)
+            streak = streak + 1 if previous is not None and day - previous == timedelta(days=1) else 1
+            totals['longest_streak'] = max(totals['longest_streak'], streak)
+            previous = day
+        if previous is not None and today - previous <= timedelta(days=1):
+            totals['current_streak'] = streak
+        
+        row = self.conn.execute(
+            'SELECT count(*), total(entry_count), total(word_count) FROM daily_stats'
+        ).fetchone()
+        totals['days'], totals['entries'], totals['words'] = row[0], int(row[1]), int(row[2])
+        return totals
+    
+    def get_entries_on_this_day(self, month, day, before_year, limit=20):
+        # Summary entries written on month/day in years before before_year,
+        # newest first, found through the month-day index
+        cursor = self.query_entries(
+            'SELECT ' + SUMMARY_COLUMNS + ' FROM diary_entries '
+            'WHERE {} = ? AND created_at < ? ORDER BY created_at DESC LIMIT ?'.format(
+                LOCAL_MONTH_DAY.format('')
+            ),
+            ('{:02d}-{:02d}'.format(month, day),
+             int(time.mktime((before_year, 1, 1, 0, 0, 0, 0, 0, -1))), limit)
+        )
+        return cursor.fetchall()
+    
+    def get_setting(self, key, default=None):
+        row = self.conn.execute('SELECT value FROM settings WHERE key = ?', (key,)).fetchone()
+        return default if row is None else row[0]
+    
+    def set_setting(self, key, value):
+        with self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)', (key, str(value))
+            )
+    
+    def set_compress_threshold(self, threshold):
+        # Bodies of at least threshold UTF-8 bytes are stored compressed from
+        # now on; 0 turns compression off. Existing rows are left as they
+        # are until compress_entries() reaches them.
+        self.set_setting('compress_threshold', threshold)
+        self.compress_threshold = threshold
+    
+    def compress_entries(self, limit=100):
+        # Compresses up to limit stored-as-text bodies that are over the
+        # threshold, in one transaction; returns how many rows it looked at
+        # so callers can repeat until it returns 0.
+        if not self.compress_threshold:
+            return 0
+        rows = self.conn.execute(
+            'SELECT id, title, content FROM diary_entries '
+            'WHERE content_flags = 0 AND id > ? AND length(CAST(content AS BLOB)) >= ? '
+            'ORDER BY id LIMIT ?',
+            (self.compressed_up_to, self.compress_threshold, limit)
+        ).fetchall()
+        updates = []
+        for entry_id, title, content in rows:
+            stored, flags = encode_body(content, self.compress_threshold)
+            if flags:
+                updates.append((stored, flags, entry_id))
+        with self.conn:
+            self.conn.executemany(
+                'UPDATE diary_entries SET content = ?, content_flags = ? WHERE id = ?', updates
+            )
+            # The trigger took the rows out of the index as plain text
+            compressed = set(entry_id for stored, flags, entry_id in updates)
+            for entry_id, title, content in rows:
+                if entry_id in compressed:
+                    self.index_compressed(entry_id, title, content, BODY_ZLIB)
+        if rows:
+            # Rows that did not shrink stay plain; do not look at them again
+            self.compressed_up_to = rows[-1][0]
+        return len(rows)
+    
+    def is_locked(self):
+        return self.encrypted and self.cipher is None
+    
+    def unlock(self, passphrase):
+        # Derives the key once and keeps it for the life of this manager;
+        # returns False for a wrong passphrase.
+        n, r, p = (int(value) for value in self.get_setting('encryption_kdf').split(':')[1:])
+        cipher = EntryCipher.from_passphrase(
+            passphrase, bytes.fromhex(self.get_setting('encryption_salt')), n, r, p
+        )
+        try:
+            cipher.decrypt(bytes.fromhex(self.get_setting('encryption_check')), b'check')
+        except ValueError:
+            return False
+        if self.get_setting('encryption_binding') != 'row':
+            self.bind_to_rows(cipher)
+        self.cipher = cipher
+        return True
+    
+    def bind_to_rows(self, cipher):
+        # Diaries encrypted before values were bound to their rows used the
+        # field name alone as associated data; everything encrypted is
+        # sealed again with its row, once, on the first unlock
+        def rebind(blob, field, *keys):
+            return cipher.encrypt(cipher.decrypt(blob, field), row_field(field, *keys))
+        
+        with self.conn:
+            rows = self.conn.execute(
+                'SELECT id, title, preview, content FROM diary_entries WHERE content_flags & ?',
+                (BODY_ENCRYPTED,)
+            ).fetchall()
+            self.conn.executemany(
+                'UPDATE diary_entries SET title = ?, preview = ?, content = ? WHERE id = ?',
+                [(rebind(title, b'title', entry_id), rebind(preview, b'preview', entry_id),
+                  rebind(content, b'content', entry_id), entry_id)
+                 for entry_id, title, preview, content in rows]
+            )
+            drafts = self.conn.execute(
+                "SELECT entry_id, title, content FROM drafts WHERE typeof(title) = 'blob'"
+            ).fetchall()
+            self.conn.executemany(
+                'UPDATE drafts SET title = ?, content = ? WHERE entry_id = ?',
+                [(rebind(title, b'draft title', entry_id),
+                  rebind(content, b'draft content', entry_id), entry_id)
+                 for entry_id, title, content in drafts]
+            )
+            revisions = self.conn.execute(
+                'SELECT entry_id, revision, title, data FROM entry_revisions WHERE flags & ?',
+                (BODY_ENCRYPTED,)
+            ).fetchall()
+            self.conn.executemany(
+                'UPDATE entry_revisions SET title = ?, data = ? WHERE entry_id = ? AND revision = ?',
+                [(rebind(title, b'revision title', entry_id, revision),
+                  rebind(data, b'revision', entry_id, revision), entry_id, revision)
+                 for entry_id, revision, title, data in revisions]
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO settings (key, value) VALUES ('encryption_binding', 'row')"
+            )
+    
+    def enable_encryption(self, passphrase):
+        # New writes are encrypted from now on; existing rows and drafts
+        # are encrypted by encrypt_entries(). There is no way back and no
+        # way to recover a forgotten passphrase.
+        if self.encrypted:
+            raise ValueError('this diary is already encrypted')
+        salt = os.urandom(SALT_LENGTH)
+        cipher = EntryCipher.from_passphrase(passphrase, salt, KDF_N, KDF_R, KDF_P)
+        with self.conn:
+            for key, value in (
+                ('encryption_kdf', 'scrypt:{}:{}:{}'.format(KDF_N, KDF_R, KDF_P)),
+                ('encryption_salt', salt.hex()),
+                ('encryption_check', cipher.encrypt(CHECK_TEXT, b'check').hex()),
+                ('encryption_binding', 'row'),
+                ('purge_pending', '1'),
+            ):
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)', (key, value)
+                )
+        self.cipher = cipher
+        self.encrypted = True
+        self.conn.execute('PRAGMA secure_delete = ON')
+    
+    def encrypt_entries(self, limit=100):
+        # Encrypts up to limit plain rows in one transaction, drafts
+        # included; returns how many entries it looked at so callers can
+        # repeat until it returns 0.
+        if not self.encrypted:
+            return 0
+        rows = self.conn.execute(
+            'SELECT id, title, preview, content, content_flags FROM diary_entries '
+            'WHERE content_flags & ? = 0 AND id > ? ORDER BY id LIMIT ?',
+            (BODY_ENCRYPTED, self.encrypted_up_to, limit)
+        ).fetchall()
+        drafts = self.conn.execute(
+            "SELECT entry_id, title, content FROM drafts WHERE typeof(title) = 'text'"
+        ).fetchall()
+        revisions = self.conn.execute(
+            'SELECT entry_id, revision, title, flags, data FROM entry_revisions '
+            'WHERE entry_id > ? AND entry_id <= ? AND flags & ? = 0',
+            (self.encrypted_up_to, rows[-1][0] if rows else self.encrypted_up_to, BODY_ENCRYPTED)
+        ).fetchall()
+        with self.conn:
+            for entry_id, title, preview, content, flags in rows:
+                self.unindex_compressed(entry_id)
+            self.conn.executemany(
+                'UPDATE diary_entries SET title = ?, preview = ?, content = ?, content_flags = ? '
+                'WHERE id = ?',
+                [self.seal_row(title, preview, content, flags, entry_id) + (entry_id,)
+                 for entry_id, title, preview, content, flags in rows]
+            )
+            self.conn.executemany(
+                'UPDATE drafts SET title = ?, content = ? WHERE entry_id = ?',
+                [self.seal_draft(title, content, entry_id) + (entry_id,)
+                 for entry_id, title, content in drafts]
+            )
+            self.conn.executemany(
+                'UPDATE entry_revisions SET title = ?, data = ?, flags = ? '
+                'WHERE entry_id = ? AND revision = ?',
+                [self.seal_revision(title, data, flags, entry_id, revision)
+                 + (entry_id, revision)
+                 for entry_id, revision, title, flags, data in revisions]
+            )
+        if rows:
+            self.encrypted_up_to = rows[-1][0]
+        return len(rows)
+    
+    def purge_plaintext(self):
+        # After encrypt_entries() is done: drop deleted words from the
+        # search index and rewrite the file so no free page keeps old text
+        if self.has_search_index:
+            with self.conn:
+                self.conn.execute("INSERT INTO entries_fts (entries_fts) VALUES ('optimize')")
+        self.conn.execute('VACUUM')
+        self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    
+    def purge_pending(self):
+        # Whether purge_plaintext() and replacing the backups made before
+        # encryption are due: from enable_encryption() until purge_done(),
+        # once every row is encrypted. Kept in the file, so a run stopped
+        # in between, or with nothing to encrypt, is caught up on later.
+        if self.get_setting('purge_pending') is None:
+            return False
+        return self.conn.execute(
+            'SELECT 1 FROM diary_entries WHERE content_flags & ? = 0 LIMIT 1', (BODY_ENCRYPTED,)
+        ).fetchone() is None and self.conn.execute(
+            "SELECT 1 FROM drafts WHERE typeof(title) = 'text' LIMIT 1"
+        ).fetchone() is None
+    
+    def purge_done(self):
+        with self.conn:
+            self.conn.execute("DELETE FROM settings WHERE key = 'purge_pending'")
+    
+    def require_cipher(self):
+        if self.cipher is None:
+            raise DiaryLocked('unlock the diary first')
+        return self.cipher
+    
+    def seal_row(self, title, preview, stored, flags, entry_id):
+        # (title, preview, content, content_flags) as written to the table
+        # for the row entry_id
+        if not self.encrypted:
+            return title, preview, stored, flags
+        cipher = self.require_cipher()
+        if isinstance(stored, str):
+            stored = stored.encode('utf-8')
+        return (cipher.encrypt_text(title, row_field(b'title', entry_id)),
+                cipher.encrypt_text(preview, row_field(b'preview', entry_id)),
+                cipher.encrypt(stored, row_field(b'content', entry_id)), flags | BODY_ENCRYPTED)
+    
+    def seal_draft(self, title, content, entry_id):
+        if not self.encrypted:
+            return title, content
+        cipher = self.require_cipher()
+        return (cipher.encrypt_text(title, row_field(b'draft title', entry_id)),
+                cipher.encrypt_text(content, row_field(b'draft content', entry_id)))
+    
+    def seal_revision(self, title, data, flags, entry_id, revision):
+        if not self.encrypted:
+            return title, data, flags
+        cipher = self.require_cipher()
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        return (cipher.encrypt_text(title, row_field(b'revision title', entry_id, revision)),
+                cipher.encrypt(data, row_field(b'revision', entry_id, revision)),
+                flags | BODY_ENCRYPTED)
+    
+    def open_revision(self, title, data, flags, entry_id, revision):
+        # (title, data, flags) with any encryption undone
+        if not flags & BODY_ENCRYPTED:
+            return title, data, flags
+        cipher = self.require_cipher()
+        title = cipher.decrypt_text(title, row_field(b'revision title', entry_id, revision))
+        data = cipher.decrypt(data, row_field(b'revision', entry_id, revision))
+        flags &= ~BODY_ENCRYPTED
+        return title, data, flags
+    
+    def read_entry(self, cursor, row):
+        # Row factory for encrypted diaries. Titles and previews are
+        # decrypted as each row of a page is fetched; bodies only come with
+        # full entries, and are decompressed later, on first use.
+        entry = entry_factory(cursor, row)
+        if not entry.body_flags & BODY_ENCRYPTED:
+            return entry
+        cipher = self.require_cipher()
+        entry.title = cipher.decrypt_text(entry.title, row_field(b'title', entry.id))
+        entry.preview = cipher.decrypt_text(entry.preview, row_field(b'preview', entry.id))
+        entry.body_flags &= ~BODY_ENCRYPTED
+        if entry.body is not None:
+            entry.body = cipher.decrypt(entry.body, row_field(b'content', entry.id))
+            if not entry.body_flags & BODY_ZLIB:
+                entry.body = entry.body.decode('utf-8')
+        return entry
+    
+    def restore_backup(self, path, allow_unencrypted=False):
+        # Replaces the whole diary with the backup at path once it passes an
+        # integrity check. Listeners are told with change 'restored' and no
+        # entry id; an encrypted backup needs unlocking with its passphrase.
+        # Raises UnencryptedBackup for a backup made before an encrypted
+        # diary was encrypted, unless allow_unencrypted says to go ahead, and
+        # DiaryInUse while another connection, such as the app's, has the
+        # file open: it would go on with the device id, key and caches of
+        # the diary it read before. Returns the names of attachments it refers to that are no longer
+        # on disk.
+        verify_database(path)
+        if self.encrypted and not allow_unencrypted and not backup_encrypted(path):
+            raise UnencryptedBackup(
+                '{} was made before the diary was encrypted; restoring it turns '
+                'encryption off'.format(path)
+            )
+        clock = max(self.clock_floor, self.conn.execute(
+            'SELECT coalesce(max(clock), 0) FROM change_log'
+        ).fetchone()[0])
+        # Every other connection holds a shared lock on a WAL database for as
+        # long as it is open, so the exclusive lock is only granted to the
+        # last one. It is kept until the restored diary is set up.
+        self.conn.execute('PRAGMA locking_mode = EXCLUSIVE')
+        try:
+            try:
+                self.conn.execute('BEGIN EXCLUSIVE')
+                self.conn.commit()
+            except sqlite3.OperationalError:
+                raise DiaryInUse(
+                    '{} is open elsewhere; close the app or other programs using it '
+                    'first'.format(self.db_path)
+                )
+            source = sqlite3.connect(path)
+            try:
+                source.backup(self.conn)
+            finally:
+                source.close()
+            self.cache = EntryCache(self.cache.max_bytes)
+            # Backups made by older versions are upgraded like any diary
+            self.init_database()
+            self.reset_device(clock)
+        finally:
+            self.conn.execute('PRAGMA locking_mode = NORMAL')
+            # The lock is only given up on the next access
+            self.conn.execute('SELECT count(*) FROM sqlite_master').fetchone()
+        self.notify('restored', None)
+        directory = attachments_dir(self.db_path)
+        return [
+            name for (name,) in self.conn.execute('SELECT name FROM attachments ORDER BY name')
+            if not os.path.exists(attachment_path(directory, name))
+        ]
+    
+    def add_listener(self, callback):
+        # callback(change, entry_id) is called after every committed write,
+        # with change being 'added', 'updated' or 'deleted', or 'restored'
+        # with no entry id after restore_backup().
+        self.listeners.append(callback)
+    
+    def remove_listener(self, callback):
+        self.listeners.remove(callback)
+    
+    def notify(self, change, entry_id):
+        for callback in list(self.listeners):
+            callback(change, entry_id)
+    
+    def get_tags(self):
+        # [(id, name, entry_count)] of tags in use, by name
+        cursor = self.conn.execute(
+            'SELECT id, name, entry_count FROM tags WHERE entry_count > 0 ORDER BY name'
+        )
+        return cursor.fetchall()
+    
+    def get_entry_tags(self, entry_id):
+        cursor = self.conn.execute(
+            'SELECT t.name FROM entry_tags et JOIN tags t ON t.id = et.tag_id '
+            'WHERE et.entry_id = ? ORDER BY t.name',
+            (entry_id,)
+        )
+        return [name for (name,) in cursor]
+    
+    def set_entry_tags(self, entry_id, names):
+        # Replaces the tags of an entry; call inside a transaction. Names
+        # match case-insensitively, a new tag keeps the first spelling used.
+        self.conn.executemany(
+            'INSERT OR IGNORE INTO tags (name) VALUES (?)', [(name,) for name in names]
+        )
+        tag_ids = [
+            row[0] for row in self.conn.execute(
+                'SELECT id FROM tags WHERE name IN ({})'.format(', '.join('?' * len(names))),
+                names
+            )
+        ] if names else []
+        self.conn.execute(
+            'DELETE FROM entry_tags WHERE entry_id = ? AND tag_id NOT IN ({})'.format(
+                ', '.join('?' * len(tag_ids))
+            ),
+            [entry_id] + tag_ids
+        )
+        self.conn.executemany(
+            'INSERT OR IGNORE INTO entry_tags (entry_id, tag_id) VALUES (?, ?)',
+            [(entry_id, tag_id) for tag_id in tag_ids]
+        )
+    
+    def get_entry_attachments(self, entry_id):
+        # [(name, size)] in the order they were attached
+        cursor = self.conn.execute(
+            'SELECT a.name, a.size FROM entry_attachments ea JOIN attachments a ON a.name = ea.name '
+            'WHERE ea.entry_id = ? ORDER BY ea.position',
+            (entry_id,)
+        )
+        return cursor.fetchall()
+    
+    def set_entry_attachments(self, entry_id, attachments):
+        # Replaces the attachments of an entry with [(name, size)] as
+        # returned by AttachmentStore.import_file; call inside a transaction.
+        # Returns the new cover.
+        self.conn.executemany(
+            'INSERT OR IGNORE INTO attachments (name, size) VALUES (?, ?)', attachments
+        )
+        self.conn.execute('DELETE FROM entry_attachments WHERE entry_id = ?', (entry_id,))
+        self.conn.executemany(
+            'INSERT INTO entry_attachments (entry_id, position, name) VALUES (?, ?, ?)',
+            [(entry_id, position, name) for position, (name, size) in enumerate(attachments)]
+        )
+        cover = attachments[0][0] if attachments else None
+        self.conn.execute('UPDATE diary_entries SET cover = ? WHERE id = ?', (cover, entry_id))
+        return cover
+    
+    def prune_attachments(self):
+        # Forgets attachments no entry uses any more; returns the names
+        # still in use, for AttachmentStore.keep_only
+        with self.conn:
+            self.conn.execute(
+                'DELETE FROM attachments WHERE name NOT IN (SELECT name FROM entry_attachments)'
+            )
+        return [name for (name,) in self.conn.execute('SELECT name FROM attachments')]
+    
+    def tag_condition(self, column, tag_ids, match_all):
+        # SQL condition on an entry id column and its parameters: tagged
+        # with any of tag_ids, or with all of them. Both read the
+        # (tag_id, entry_id) index only.
+        marks = ', '.join('?' * len(tag_ids))
+        if match_all and len(tag_ids) > 1:
+            return (
+                '{} IN (SELECT entry_id FROM entry_tags WHERE tag_id IN ({}) '
+                'GROUP BY entry_id HAVING count(*) = ?)'.format(column, marks),
+                list(tag_ids) + [len(tag_ids)]
+            )
+        return (
+            '{} IN (SELECT entry_id FROM entry_tags WHERE tag_id IN ({}))'.format(column, marks),
+            list(tag_ids)
+        )
+    
+    def index_compressed(self, entry_id, title, content, flags):
+        # Adds a row just written with content_flags flags to the full-text
+        # index if it is compressed and not encrypted; plain rows are the
+        # triggers' job. Call inside a transaction.
+        if self.has_search_index and flags == BODY_ZLIB:
+            self.conn.execute(
+                'INSERT INTO entries_fts (rowid, title, content) VALUES (?, ?, ?)',
+                (entry_id, title, content)
+            )
+    
+    def unindex_compressed(self, entry_id):
+        # Takes a compressed, unencrypted row out of the index before it is
+        # changed or deleted; 'delete' needs the text that was indexed
+        if not self.has_search_index:
+            return
+        row = self.conn.execute(
+            'SELECT title, content FROM diary_entries WHERE id = ? AND content_flags = ?',
+            (entry_id, BODY_ZLIB)
+        ).fetchone()
+        if row is not None:
+            self.conn.execute(
+                "INSERT INTO entries_fts (entries_fts, rowid, title, content) "
+                "VALUES ('delete', ?, ?, ?)",
+                (entry_id, row[0], entry_body(row[1], BODY_ZLIB))
+            )
+    
+    def add_entry(self, title, content, tags=None, attachments=None):
+        created_at, utc_offset, date = current_timestamp()
+        stored, flags = encode_body(content, self.compress_threshold)
+        preview, word_count = make_preview(content), count_words(content)
+        uid = uuid.uuid4().hex
+        with self.conn:
+            entry_id = self.next_entry_id()
+            row_title, row_preview, row_content, row_flags = self.seal_row(
+                title, preview, stored, flags, entry_id
+            )
+            self.conn.execute(
+                'INSERT INTO diary_entries (id, uid, title, content, content_flags, date, '
+                'created_at, utc_offset, preview, word_count) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (entry_id, uid, row_title, row_content, row_flags, date, created_at, utc_offset,
+                 row_preview, word_count)
+            )
+            self.record_changes([uid], 'put')
+            self.index_compressed(entry_id, title, content, row_flags)
+            if tags:
+                self.set_entry_tags(entry_id, tags)
+            cover = self.set_entry_attachments(entry_id, attachments) if attachments else None
+        # A new entry is usually opened again right away
+        self.cache.put(Entry(entry_id, title, preview, created_at, utc_offset,
+                             word_count, stored, flags, cover))
+        self.notify('added', entry_id)
+        return entry_id
+    
+    def next_entry_id(self):
+        # The id AUTOINCREMENT would give the next entry. Encrypted values
+        # are bound to their row id, so inserts take it up front.
+        return self.conn.execute(
+            "SELECT max(coalesce((SELECT seq FROM sqlite_sequence WHERE name = 'diary_entries'), 0), "
+            "coalesce((SELECT max(id) FROM diary_entries), 0)) + 1"
+        ).fetchone()[0]
+    
+    def query_entries(self, sql, parameters=()):
+        # Cursor whose rows come back as Entry objects, decrypted if need be
+        cursor = self.conn.cursor()
+        cursor.row_factory = self.read_entry if self.encrypted else entry_factory
+        return cursor.execute(sql, parameters)
+    
+    def iter_entries(self, batch_size=500):
+        # Streams every full Entry, oldest first, holding at most batch_size
+        # rows in memory.
+        cursor = self.query_entries(
+            'SELECT ' + ENTRY_COLUMNS + ' FROM diary_entries ORDER BY created_at, id'
+        )
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield from rows
+    
+    def import_entries(self, entries, batch_size=1000, progress=None):
+        # entries is any iterable of (title, content, created_at, utc_offset);
+        # created_at may be None for "now". Rows are inserted batch_size at a
+        # time, one transaction per batch, and progress(count) is called
+        # after each commit. Returns the number of entries imported.
+        now, now_offset, now_date = current_timestamp()
+        
+        def prepare(entry):
+            title, content, created_at, utc_offset = entry
+            if created_at is None:
+                created_at, utc_offset, date = now, now_offset, now_date
+            else:
+                utc_offset = utc_offset or 0
+                date = timestamp_to_iso(created_at, utc_offset)
+            stored, flags = encode_body(content, self.compress_threshold)
+            return (uuid.uuid4().hex, title, make_preview(content), stored, flags, date, created_at,
+                    utc_offset, count_words(content))
+        
+        def seal(entry_id, row):
+            uid, title, preview, stored, flags, date, created_at, utc_offset, word_count = row
+            title, preview, stored, flags = self.seal_row(title, preview, stored, flags, entry_id)
+            return (entry_id, uid, title, stored, flags, date, created_at, utc_offset, preview,
+                    word_count)
+        
+        rows = (prepare(entry) for entry in entries)
+        imported = 0
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            with self.conn:
+                last_id = self.next_entry_id() - 1
+                if self.has_search_index:
+                    # Indexing row by row from the trigger costs several times
+                    # the inserts themselves; the batch is indexed at once below
+                    self.conn.execute('DROP TRIGGER diary_entries_fts_insert')
+                self.conn.executemany(
+                    'INSERT INTO diary_entries (id, uid, title, content, content_flags, date, '
+                    'created_at, utc_offset, preview, word_count) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    [seal(entry_id, row) for entry_id, row in enumerate(batch, last_id + 1)]
+                )
+                self.record_changes([row[0] for row in batch], 'put')
+                if self.has_search_index:
+                    # AUTOINCREMENT ids only grow, so the batch is every id
+                    # past last_id; the view leaves out encrypted rows
+                    self.conn.execute(
+                        'INSERT INTO entries_fts (rowid, title, content) '
+                        'SELECT id, title, content FROM diary_entries_text WHERE id > ?',
+                        (last_id,)
+                    )
+                    self.conn.execute(FTS_INSERT_TRIGGER)
+            imported += len(batch)
+            if progress is not None:
+                progress(imported)
+        return imported
+    
+    def get_all_entries(self):
+        cursor = self.query_entries(
+            'SELECT ' + ENTRY_COLUMNS + ' FROM diary_entries ORDER BY created_at DESC, id DESC'
+        )
+        return cursor.fetchall()
+    
+    def get_entry(self, entry_id):
+        # Full Entry, or None. The body is decompressed only when its
+        # content is first read, never for list pages. Each call returns an
+        # Entry of its own.
+        entry = self.cache.get(entry_id)
+        if entry is not None:
+            return entry
+        cursor = self.query_entries(
+            'SELECT ' + ENTRY_COLUMNS + ' FROM diary_entries WHERE id = ?',
+            (entry_id,)
+        )
+        entry = cursor.fetchone()
+        if entry is not None:
+            self.cache.put(entry)
+        return entry
+    
+    def cache_stats(self):
+        return self.cache.stats()
+    
+    def get_entry_summary(self, entry_id):
+        # Same fields as an Entry of get_entries_page
+        cursor = self.query_entries(
+            'SELECT ' + SUMMARY_COLUMNS + ' FROM diary_entries WHERE id = ?',
+            (entry_id,)
+        )
+        return cursor.fetchone()
+    
+    def get_entries_page(self, before_time=None, before_id=None, limit=50,
+                         tag_ids=None, match_all=False):
+        # Keyset pagination: pass the created_at and id of the last entry of
+        # the previous page to continue from there without an OFFSET scan.
+        # Entries carry the preview and word count; bodies stay on disk.
+        # tag_ids limits the page to entries with any (or, with match_all,
+        # every one) of those tags.
+        conditions = []
+        parameters = []
+        if before_time is not None:
+            conditions.append('created_at <= ? AND (created_at < ? OR id < ?)')
+            parameters += [before_time, before_time, before_id]
+        if tag_ids:
+            condition, tag_parameters = self.tag_condition('id', tag_ids, match_all)
+            conditions.append(condition)
+            parameters += tag_parameters
+        where = 'WHERE ' + ' AND '.join(conditions) + ' ' if conditions else ''
+        cursor = self.query_entries(
+            'SELECT ' + SUMMARY_COLUMNS + ' '
+            'FROM diary_entries ' + where + 'ORDER BY created_at DESC, id DESC LIMIT ?',
+            parameters + [limit]
+        )
+        return cursor.fetchall()
+    
+    def search_entries(self, query, limit=20, offset=0, tag_ids=None, match_all=False):
+        # Returns entries shaped like get_entries_page, best match first,
+        # with a snippet in place of the preview. Matched words are wrapped
+        # in MATCH_START/MATCH_END in title and snippet.
+        words = re.findall(r'\w+', query)
+        if not words:
+            return []
+        if self.encrypted:
+            return self.scan_entries(words, limit, offset, tag_ids, match_all)
+        tag_filter, tag_parameters = '', []
+        
+        if not self.has_search_index:
+            if tag_ids:
+                tag_filter, tag_parameters = self.tag_condition('id', tag_ids, match_all)
+                tag_filter = 'AND ' + tag_filter + ' '
+            pattern = '%{}%'.format(' '.join(words))
+            cursor = self.query_entries(
+                'SELECT ' + SUMMARY_COLUMNS + ' '
+                'FROM diary_entries '
+                'WHERE (title LIKE ? OR entry_body(content, content_flags) LIKE ?) ' + tag_filter +
+                'ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?',
+                [pattern, pattern] + tag_parameters + [limit, offset]
+            )
+            return cursor.fetchall()
+        
+        if tag_ids:
+            tag_filter, tag_parameters = self.tag_condition('d.id', tag_ids, match_all)
+            tag_filter = 'AND ' + tag_filter + ' '
+        
+        # Every word must match, each as a prefix of an indexed token
+        match = ' '.join('"{}"*'.format(word) for word in words)
+        cursor = self.query_entries(
+            'SELECT d.id AS id, '
+            'highlight(entries_fts, 0, ?, ?) AS title, '
+            "snippet(entries_fts, 1, ?, ?, '...', 16) AS preview, "
+            'd.created_at AS created_at, d.utc_offset AS utc_offset, d.word_count AS word_count, '
+            'd.cover AS cover '
+            'FROM entries_fts JOIN diary_entries d ON d.id = entries_fts.rowid '
+            'WHERE entries_fts MATCH ? ' + tag_filter +
+            'ORDER BY bm25(entries_fts, 10.0, 1.0) LIMIT ? OFFSET ?',
+            [MATCH_START, MATCH_END, MATCH_START, MATCH_END, match] + tag_parameters + [limit, offset]
+        )
+        return cursor.fetchall()
+    
+    def scan_entries(self, words, limit, offset, tag_ids, match_all):
+        # Search for encrypted diaries, which have no index: decrypt entries
+        # newest first and keep those where every word starts a word of the
+        # title or body. Costs a pass over the diary per page of results.
+        patterns = [re.compile(r'\b' + re.escape(word), re.IGNORECASE) for word in words]
+        highlight = re.compile(
+            '|'.join(r'\b' + re.escape(word) + r'\w*' for word in words), re.IGNORECASE
+        )
+        
+        def mark(text):
+            return highlight.sub(lambda match: MATCH_START + match.group() + MATCH_END, text)
+        
+        where, parameters = '', []
+        if tag_ids:
+            where, parameters = self.tag_condition('id', tag_ids, match_all)
+            where = 'WHERE ' + where + ' '
+        cursor = self.query_entries(
+            'SELECT ' + ENTRY_COLUMNS + ' FROM diary_entries ' + where +
+            'ORDER BY created_at DESC, id DESC',
+            parameters
+        )
+        results = []
+        for entry in cursor:
+            content = entry.content
+            if not all(pattern.search(entry.title) or pattern.search(content) for pattern in patterns):
+                continue
+            if offset:
+                offset -= 1
+                continue
+            match = highlight.search(content)
+            start = max(0, match.start() - 30) if match else 0
+            snippet = ('...' if start else '') + make_preview(content[start:])
+            results.append(Entry(entry.id, mark(entry.title), mark(snippet), entry.created_at,
+                                 entry.utc_offset, entry.word_count, cover=entry.cover))
+            if len(results) == limit:
+                break
+        return results
+    
+    def update_entry(self, entry_id, title, content, tags=None, attachments=None):
+        # tags or attachments left as None are not changed. The version
+        # being replaced is kept in entry_revisions.
+        previous = self.get_entry(entry_id)
+        stored, flags = encode_body(content, self.compress_threshold)
+        preview, word_count = make_preview(content), count_words(content)
+        row_title, row_preview, row_content, row_flags = self.seal_row(
+            title, preview, stored, flags, entry_id
+        )
+        with self.conn:
+            if previous is not None and (previous.title, previous.content) != (title, content):
+                self.add_revision(previous, content)
+            self.unindex_compressed(entry_id)
+            self.conn.execute(
+                'UPDATE diary_entries SET title = ?, content = ?, content_flags = ?, '
+                'preview = ?, word_count = ? WHERE id = ?',
+                (row_title, row_content, row_flags, row_preview, word_count, entry_id)
+            )
+            self.index_compressed(entry_id, title, content, row_flags)
+            self.record_changes(self.entry_uids([entry_id]), 'put')
+            if tags is not None:
+                self.set_entry_tags(entry_id, tags)
+            if attachments is not None:
+                cover = self.set_entry_attachments(entry_id, attachments)
+        # Write through: screens may still hold the old Entry, so the cached
+        # one is replaced rather than changed in place
+        cached = self.cache.peek(entry_id)
+        if cached is not None:
+            if attachments is None:
+                cover = cached.cover
+            self.cache.put(Entry(entry_id, title, preview, cached.created_at, cached.utc_offset,
+                                 word_count, stored, flags, cover))
+        self.notify('updated', entry_id)
+    
+    def add_revision(self, previous, content):
+        # Stores the Entry about to be replaced by content, as a delta from
+        # content unless a snapshot is due or would be smaller
+        revision = self.conn.execute(
+            'SELECT coalesce(max(revision), 0) + 1 FROM entry_revisions WHERE entry_id = ?',
+            (previous.id,)
+        ).fetchone()[0]
+        data, flags = encode_body(previous.content, 1)
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        kind = REVISION_SNAPSHOT
+        if revision % SNAPSHOT_INTERVAL:
+            delta = make_delta(previous.content, content)
+            if len(delta) < len(data):
+                data, flags, kind = delta, 0, REVISION_DELTA
+        title, data, flags = self.seal_revision(previous.title, data, flags, previous.id, revision)
+        self.conn.execute(
+            'INSERT INTO entry_revisions '
+            '(entry_id, revision, replaced_at, title, word_count, kind, flags, data) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (previous.id, revision, int(time.time()), title, previous.word_count, kind, flags, data)
+        )
+    
+    def get_revisions(self, entry_id):
+        # [(revision, saved_at, title, word_count, stored bytes)] of the
+        # earlier versions of an entry, newest first, read without
+        # rebuilding any text. A version was saved when the one before it
+        # was replaced, or when the entry was created.
+        entry = self.get_entry_summary(entry_id)
+        if entry is None:
+            return []
+        revisions = []
+        saved_at = entry.created_at
+        for revision, replaced_at, title, word_count, flags, size in self.conn.execute(
+            'SELECT revision, replaced_at, title, word_count, flags, length(data) '
+            'FROM entry_revisions WHERE entry_id = ? ORDER BY revision',
+            (entry_id,)
+        ):
+            if flags & BODY_ENCRYPTED:
+                title = self.require_cipher().decrypt_text(
+                    title, row_field(b'revision title', entry_id, revision)
+                )
+            revisions.append((revision, saved_at, title, word_count, size))
+            saved_at = replaced_at
+        revisions.reverse()
+        return revisions
+    
+    def get_revision(self, entry_id, revision):
+        # One earlier version as a full Entry dated when it was saved, or
+        # None. Starts from the nearest snapshot at or above revision, or
+        # from the current entry, and applies the deltas in between.
+        entry = self.get_entry(entry_id)
+        if entry is None:
+            return None
+        rows = self.conn.execute(
+            'SELECT revision, title, word_count, kind, flags, data FROM entry_revisions '
+            'WHERE entry_id = ? AND revision >= ? AND revision <= coalesce('
+            '(SELECT min(revision) FROM entry_revisions '
+            'WHERE entry_id = ? AND revision >= ? AND kind = ?), revision) '
+            'ORDER BY revision DESC',
+            (entry_id, revision, entry_id, revision, REVISION_SNAPSHOT)
+        ).fetchall()
+        if not rows or rows[-1][0] != revision:
+            return None
+        text = entry.content
+        for number, title, word_count, kind, flags, data in rows:
+            title, data, flags = self.open_revision(title, data, flags, entry_id, number)
+            if kind == REVISION_SNAPSHOT:
+                text = entry_body(data if flags & BODY_ZLIB else data.decode('utf-8'), flags)
+            else:
+                text = apply_delta(data, text)
+        saved_at = self.conn.execute(
+            'SELECT replaced_at FROM entry_revisions WHERE entry_id = ? AND revision = ?',
+            (entry_id, revision - 1)
+        ).fetchone()
+        return Entry(entry_id, title, make_preview(text), saved_at[0] if saved_at else entry.created_at,
+                     entry.utc_offset, word_count, text, 0)
+    
+    def restore_revision(self, entry_id, revision):
+        # Makes an earlier version current again; the version it replaces
+        # becomes the newest revision, so a restore can itself be undone
+        entry = self.get_revision(entry_id, revision)
+        if entry is None:
+            return False
+        self.update_entry(entry_id, entry.title, entry.content)
+        return True
+    
+    def delete_entry(self, entry_id):
+        with self.conn:
+            self.record_changes(self.entry_uids([entry_id]), 'delete')
+            self.unindex_compressed(entry_id)
+            self.conn.execute('DELETE FROM diary_entries WHERE id = ?', (entry_id,))
+            self.conn.execute('DELETE FROM drafts WHERE entry_id = ?', (entry_id,))
+        self.cache.discard(entry_id)
+        self.notify('deleted', entry_id)
+    
+    def save_draft(self, entry_id, title, content):
+        with self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO drafts (entry_id, title, content, updated_at) '
+                'VALUES (?, ?, ?, ?)',
+                (entry_id,) + self.seal_draft(title, content, entry_id) + (int(time.time()),)
+            )
+    
+    def get_draft(self, entry_id):
+        # (title, content) of the unsaved draft for entry_id, or None
+        draft = self.conn.execute(
+            'SELECT title, content FROM drafts WHERE entry_id = ?',
+            (entry_id,)
+        ).fetchone()
+        if draft is not None and isinstance(draft[0], bytes):
+            cipher = self.require_cipher()
+            draft = (cipher.decrypt_text(draft[0], row_field(b'draft title', entry_id)),
+                     cipher.decrypt_text(draft[1], row_field(b'draft content', entry_id)))
+        return draft
+    
+    def delete_draft(self, entry_id):
+        with self.conn:
+            self.conn.execute('DELETE FROM drafts WHERE entry_id = ?', (entry_id,))
+    
+    def entry_uids(self, entry_ids):
+        cursor = self.conn.execute(
+            'SELECT uid FROM diary_entries WHERE id IN ({})'.format(', '.join('?' * len(entry_ids))),
+            list(entry_ids)
+        )
+        return [uid for (uid,) in cursor]
+    
+    def record_changes(self, uids, op):
+        # Journals a local 'put' or 'delete' of each entry for sync, under
+        # the next logical clock value; call inside a transaction
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO change_log (uid, op, clock, device) '
+            'VALUES (?, ?, (SELECT max(coalesce(max(clock), 0), ?) + 1 FROM change_log), ?)',
+            [(uid, op, self.clock_floor, self.device_id) for uid in uids]
+        )
+    
+    def reset_device(self, clock=0):
+        # Makes this diary a new device for sync, whose changes count from
+        # scratch at other devices, with clocks past clock. For a copy of
+        # another diary's file, which would otherwise share its id, and for
+        # a restored backup, whose journal is behind what peers already
+        # received from this diary: under the old id its new changes would
+        # reuse seq and clock values they have seen and be skipped or lose.
+        device_id = uuid.uuid4().hex[:16]
+        clock = max(clock, self.clock_floor)
+        with self.conn:
+            # Changes journaled under the old id move to the new one: a copy
+            # may have made some before it was reset, and a peer never takes
+            # changes carrying its own id from anyone else
+            self.conn.execute(
+                'UPDATE change_log SET device = ? WHERE device = ?', (device_id, self.device_id)
+            )
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)',
+                [('device_id', device_id), ('clock_floor', str(clock))]
+            )
+        self.device_id = device_id
+        self.clock_floor = clock
+    
+    def get_sync_state(self):
+        # This device and the last seq received from every other one; what
+        # a peer needs to send only the changes missing here
+        return {
+            'device': self.device_id,
+            'received': dict(self.conn.execute('SELECT device, received FROM sync_peers')),
+        }
+    
+    def export_changes(self, peer=None, since=None):
+        # Sync message with the journaled changes after seq since, by
+        # default after the last one peer acknowledged (all of them for an
+        # unknown peer). Changes that came from peer itself are left out.
+        # Puts carry the whole entry as plain text, tags included.
+        if since is None:
+            row = self.conn.execute(
+                'SELECT acknowledged FROM sync_peers WHERE device = ?', (peer,)
+            ).fetchone()
+            since = row[0] if row else 0
+        upto = self.conn.execute('SELECT coalesce(max(seq), 0) FROM change_log').fetchone()[0]
+        changes = []
+        for uid, op, clock, device, entry_id in self.conn.execute(
+            'SELECT c.uid, c.op, c.clock, c.device, d.id FROM change_log c '
+            'LEFT JOIN diary_entries d ON d.uid = c.uid '
+            'WHERE c.seq > ? AND c.seq <= ? AND c.device != ? ORDER BY c.seq',
+            (since, upto, peer or '')
+        ).fetchall():
+            change = {'uid': uid, 'op': op, 'clock': clock, 'device': device}
+            if op == 'put':
+                entry = self.query_entries(
+                    'SELECT ' + ENTRY_COLUMNS + ' FROM diary_entries WHERE id = ?', (entry_id,)
+                ).fetchone()
+                change.update(
+                    title=entry.title,
+                    content=entry.content,
+                    created_at=entry.created_at,
+                    utc_offset=entry.utc_offset,
+                    tags=self.get_entry_tags(entry_id),
+                )
+            changes.append(change)
+        message = self.get_sync_state()
+        message.update(upto=upto, changes=changes)
+        return message
+    
+    def apply_changes(self, message):
+        # Applies an export_changes() message of another diary in one
+        # transaction. Of two changes to an entry the one with the higher
+        # (clock, device) wins, so both sides settle on the same text in
+        # whatever order they sync. Returns how many changes were applied.
+        peer = message['device']
+        if peer == self.device_id:
+            raise ValueError(
+                'these changes come from this diary, or from a copy of its file that still '
+                'has the same device id (see reset_device)'
+            )
+        applied = []
+        with self.conn:
+            for change in message['changes']:
+                local = self.conn.execute(
+                    'SELECT clock, device FROM change_log WHERE uid = ?', (change['uid'],)
+                ).fetchone()
+                if local is not None and tuple(local) >= (change['clock'], change['device']):
+                    continue
+                row = self.conn.execute(
+                    'SELECT id FROM diary_entries WHERE uid = ?', (change['uid'],)
+                ).fetchone()
+                if change['op'] == 'put':
+                    applied.append(self.apply_put(change, row[0] if row else None))
+                elif row is not None:
+                    self.unindex_compressed(row[0])
+                    self.conn.execute('DELETE FROM diary_entries WHERE id = ?', row)
+                    self.conn.execute('DELETE FROM drafts WHERE entry_id = ?', row)
+                    applied.append(('deleted', row[0]))
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO change_log (uid, op, clock, device) VALUES (?, ?, ?, ?)',
+                    (change['uid'], change['op'], change['clock'], change['device'])
+                )
+            received, acknowledged = self.conn.execute(
+                'SELECT received, acknowledged FROM sync_peers WHERE device = ?', (peer,)
+            ).fetchone() or (0, 0)
+            self.conn.execute(
+                'INSERT OR REPLACE INTO sync_peers (device, received, acknowledged) VALUES (?, ?, ?)',
+                (peer, max(received, message['upto']),
+                 max(acknowledged, message['received'].get(self.device_id, 0)))
+            )
+        for change, entry_id in applied:
+            self.cache.discard(entry_id)
+            self.notify(change, entry_id)
+        return len(applied)
+    
+    def apply_put(self, change, entry_id):
+        # Writes a synced entry over the local one, if any, keeping the
+        # replaced version as a revision; returns (change, entry id)
+        title, content = change['title'], change['content']
+        stored, flags = encode_body(content, self.compress_threshold)
+        preview, word_count = make_preview(content), count_words(content)
+        if entry_id is None:
+            entry_id = self.next_entry_id()
+            row_title, row_preview, row_content, row_flags = self.seal_row(
+                title, preview, stored, flags, entry_id
+            )
+            created_at, utc_offset = change['created_at'], change['utc_offset']
+            self.conn.execute(
+                'INSERT INTO diary_entries (id, uid, title, content, content_flags, date, '
+                'created_at, utc_offset, preview, word_count) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (entry_id, change['uid'], row_title, row_content, row_flags,
+                 timestamp_to_iso(created_at, utc_offset), created_at, utc_offset, row_preview,
+                 word_count)
+            )
+            self.index_compressed(entry_id, title, content, row_flags)
+            result = ('added', entry_id)
+        else:
+            previous = self.get_entry(entry_id)
+            if previous is not None and (previous.title, previous.content) != (title, content):
+                self.add_revision(previous, content)
+            row_title, row_preview, row_content, row_flags = self.seal_row(
+                title, preview, stored, flags, entry_id
+            )
+            self.unindex_compressed(entry_id)
+            self.conn.execute(
+                'UPDATE diary_entries SET title = ?, content = ?, content_flags = ?, '
+                'preview = ?, word_count = ? WHERE id = ?',
+                (row_title, row_content, row_flags, row_preview, word_count, entry_id)
+            )
+            self.index_compressed(entry_id, title, content, row_flags)
+            result = ('updated', entry_id)
+        self.set_entry_tags(entry_id, change['tags'])
+        return result
+    
+    def close(self):
+        if self.conn is None:
+            return
+        self.conn.execute('PRAGMA optimize')
+        self.conn.close()
+        self.conn = None
+
@@ -0,0 +1,186 @@
+import zlib
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+
+# Markers placed around search matches by SQLite; they cannot occur in
+# typed text, so the UI can turn them into markup after escaping the rest.
+MATCH_START = '\x02'
+MATCH_END = '\x03'
+
+PREVIEW_LENGTH = 100
+
+# Longest piece of an entry body rendered into a single texture
+CHUNK_LENGTH = 1000
+
+# Bit in diary_entries.content_flags: content holds zlib-compressed UTF-8
+BODY_ZLIB = 1
+# Bit in diary_entries.content_flags: title, preview and content of the row
+# are encrypted (see diary.crypto); a compressed body is compressed first
+BODY_ENCRYPTED = 2
+# Default size in bytes from which bodies are compressed once enabled
+COMPRESS_THRESHOLD = 4096
+
+def make_preview(content):
+    return content[:PREVIEW_LENGTH] + '...' if len(content) > PREVIEW_LENGTH else content
+
+def count_words(content):
+    return len(content.split())
+
+def parse_tags(text):
+    # 'work, #Travel, work' -> ['work', 'Travel']; tag names compare
+    # case-insensitively, like the tags table does
+    names = []
+    seen = set()
+    for name in text.split(','):
+        name = name.strip().lstrip('#').strip()
+        if name and name.lower() not in seen:
+            seen.add(name.lower())
+            names.append(name)
+    return names
+
+def encode_body(content, threshold):
+    # (stored value, content_flags) for a body; threshold 0 stores text
+    if not threshold:
+        return content, 0
+    raw = content.encode('utf-8')
+    if len(raw) < threshold:
+        return content, 0
+    packed = zlib.compress(raw, 6)
+    if len(packed) >= len(raw):
+        return content, 0
+    return packed, BODY_ZLIB
+
+def entry_body(stored, flags):
+    if flags & BODY_ZLIB:
+        return zlib.decompress(stored).decode('utf-8')
+    return stored
+
+def split_into_chunks(content, limit=CHUNK_LENGTH):
+    # Consecutive lines are grouped into chunks of at most limit characters;
+    # a longer line is cut at the last space before the limit. Chunks keep
+    # their line breaks, so stacking them reproduces the original text.
+    chunks = []
+    lines = []
+    length = 0
+    for line in content.split('\n'):
+        while len(line) > limit:
+            cut = line.rfind(' ', 0, limit)
+            if cut <= 0:
+                cut = limit
+            if lines:
+                chunks.append('\n'.join(lines))
+                lines, length = [], 0
+            chunks.append(line[:cut])
+            line = line[cut:].lstrip(' ')
+        if lines and length + len(line) > limit:
+            chunks.append('\n'.join(lines))
+            lines, length = [], 0
+        lines.append(line)
+        length += len(line) + 1
+    if lines:
+        chunks.append('\n'.join(lines))
+    # An empty chunk would render with no height at all
+    return [chunk or ' ' for chunk in chunks]
+
+def current_timestamp():
+    # (epoch seconds, UTC offset in seconds, naive local ISO string)
+    now = datetime.now().astimezone()
+    return (
+        int(now.timestamp()),
+        int(now.utcoffset().total_seconds()),
+        now.replace(tzinfo=None).isoformat()
+    )
+
+def timestamp_to_iso(timestamp, utc_offset):
+    # Naive local ISO string, as stored in the legacy date column
+    zone = timezone(timedelta(seconds=utc_offset))
+    return datetime.fromtimestamp(timestamp, zone).replace(tzinfo=None).isoformat()
+
+def parse_iso_date(date_str):
+    # Rows written before timestamps hold naive local-time ISO strings
+    try:
+        return datetime.fromisoformat(date_str).astimezone()
+    except (TypeError, ValueError):
+        return None
+
+def iso_to_timestamp(date_str):
+    moment = parse_iso_date(date_str)
+    return int(moment.timestamp()) if moment else 0
+
+def iso_to_utc_offset(date_str):
+    moment = parse_iso_date(date_str)
+    return int(moment.utcoffset().total_seconds()) if moment else 0
+
+def format_timestamp(timestamp, utc_offset, pattern):
+    # Display formats stop at minutes, so every entry written in the same
+    # minute shares one cached string.
+    return format_minute(timestamp // 60, utc_offset, pattern)
+
+@lru_cache(maxsize=4096)
+def format_minute(minute, utc_offset, pattern):
+    zone = timezone(timedelta(seconds=utc_offset))
+    return datetime.fromtimestamp(minute * 60, zone).strftime(pattern)
+
+class Entry:
+    # One diary entry as handed out by DatabaseManager. List and search
+    # rows fill only the summary fields; rows read in full also carry the
+    # body as stored, which content decodes on first use. cover names the
+    # first attached image, if any.
+    __slots__ = (
+        'id', 'title', 'preview', 'created_at', 'utc_offset', 'word_count',
+        'body', 'body_flags', 'decoded', 'cover'
+    )
+    
+    def __init__(self, id=None, title='', preview='', created_at=0, utc_offset=0,
+                 word_count=0, body=None, body_flags=0, cover=None):
+        self.id = id
+        self.title = title
+        self.preview = preview
+        self.created_at = created_at
+        self.utc_offset = utc_offset
+        self.word_count = word_count
+        self.body = body
+        self.body_flags = body_flags
+        self.decoded = None
+        self.cover = cover
+    
+    @property
+    def has_content(self):
+        return self.body is not None
+    
+    @property
+    def content(self):
+        # None for summary rows, which never read the body
+        # A release_content() in between may clear decoded, so the text is
+        # returned from a local rather than read back from the attribute
+        decoded = self.decoded
+        if decoded is None and self.body is not None:
+            decoded = self.decoded = entry_body(self.body, self.body_flags)
+        return decoded
+    
+    def release_content(self):
+        # Drop the decoded text of a compressed body once it has been shown;
+        # the smaller stored form stays and is decoded again if needed.
+        if self.body_flags:
+            self.decoded = None
+    
+    def copy(self):
+        # Same fields and stored body, without any decoded text
+        return Entry(self.id, self.title, self.preview, self.created_at, self.utc_offset,
+                     self.word_count, self.body, self.body_flags, self.cover)
+    
+    @property
+    def sort_key(self):
+        # Newest first order used by every list: (created_at, id) descending
+        return (self.created_at, self.id)
+    
+    def format_date(self, pattern):
+        return format_timestamp(self.created_at, self.utc_offset, pattern)
+
+def entry_factory(cursor, row):
+    # sqlite3 row factory: result columns are named after Entry attributes
+    entry = Entry()
+    for column, value in zip(cursor.description, row):
+        setattr(entry, column[0], value)
+    return entry
+
@@ -0,0 +1,167 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+class Profiler:
+    # Opt-in timing of queries, screen switches and frames, enabled by
+    # setting DIARY_PROFILE. Events go to a rotating log file and the most
+    # recent ones are kept for the on-screen overlay. record() is called
+    # from the database thread as well as the main thread.
+    SLOW_FRAME = 1 / 30.0
+    
+    def __init__(self, log_path, history=100):
+        self.lock = threading.Lock()
+        self.events = deque(maxlen=history)
+        self.latest = {}
+        self.frame_times = deque(maxlen=120)
+        self.slow_frames = 0
+        
+        self.log = logging.getLogger('diary.profile')
+        self.log.propagate = False
+        self.log.setLevel(logging.INFO)
+        handler = RotatingFileHandler(log_path, maxBytes=1024 * 1024, backupCount=3)
+        handler.setFormatter(logging.Formatter('%(asctime)s %(threadName)s %(message)s'))
+        self.log.addHandler(handler)
+    
+    def record(self, category, name, seconds, detail=''):
+        event = (category, name, seconds, detail)
+        with self.lock:
+            self.events.append(event)
+            self.latest[category] = event
+        self.log.info('{} {} {:.2f} ms {}'.format(category, name, seconds * 1000, detail).rstrip())
+    
+    def record_frame(self, seconds):
+        with self.lock:
+            self.frame_times.append(seconds)
+        if seconds > self.SLOW_FRAME:
+            self.slow_frames += 1
+            self.record('frame', 'slow frame', seconds)
+    
+    def summary(self):
+        with self.lock:
+            frames = list(self.frame_times)
+            latest = sorted(self.latest.values())
+        lines = []
+        if frames:
+            lines.append('{:.0f} fps  worst {:.0f} ms  slow frames {}'.format(
+                len(frames) / max(sum(frames), 1e-6), max(frames) * 1000, self.slow_frames
+            ))
+        for category, name, seconds, detail in latest:
+            if category != 'frame':
+                lines.append('{} {:.1f} ms  {}'.format(name[:40], seconds * 1000, detail[:30]))
+        return '\n'.join(lines)
+
+profiler = None
+if os.environ.get('DIARY_PROFILE'):
+    profiler = Profiler(os.environ.get('DIARY_PROFILE_LOG', 'diary_profile.log'))
+
+@contextmanager
+def profiled(category, name, detail=''):
+    if profiler is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profiler.record(category, name, time.perf_counter() - started, detail)
+
+def parameter_shape(parameters):
+    # Only types and lengths are logged; entry text never reaches the log
+    if isinstance(parameters, dict):
+        parameters = parameters.values()
+    shape = []
+    for value in parameters:
+        if isinstance(value, (str, bytes)):
+            shape.append('{}[{}]'.format(type(value).__name__, len(value)))
+        else:
+            shape.append(type(value).__name__)
+    return '(' + ', '.join(shape) + ')'
+
+class ProfiledCursor(sqlite3.Cursor):
+    # Times a statement from execute() until its rows have been fetched,
+    # since SQLite does most of the work of a SELECT while stepping.
+    profile_sql = None
+    
+    def execute(self, sql, parameters=()):
+        self.profile_sql = ' '.join(sql.split())
+        self.profile_shape = parameter_shape(parameters)
+        self.profile_rows = 0
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.profile_time = time.perf_counter() - started
+            if self.description is None:
+                self.finish_profile(max(self.rowcount, 0))
+    
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            profiler.record(
+                'query', ' '.join(sql.split()), time.perf_counter() - started,
+                '{} rows, executemany'.format(max(self.rowcount, 0))
+            )
+    
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self.profile_time += time.perf_counter() - started
+        self.finish_profile(0 if row is None else 1)
+        return row
+    
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(size or self.arraysize)
+        self.profile_time += time.perf_counter() - started
+        self.profile_rows += len(rows)
+        if not rows:
+            self.finish_profile(0)
+        return rows
+    
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self.profile_time += time.perf_counter() - started
+        self.finish_profile(len(rows))
+        return rows
+    
+    def __next__(self):
+        # Rows read with a for loop over the cursor
+        started = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self.profile_time += time.perf_counter() - started
+            self.finish_profile(0)
+            raise
+        self.profile_time += time.perf_counter() - started
+        self.profile_rows += 1
+        return row
+    
+    def finish_profile(self, rows):
+        if self.profile_sql is None:
+            return
+        profiler.record('query', self.profile_sql, self.profile_time, '{} rows {}'.format(
+            self.profile_rows + rows, self.profile_shape
+        ))
+        self.profile_sql = None
+
+class ProfiledConnection(sqlite3.Connection):
+    # Used instead of sqlite3.Connection while profiling is enabled
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+    
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+    
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
@@ -0,0 +1,45 @@
+import difflib
+import json
+import re
+import zlib
+
+# Values of entry_revisions.kind: a delta rebuilds the version from the next
+# newer one (or the current entry); a snapshot holds the version in full
+REVISION_DELTA = 0
+REVISION_SNAPSHOT = 1
+
+# Every SNAPSHOT_INTERVAL-th revision of an entry is a snapshot, so any
+# version is rebuilt with fewer than that many deltas
+SNAPSHOT_INTERVAL = 10
+
+# Sentences with their trailing punctuation, and line breaks: the pieces a
+# delta copies or inserts. Finer than lines, since a diary paragraph is
+# often a single long line.
+PIECE = re.compile(r'[^\n.!?]+[\n.!?]*|[\n.!?]+')
+
+def split_pieces(text):
+    return PIECE.findall(text)
+
+def make_delta(text, base):
+    # Compressed JSON list that turns base back into text: [start, end]
+    # copies those pieces of base, a string is inserted as it is
+    base_pieces = split_pieces(base)
+    pieces = split_pieces(text)
+    operations = []
+    matcher = difflib.SequenceMatcher(None, base_pieces, pieces, autojunk=False)
+    for tag, base_start, base_end, start, end in matcher.get_opcodes():
+        if tag == 'equal':
+            operations.append([base_start, base_end])
+        elif end > start:
+            operations.append(''.join(pieces[start:end]))
+    return zlib.compress(
+        json.dumps(operations, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), 6
+    )
+
+def apply_delta(delta, base):
+    base_pieces = split_pieces(base)
+    operations = json.loads(zlib.decompress(delta).decode('utf-8'))
+    return ''.join(
+        operation if isinstance(operation, str) else ''.join(base_pieces[operation[0]:operation[1]])
+        for operation in operations
+    )
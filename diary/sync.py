@@ -0,0 +1,221 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import socket
+import zlib
+
+from diary.crypto import KDF_N, KDF_P, KDF_R, KEY_LENGTH, EntryCipher
+
+# TCP port sync_serve listens on unless told otherwise
+SYNC_PORT = 8765
+
+# Seconds a sync connection may stay silent before it is given up
+SYNC_TIMEOUT = 60
+
+# Random bytes behind a pairing code: 10 base32 characters, 50 bits
+PAIRING_CODE_BYTES = 7
+
+# Largest handshake message read before the other side has proved it knows
+# the pairing code
+HANDSHAKE_LIMIT = 1024
+
+class SyncRefused(ValueError):
+    # The other side of a sync connection does not know the pairing code
+    pass
+
+def encode_message(message):
+    return zlib.compress(
+        json.dumps(message, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), 6
+    )
+
+def decode_message(data):
+    try:
+        return json.loads(zlib.decompress(data).decode('utf-8'))
+    except (zlib.error, ValueError):
+        raise ValueError('not a diary sync message')
+
+def write_frame(stream, data):
+    # A frame is its length in four bytes, then the data; returns the
+    # bytes written
+    stream.write(len(data).to_bytes(4, 'big'))
+    stream.write(data)
+    stream.flush()
+    return len(data) + 4
+
+def read_frame(stream, limit=None):
+    header = stream.read(4)
+    size = int.from_bytes(header, 'big') if len(header) == 4 else 0
+    if limit is not None and size > limit:
+        raise ValueError('the sync message is too large')
+    data = stream.read(size) if size else b''
+    if not data or len(data) < size:
+        raise ValueError('the sync message ends early')
+    return data
+
+def write_message(stream, message):
+    # A message is zlib-compressed JSON in one frame; returns the bytes
+    # written
+    return write_frame(stream, encode_message(message))
+
+def read_message(stream, limit=None):
+    return decode_message(read_frame(stream, limit))
+
+def read_handshake(stream, name):
+    message = read_message(stream, HANDSHAKE_LIMIT)
+    if not isinstance(message, dict) or not isinstance(message.get(name), str):
+        raise ValueError('not a diary sync handshake')
+    return message[name]
+
+def new_pairing_code():
+    code = base64.b32encode(os.urandom(PAIRING_CODE_BYTES)).decode('ascii')[:10]
+    return code[:5] + '-' + code[5:]
+
+def pairing_key(code):
+    # Case, spaces and dashes do not matter when the code is typed in
+    code = ''.join(code.split()).replace('-', '').upper()
+    return hashlib.scrypt(code.encode('utf-8'), salt=b'personal-diary sync', n=KDF_N, r=KDF_R,
+                          p=KDF_P, maxmem=KDF_N * KDF_R * 256, dklen=KEY_LENGTH)
+
+class SyncChannel:
+    # Messages over a sync connection once both sides proved they know the
+    # pairing code. They are sealed with a key of this connection alone and
+    # numbered in each direction, so none can be read, changed, replayed,
+    # reordered or sent back to the side that wrote it.
+    def __init__(self, stream, key, initiator):
+        self.stream = stream
+        self.cipher = EntryCipher(key)
+        self.sending, self.receiving = (
+            (b'initiator', b'responder') if initiator else (b'responder', b'initiator')
+        )
+        self.sent = 0
+        self.received = 0
+    
+    def send(self, message):
+        self.sent += 1
+        return write_frame(self.stream, self.cipher.encrypt(
+            encode_message(message), b'%s:%d' % (self.sending, self.sent)
+        ))
+    
+    def receive(self):
+        self.received += 1
+        return decode_message(self.cipher.decrypt(
+            read_frame(self.stream), b'%s:%d' % (self.receiving, self.received)
+        ))
+
+def open_channel(stream, key, initiator):
+    # Both sides send a random nonce and then an HMAC of both nonces under
+    # the pairing key, the initiator first each time. The responder checks
+    # the initiator's proof before it proves anything itself, and neither
+    # side sends an entry before the other has proved it knows the code.
+    nonce = os.urandom(16)
+    if initiator:
+        write_message(stream, {'nonce': nonce.hex()})
+        peer_nonce = read_handshake(stream, 'nonce')
+        nonces = nonce + bytes.fromhex(peer_nonce)
+    else:
+        peer_nonce = read_handshake(stream, 'nonce')
+        write_message(stream, {'nonce': nonce.hex()})
+        nonces = bytes.fromhex(peer_nonce) + nonce
+    
+    def proof(role):
+        return hmac.new(key, role + nonces, hashlib.sha256).hexdigest()
+    
+    def check(role):
+        if not hmac.compare_digest(read_handshake(stream, 'proof'), proof(role)):
+            raise SyncRefused('the other device did not give the same pairing code')
+    
+    if initiator:
+        write_message(stream, {'proof': proof(b'initiator')})
+        check(b'responder')
+    else:
+        check(b'initiator')
+        write_message(stream, {'proof': proof(b'responder')})
+    return SyncChannel(stream, hmac.new(key, b'session' + nonces, hashlib.sha256).digest(),
+                       initiator)
+
+def file_channel(stream, code, nonce, writing):
+    # A sync file is sealed like one message of a connection, under a key
+    # of that file alone
+    key = hmac.new(pairing_key(code), b'file' + nonce, hashlib.sha256).digest()
+    return SyncChannel(stream, key, initiator=writing)
+
+def export_file(db, path, peer=None, code=None):
+    # Writes the changes peer lacks, or every change for a new peer, for
+    # import_file on the other device; returns (changes, bytes). With a
+    # pairing code the changes are sealed with it, else they are written as
+    # plain text. Either way the file is made readable by its owner only.
+    message = db.export_changes(peer)
+    output = os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb')
+    with output:
+        if code is None:
+            return len(message['changes']), write_message(output, message)
+        nonce = os.urandom(16)
+        size = write_message(output, {'sealed': nonce.hex()})
+        return len(message['changes']), size + file_channel(output, code, nonce, True).send(message)
+
+def file_sealed(path):
+    # Whether the sync file at path needs a pairing code to import
+    with open(path, 'rb') as source:
+        message = read_message(source)
+    return isinstance(message, dict) and 'sealed' in message
+
+def import_file(db, path, code=None):
+    # Raises SyncRefused for a sealed file without the pairing code it was
+    # written with
+    with open(path, 'rb') as source:
+        message = read_message(source)
+        if isinstance(message, dict) and 'sealed' in message:
+            if code is None:
+                raise SyncRefused('{} is sealed with a pairing code'.format(path))
+            channel = file_channel(source, code, bytes.fromhex(message['sealed']), False)
+            try:
+                message = channel.receive()
+            except ValueError:
+                raise SyncRefused(
+                    '{} was sealed with another pairing code, or is damaged'.format(path)
+                )
+    return db.apply_changes(message)
+
+def sync_stream(db, channel, initiator):
+    # Both sides swap sync states, then send just the changes the other one
+    # lacks and apply what they get. The initiator writes first each time
+    # and the other side reads first, so they never both block writing
+    # into full socket buffers. Returns (changes sent, changes applied).
+    state = db.get_sync_state()
+    if initiator:
+        channel.send(state)
+        peer_state = channel.receive()
+    else:
+        peer_state = channel.receive()
+        channel.send(state)
+    outgoing = db.export_changes(
+        peer_state['device'], since=peer_state['received'].get(db.device_id, 0)
+    )
+    if initiator:
+        channel.send(outgoing)
+        incoming = channel.receive()
+    else:
+        incoming = channel.receive()
+        channel.send(outgoing)
+    return len(outgoing['changes']), db.apply_changes(incoming)
+
+def sync_serve(db, code, host='127.0.0.1', port=SYNC_PORT, timeout=SYNC_TIMEOUT):
+    # Waits for one sync_connect from another device given the same
+    # pairing code, and syncs with it. Raises SyncRefused for a device
+    # that does not know the code, before anything is sent to it.
+    key = pairing_key(code)
+    with socket.create_server((host, port)) as server:
+        server.settimeout(timeout)
+        connection, address = server.accept()
+        with connection:
+            connection.settimeout(timeout)
+            with connection.makefile('rwb') as stream:
+                return sync_stream(db, open_channel(stream, key, initiator=False), initiator=False)
+
+def sync_connect(db, host, code, port=SYNC_PORT, timeout=SYNC_TIMEOUT):
+    key = pairing_key(code)
+    with socket.create_connection((host, port), timeout=timeout) as connection:
+        with connection.makefile('rwb') as stream:
+            return sync_stream(db, open_channel(stream, key, initiator=True), initiator=True)
@@ -0,0 +1,179 @@
+import logging
+import queue
+import threading
+import time
+
+from diary.attachments import AttachmentStore, attachments_dir, thumbnails_dir
+from diary.backup import BackupStore
+from diary.database import DatabaseManager
+from diary.profiling import profiler
+
+log = logging.getLogger('diary')
+
+class DatabaseRequest:
+    def __init__(self, method, args, kwargs, on_result, on_error):
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.on_result = on_result
+        self.on_error = on_error
+        self.cancelled = False
+        self.queued_at = time.perf_counter()
+    
+    def cancel(self):
+        # Skipped if still queued; its callbacks never run either way
+        self.cancelled = True
+
+class Worker:
+    # Owns an object on a background thread and runs its methods there, one
+    # at a time, so nothing slow runs on the caller's thread. Calls are
+    # queued with call(); results are handed to schedule(), which runs them
+    # on the worker thread here and is overridden by the app to use its
+    # main loop. Subclasses create the object in open(); should that fail,
+    # every call gets the error through its on_error.
+    _shared = None
+    
+    def __init__(self):
+        self.requests = queue.Queue()
+        # Set when open() failed; the thread has ended by then
+        self.error = None
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, name=type(self).__name__, daemon=True)
+        self.thread.start()
+    
+    @classmethod
+    def shared(cls):
+        # One app-wide worker per class
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+    
+    def call(self, method, *args, on_result=None, on_error=None, **kwargs):
+        # Queue <object>.<method>(*args, **kwargs); returns a request that
+        # can be cancelled once its result is no longer wanted.
+        request = DatabaseRequest(method, args, kwargs, on_result, on_error)
+        with self.lock:
+            if self.error is None:
+                self.requests.put(request)
+                return request
+        # Nothing is left to run it; on_error is told at once
+        self.deliver(request, request.on_error, self.error)
+        return request
+    
+    def stop(self):
+        self.requests.put(None)
+        self.thread.join()
+        if type(self)._shared is self:
+            type(self)._shared = None
+    
+    def open(self):
+        raise NotImplementedError
+    
+    def close(self, target):
+        pass
+    
+    def run(self):
+        try:
+            target = self.open()
+        except Exception as error:
+            log.exception('{}: open failed'.format(type(self).__name__))
+            with self.lock:
+                self.error = error
+            # Requests queued before that get the error instead of waiting
+            # forever; later ones get it from call()
+            while True:
+                try:
+                    request = self.requests.get_nowait()
+                except queue.Empty:
+                    return
+                if request is not None and not request.cancelled:
+                    self.deliver(request, request.on_error, error)
+        while True:
+            request = self.requests.get()
+            if request is None:
+                break
+            if request.cancelled:
+                continue
+            started = time.perf_counter()
+            try:
+                result = getattr(target, request.method)(*request.args, **request.kwargs)
+            except Exception as error:
+                log.exception('{}: {} failed'.format(type(self).__name__, request.method))
+                self.deliver(request, request.on_error, error)
+            else:
+                self.deliver(request, request.on_result, result)
+            if profiler is not None:
+                profiler.record('worker', request.method, time.perf_counter() - started,
+                                'waited {:.1f} ms'.format((started - request.queued_at) * 1000))
+        self.close(target)
+    
+    def deliver(self, request, callback, value):
+        if callback is None:
+            return
+        
+        def dispatch():
+            if not request.cancelled:
+                callback(value)
+        
+        self.schedule(dispatch)
+    
+    def schedule(self, callback):
+        callback()
+
+class DatabaseWorker(Worker):
+    # Owns the DatabaseManager, so every screen goes through one connection
+    # and no query or commit runs on the UI thread. Change notifications
+    # are passed on through schedule() as well.
+    def __init__(self, db_path='diary.db'):
+        self.db_path = db_path
+        self.listeners = []
+        super().__init__()
+    
+    def open(self):
+        db = DatabaseManager(self.db_path)
+        db.add_listener(self.forward_change)
+        return db
+    
+    def close(self, db):
+        db.close()
+    
+    def add_listener(self, callback):
+        # Same as DatabaseManager.add_listener, but called through schedule()
+        self.listeners.append(callback)
+    
+    def remove_listener(self, callback):
+        self.listeners.remove(callback)
+    
+    def forward_change(self, change, entry_id):
+        self.schedule(lambda: self.notify(change, entry_id))
+    
+    def notify(self, change, entry_id):
+        for callback in list(self.listeners):
+            callback(change, entry_id)
+
+class AttachmentWorker(Worker):
+    # Copies attached files into the store and makes thumbnails, away from
+    # both the UI thread and the database thread
+    def __init__(self, db_path='diary.db'):
+        self.db_path = db_path
+        super().__init__()
+    
+    def open(self):
+        return AttachmentStore(attachments_dir(self.db_path), thumbnails_dir(self.db_path))
+
+class BackupWorker(Worker):
+    # Makes backups on a thread and connection of their own, so a long copy
+    # never holds up the database thread or the UI
+    def __init__(self, db_path='diary.db'):
+        self.db_path = db_path
+        super().__init__()
+    
+    def open(self):
+        self.store = BackupStore(self.db_path)
+        return self.store
+    
+    def stop(self):
+        # Quitting should not wait for a long copy to finish
+        if getattr(self, 'store', None) is not None:
+            self.store.cancelled = True
+        super().stop()
@@ -0,0 +1,476 @@
+import argparse
+import getpass
+import json
+import os
+import sys
+
+from diary import (
+    BACKUP_KEEP, COMPRESS_THRESHOLD, SYNC_PORT, BackupStore, DatabaseManager, UnencryptedBackup,
+    encryption_available, export_file, file_sealed, import_file, iso_to_timestamp,
+    iso_to_utc_offset, new_pairing_code, sync_connect, sync_serve
+)
+
+# Marks the start of an entry in Markdown exports, right after its heading
+MARKDOWN_MARKER = '<!-- diary-entry created_at={} utc_offset={} -->'
+MARKDOWN_MARKER_PREFIX = '<!-- diary-entry '
+
+def write_jsonl(entries, output):
+    for entry in entries:
+        record = {
+            'title': entry.title,
+            'content': entry.content,
+            'created_at': entry.created_at,
+            'utc_offset': entry.utc_offset,
+        }
+        output.write(json.dumps(record, ensure_ascii=False))
+        output.write('\n')
+
+def write_markdown(entries, output):
+    for entry in entries:
+        output.write('## {}\n'.format(entry.title))
+        output.write(MARKDOWN_MARKER.format(entry.created_at, entry.utc_offset) + '\n')
+        output.write('_{}_\n\n'.format(entry.format_date('%B %d, %Y - %I:%M %p')))
+        output.write('\n'.join(escape_markdown_line(line) for line in entry.content.split('\n')))
+        output.write('\n\n')
+
+def escape_markdown_line(line):
+    # A body line that reads like an entry marker would split the entry in
+    # two on import; a backslash in front keeps it in the body, and keeps
+    # Markdown from hiding it as a comment
+    if line.lstrip('\\').startswith(MARKDOWN_MARKER_PREFIX):
+        return '\\' + line
+    return line
+
+def unescape_markdown_line(line):
+    if line.startswith('\\') and line.lstrip('\\').startswith(MARKDOWN_MARKER_PREFIX):
+        return line[1:]
+    return line
+
+def read_jsonl(lines):
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+            title = record['title']
+            content = record['content']
+        except (ValueError, KeyError, TypeError):
+            raise ValueError('line {}: expected an object with title and content'.format(number))
+        
+        created_at = record.get('created_at')
+        utc_offset = record.get('utc_offset', 0)
+        if created_at is None and record.get('date'):
+            # Older exports and other tools may only carry an ISO date
+            created_at = iso_to_timestamp(record['date'])
+            utc_offset = iso_to_utc_offset(record['date'])
+        yield title, content, created_at, utc_offset
+
+def read_markdown(lines):
+    # An entry is a '## title' line directly followed by a diary-entry
+    # marker; everything up to the next such pair is its body.
+    entry = None
+    body = []
+    previous = None
+    for line in lines:
+        line = line.rstrip('\n')
+        if line.startswith(MARKDOWN_MARKER_PREFIX) and previous is not None \
+                and previous.startswith('## '):
+            if entry is not None:
+                body.pop()  # the heading belongs to the new entry
+                yield finish_markdown_entry(entry, body)
+            entry = parse_markdown_marker(previous[3:], line)
+            body = []
+        elif entry is not None:
+            body.append(unescape_markdown_line(line))
+        previous = line
+    
+    if entry is not None:
+        yield finish_markdown_entry(entry, body)
+
+def parse_markdown_marker(title, line):
+    fields = dict(
+        part.split('=', 1) for part in line[len(MARKDOWN_MARKER_PREFIX):-3].split() if '=' in part
+    )
+    try:
+        created_at = int(fields['created_at'])
+        utc_offset = int(fields.get('utc_offset', 0))
+    except (KeyError, ValueError):
+        created_at, utc_offset = None, 0
+    return title, created_at, utc_offset
+
+def finish_markdown_entry(entry, body):
+    title, created_at, utc_offset = entry
+    # Drop the formatted date line and the blank line after it
+    if body and body[0].startswith('_'):
+        body = body[1:]
+    if body and not body[0]:
+        body = body[1:]
+    return title, '\n'.join(body).rstrip('\n'), created_at, utc_offset
+
+WRITERS = {
+    'jsonl': write_jsonl,
+    'markdown': write_markdown,
+}
+
+READERS = {
+    'jsonl': read_jsonl,
+    'markdown': read_markdown,
+}
+
+def require_text(entries):
+    # The app does not save an entry without a title or text, nor does import
+    for number, entry in enumerate(entries, 1):
+        title, content = entry[0], entry[1]
+        if not isinstance(title, str) or not isinstance(content, str) or \
+                not title.strip() or not content.strip():
+            raise ValueError('entry {} has no title or no text'.format(number))
+        yield entry
+
+def guess_format(path):
+    if path.endswith('.md') or path.endswith('.markdown'):
+        return 'markdown'
+    return 'jsonl'
+
+def open_database(path):
+    # Asks for the passphrase of an encrypted diary
+    db = DatabaseManager(path)
+    if db.is_locked() and not db.unlock(getpass.getpass('Passphrase for {}: '.format(path))):
+        db.close()
+        sys.exit('Wrong passphrase')
+    return db
+
+def export_command(args):
+    db = open_database(args.db)
+    output_format = args.format or guess_format(args.output)
+    try:
+        if args.output == '-':
+            WRITERS[output_format](db.iter_entries(), sys.stdout)
+        else:
+            with open(args.output, 'w', encoding='utf-8') as output:
+                WRITERS[output_format](db.iter_entries(), output)
+    finally:
+        db.close()
+
+def import_command(args):
+    db = open_database(args.db)
+    input_format = args.format or guess_format(args.input)
+    
+    def report(count):
+        sys.stderr.write('\rImported {} entries'.format(count))
+        sys.stderr.flush()
+    
+    try:
+        if args.input == '-':
+            entries = require_text(READERS[input_format](sys.stdin))
+            count = db.import_entries(entries, args.batch_size, report)
+        else:
+            with open(args.input, encoding='utf-8') as source:
+                entries = require_text(READERS[input_format](source))
+                count = db.import_entries(entries, args.batch_size, report)
+    except ValueError as error:
+        sys.stderr.write('\nImport stopped: {}\n'.format(error))
+        return 1
+    finally:
+        db.close()
+    
+    sys.stderr.write('\rImported {} entries\n'.format(count))
+    return 0
+
+def compress_command(args):
+    db = DatabaseManager(args.db)
+    size_before = os.path.getsize(args.db)
+    try:
+        db.set_compress_threshold(args.threshold)
+        if not args.threshold:
+            print('Compression turned off for new writes')
+            return 0
+        total = 0
+        while True:
+            count = db.compress_entries(limit=500)
+            if not count:
+                break
+            total += count
+            sys.stderr.write('\rChecked {} entries'.format(total))
+            sys.stderr.flush()
+        sys.stderr.write('\n')
+        # Compressed rows leave free pages behind; give them back to the disk
+        db.conn.execute('VACUUM')
+    finally:
+        db.close()
+    print('{}: {} -> {} bytes'.format(args.db, size_before, os.path.getsize(args.db)))
+    return 0
+
+def rebuild_stats_command(args):
+    db = DatabaseManager(args.db)
+    try:
+        db.rebuild_daily_stats()
+        totals = db.get_writing_stats()
+    finally:
+        db.close()
+    print('{entries} entries on {days} days, {words} words'.format(**totals))
+    return 0
+
+def encrypt_command(args):
+    if not encryption_available():
+        print('Encryption needs the cryptography package')
+        return 1
+    db = open_database(args.db)
+    try:
+        if not db.encrypted:
+            passphrase = getpass.getpass('New passphrase: ')
+            if passphrase != getpass.getpass('Repeat passphrase: '):
+                print('The passphrases differ')
+                return 1
+            db.enable_encryption(passphrase)
+        # Also finishes an encryption the app was stopped in the middle of
+        total = 0
+        while True:
+            count = db.encrypt_entries(limit=500)
+            if not count:
+                break
+            total += count
+            sys.stderr.write('\rEncrypted {} entries'.format(total))
+            sys.stderr.flush()
+        sys.stderr.write('\n')
+        if db.purge_pending():
+            db.purge_plaintext()
+            # Older backups still hold the diary unencrypted
+            store = BackupStore(args.db)
+            if store.list_backups():
+                print('Replaced the backups with {}'.format(store.replace_all()))
+            db.purge_done()
+    finally:
+        db.close()
+    print('{} is encrypted'.format(args.db))
+    return 0
+
+def backup_command(args):
+    store = BackupStore(args.db, args.dir, args.keep)
+    
+    def report(copied, total):
+        sys.stderr.write('\rCopied {} of {} pages'.format(copied, total))
+        sys.stderr.flush()
+    
+    path = store.create(progress=report)
+    sys.stderr.write('\n')
+    print('Backed up to {}'.format(path))
+    return 0
+
+def list_backups_command(args):
+    for path, made_at, size in BackupStore(args.db, args.dir).list_backups():
+        print('{}  {} bytes'.format(path, size))
+    return 0
+
+def restore_command(args):
+    db = DatabaseManager(args.db)
+    try:
+        missing = db.restore_backup(args.backup, allow_unencrypted=args.allow_unencrypted)
+    except UnencryptedBackup as error:
+        print('Not restored: {}. Run again with --allow-unencrypted to restore it '
+              'anyway.'.format(error))
+        return 1
+    except ValueError as error:
+        print('Not restored: {}'.format(error))
+        return 1
+    finally:
+        db.close()
+    print('Restored {} from {}'.format(args.db, args.backup))
+    if missing:
+        print('{} attachments it refers to are missing: {}'.format(len(missing), ', '.join(missing)))
+    return 0
+
+def sync_export_command(args):
+    code = None
+    if not args.plaintext:
+        if not encryption_available():
+            print('Sealing a sync file needs the cryptography package; --plaintext writes it '
+                  'unsealed')
+            return 1
+        code = args.code or new_pairing_code()
+    db = open_database(args.db)
+    try:
+        count, size = export_file(db, args.output, args.peer, code)
+    finally:
+        db.close()
+    print('Wrote {} changes ({} bytes) to {}'.format(count, size, args.output))
+    if code is not None and not args.code:
+        print('Pairing code for sync-import: {}'.format(code))
+    elif code is None and db.encrypted:
+        print('Warning: {} holds the entries of this encrypted diary as plain '
+              'text'.format(args.output))
+    return 0
+
+def sync_import_command(args):
+    db = open_database(args.db)
+    try:
+        code = args.code
+        if code is None and file_sealed(args.input):
+            code = getpass.getpass('Pairing code shown by sync-export: ')
+        count = import_file(db, args.input, code)
+    except ValueError as error:
+        print('Not imported: {}'.format(error))
+        return 1
+    finally:
+        db.close()
+    print('Applied {} changes from {}'.format(count, args.input))
+    return 0
+
+def sync_serve_command(args):
+    db = open_database(args.db)
+    code = args.code or new_pairing_code()
+    try:
+        print('Device {} waiting on {}:{}'.format(db.device_id, args.host, args.port))
+        if not args.code:
+            print('Pairing code: {}'.format(code))
+        sent, applied = sync_serve(db, code, args.host, args.port)
+    except ValueError as error:
+        print('Not synced: {}'.format(error))
+        return 1
+    finally:
+        db.close()
+    print('Sent {} changes, applied {}'.format(sent, applied))
+    return 0
+
+def sync_connect_command(args):
+    db = open_database(args.db)
+    try:
+        code = args.code or getpass.getpass('Pairing code shown by sync-serve: ')
+        sent, applied = sync_connect(db, args.host, code, args.port)
+    except ValueError as error:
+        # With a wrong code the other side hangs up during the handshake
+        print('Not synced: {}'.format(error))
+        return 1
+    finally:
+        db.close()
+    print('Sent {} changes, applied {}'.format(sent, applied))
+    return 0
+
+def sync_status_command(args):
+    db = DatabaseManager(args.db)
+    try:
+        print('This device: {}'.format(db.device_id))
+        for device, received, acknowledged in db.conn.execute(
+            'SELECT device, received, acknowledged FROM sync_peers ORDER BY device'
+        ):
+            print('{}  received up to {}, has ours up to {}'.format(device, received, acknowledged))
+    finally:
+        db.close()
+    return 0
+
+def sync_reset_device_command(args):
+    # For a diary copied from another one, which shares its device id
+    db = DatabaseManager(args.db)
+    try:
+        previous = db.device_id
+        db.reset_device()
+        print('This device: {} (was {})'.format(db.device_id, previous))
+    finally:
+        db.close()
+    return 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Personal Diary maintenance tools')
+    parser.add_argument('--db', default='diary.db', help='diary database (default: diary.db)')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    
+    export_parser = commands.add_parser('export', help='write every entry to a file')
+    export_parser.add_argument('output', help="output file, or '-' for stdout")
+    export_parser.add_argument('--format', choices=sorted(WRITERS))
+    export_parser.set_defaults(handler=export_command)
+    
+    import_parser = commands.add_parser('import', help='add entries from an export file')
+    import_parser.add_argument('input', help="input file, or '-' for stdin")
+    import_parser.add_argument('--format', choices=sorted(READERS))
+    import_parser.add_argument('--batch-size', type=int, default=1000)
+    import_parser.set_defaults(handler=import_command)
+    
+    compress_parser = commands.add_parser('compress', help='store long entry bodies compressed')
+    compress_parser.add_argument(
+        '--threshold', type=int, default=COMPRESS_THRESHOLD,
+        help='compress bodies of at least this many bytes, 0 to turn off (default: %(default)s)'
+    )
+    compress_parser.set_defaults(handler=compress_command)
+    
+    stats_parser = commands.add_parser('rebuild-stats', help='recount the calendar statistics')
+    stats_parser.set_defaults(handler=rebuild_stats_command)
+    
+    encrypt_parser = commands.add_parser('encrypt', help='encrypt the diary with a passphrase')
+    encrypt_parser.set_defaults(handler=encrypt_command)
+    
+    backup_parser = commands.add_parser('backup', help='copy the diary into the backups folder')
+    backup_parser.add_argument('--dir', help='backups folder (default: backups next to the diary)')
+    backup_parser.add_argument(
+        '--keep', type=int, default=BACKUP_KEEP,
+        help='backups to keep, oldest deleted first (default: %(default)s)'
+    )
+    backup_parser.set_defaults(handler=backup_command)
+    
+    backups_parser = commands.add_parser('backups', help='list backups, newest first')
+    backups_parser.add_argument('--dir', help='backups folder (default: backups next to the diary)')
+    backups_parser.set_defaults(handler=list_backups_command)
+    
+    restore_parser = commands.add_parser('restore', help='replace the diary with a checked backup')
+    restore_parser.add_argument('backup', help='backup file to restore')
+    restore_parser.add_argument(
+        '--allow-unencrypted', action='store_true',
+        help='restore a backup made before the diary was encrypted, turning encryption off'
+    )
+    restore_parser.set_defaults(handler=restore_command)
+    
+    sync_export_parser = commands.add_parser(
+        'sync-export', help='write the changes another device lacks to a file'
+    )
+    sync_export_parser.add_argument('output', help='sync file to write')
+    sync_export_parser.add_argument(
+        '--peer', help='device id of the receiver (default: every change)'
+    )
+    sync_export_parser.add_argument(
+        '--code', help='pairing code to seal the file with (default: a new random one, printed)'
+    )
+    sync_export_parser.add_argument(
+        '--plaintext', action='store_true',
+        help='write the entries unsealed, readable by anyone who gets the file'
+    )
+    sync_export_parser.set_defaults(handler=sync_export_command)
+    
+    sync_import_parser = commands.add_parser('sync-import', help='apply a sync file')
+    sync_import_parser.add_argument('input', help='sync file written by sync-export')
+    sync_import_parser.add_argument(
+        '--code', help='pairing code the file was sealed with (default: ask if it is sealed)'
+    )
+    sync_import_parser.set_defaults(handler=sync_import_command)
+    
+    sync_serve_parser = commands.add_parser('sync-serve', help='wait for one sync-connect')
+    sync_serve_parser.add_argument(
+        '--host', default='127.0.0.1', help='address to listen on (default: %(default)s)'
+    )
+    sync_serve_parser.add_argument('--port', type=int, default=SYNC_PORT)
+    sync_serve_parser.add_argument(
+        '--code', help='pairing code to expect (default: a new random one, printed)'
+    )
+    sync_serve_parser.set_defaults(handler=sync_serve_command)
+    
+    sync_connect_parser = commands.add_parser('sync-connect', help='sync with a sync-serve')
+    sync_connect_parser.add_argument('host')
+    sync_connect_parser.add_argument('--port', type=int, default=SYNC_PORT)
+    sync_connect_parser.add_argument('--code', help='pairing code of the sync-serve (default: ask)')
+    sync_connect_parser.set_defaults(handler=sync_connect_command)
+    
+    sync_status_parser = commands.add_parser('sync-status', help='show this device and its peers')
+    sync_status_parser.set_defaults(handler=sync_status_command)
+    
+    sync_reset_parser = commands.add_parser(
+        'sync-reset-device', help='give a copied diary a device id of its own'
+    )
+    sync_reset_parser.set_defaults(handler=sync_reset_device_command)
+    
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.handler(args) or 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,13 @@
-import sqlite3
+import calendar
 import os
-from datetime import datetime
+import time
+from collections import OrderedDict
+from datetime import date
+from functools import partial
+
+# Taken before Kivy is imported so the startup report covers it
+STARTUP_TIME = time.perf_counter()
+
 from kivy.app import App
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.label import Label
@@ -8,74 +15,291 @@ from kivy.uix.button import Button
 from kivy.uix.textinput import TextInput
 from kivy.uix.scrollview import ScrollView
 from kivy.uix.gridlayout import GridLayout
-from kivy.uix.popup import Popup
+from kivy.uix.image import AsyncImage
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
 from kivy.uix.screenmanager import ScreenManager, Screen
 from kivy.clock import Clock
-from kivy.metrics import dp
+from kivy.logger import Logger
+from kivy.metrics import dp, sp
+from kivy.properties import NumericProperty, StringProperty
+from kivy.utils import escape_markup
 from kivy.core.window import Window
 
+from diary import (
+    CARD_THUMBNAIL_SIZE, MATCH_END, MATCH_START, VIEW_THUMBNAIL_SIZE, AttachmentWorker,
+    BackupWorker, DatabaseWorker, DiaryLocked, UnencryptedBackup, encryption_available, parse_tags,
+    split_into_chunks
+)
+from diary.attachments import IMAGE_EXTENSIONS
+from diary.profiling import profiled, profiler
+
 # Set window size for testing (remove for mobile)
 Window.size = (360, 640)
 
-class DatabaseManager:
+class StartupTimer:
+    # Collects milestones from process start until the first page of
+    # entries is on screen and logs them once as a single line.
+    def __init__(self, start):
+        self.start = start
+        self.marks = []
+        self.reported = False
+    
+    def mark(self, label):
+        if not self.reported:
+            self.marks.append((label, time.perf_counter() - self.start))
+    
+    def report(self, label):
+        if self.reported:
+            return
+        self.mark(label)
+        self.reported = True
+        Logger.info('Startup: ' + ', '.join(
+            '{} {:.0f} ms'.format(name, seconds * 1000) for name, seconds in self.marks
+        ))
+
+startup_timer = StartupTimer(STARTUP_TIME)
+startup_timer.mark('kivy loaded')
+
+class FrameMonitor:
+    # Feeds the time between frames to the profiler and shows its summary
+    # in a small overlay on top of every screen.
     def __init__(self):
-        self.db_path = 'diary.db'
-        self.init_database()
-    
-    def init_database(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS diary_entries (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT NOT NULL,
-                content TEXT NOT NULL,
-                date TEXT NOT NULL
+        self.last_frame = None
+        self.overlay = Label(
+            font_size='10sp',
+            halign='left',
+            valign='top',
+            color=(1, 1, 0.4, 1),
+            outline_width=1,
+            outline_color=(0, 0, 0, 1),
+            size_hint=(None, None)
+        )
+        self.overlay.bind(texture_size=self.overlay.setter('size'))
+    
+    def start(self):
+        Clock.schedule_interval(self.on_frame, 0)
+        Clock.schedule_interval(self.update_overlay, 0.5)
+        Window.add_widget(self.overlay)
+    
+    def on_frame(self, dt):
+        now = time.perf_counter()
+        if self.last_frame is not None:
+            profiler.record_frame(now - self.last_frame)
+        self.last_frame = now
+    
+    def update_overlay(self, dt):
+        self.overlay.text = profiler.summary()
+        self.overlay.pos = (dp(4), Window.height - self.overlay.height - dp(4))
+        # Stay above screens added to the window after the overlay
+        if Window.children[0] is not self.overlay:
+            Window.remove_widget(self.overlay)
+            Window.add_widget(self.overlay)
+
+class AppDatabaseWorker(DatabaseWorker):
+    # Delivers results and change notifications on the Kivy main thread
+    def schedule(self, callback):
+        Clock.schedule_once(lambda dt: callback())
+
+class AppAttachmentWorker(AttachmentWorker):
+    def schedule(self, callback):
+        Clock.schedule_once(lambda dt: callback())
+
+class AppBackupWorker(BackupWorker):
+    def schedule(self, callback):
+        Clock.schedule_once(lambda dt: callback())
+
+# Seconds between checks whether a backup is due
+BACKUP_CHECK_INTERVAL = 60 * 60
+
+def photo_directory():
+    # Where the photo chooser starts
+    for path in ('/sdcard/DCIM', os.path.expanduser('~/Pictures')):
+        if os.path.isdir(path):
+            return path
+    return os.path.expanduser('~')
+
+class Thumbnail(AsyncImage):
+    # Shows the thumbnail of one attachment. The thumbnail is made or found
+    # by the attachment worker and then decoded by Kivy's loader thread, so
+    # neither step holds up the UI; a late answer for a previous name is
+    # dropped.
+    name = StringProperty('')
+    
+    def __init__(self, thumbnail_size=CARD_THUMBNAIL_SIZE, **kwargs):
+        self.thumbnail_size = thumbnail_size
+        self.request = None
+        super().__init__(**kwargs)
+    
+    def on_name(self, instance, name):
+        if self.request is not None:
+            self.request.cancel()
+            self.request = None
+        self.source = ''
+        if name:
+            self.request = AppAttachmentWorker.shared().call(
+                'thumbnail', name, self.thumbnail_size, on_result=self.on_thumbnail
             )
-        ''')
-        conn.commit()
-        conn.close()
-    
-    def add_entry(self, title, content):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        date = datetime.now().isoformat()
-        cursor.execute(
-            'INSERT INTO diary_entries (title, content, date) VALUES (?, ?, ?)',
-            (title, content, date)
-        )
-        conn.commit()
-        conn.close()
-    
-    def get_all_entries(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM diary_entries ORDER BY date DESC')
-        entries = cursor.fetchall()
-        conn.close()
-        return entries
-    
-    def update_entry(self, entry_id, title, content):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            'UPDATE diary_entries SET title = ?, content = ? WHERE id = ?',
-            (title, content, entry_id)
-        )
-        conn.commit()
-        conn.close()
-    
-    def delete_entry(self, entry_id):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM diary_entries WHERE id = ?', (entry_id,))
-        conn.commit()
-        conn.close()
+    
+    def on_thumbnail(self, path):
+        self.request = None
+        self.source = path
+
+# Drafts are keyed by entry id; a new, never saved entry uses this key
+NEW_ENTRY_DRAFT = 0
+# Seconds of typing coalesced into one draft write
+DRAFT_SAVE_DELAY = 3
+
+class EntryCard(RecycleDataViewBehavior, BoxLayout):
+    # One card of the home list; RecycleView reuses a handful of these and
+    # rebinds them to whichever rows are currently visible.
+    entry_id = NumericProperty(0)
+    title = StringProperty('')
+    preview = StringProperty('')
+    date_text = StringProperty('')
+    cover = StringProperty('')
+    
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.orientation = 'vertical'
+        self.padding = dp(10)
+        self.spacing = dp(5)
+        self.list_view = None
+        
+        # Title
+        title_label = Label(
+            font_size='16sp',
+            bold=True,
+            markup=True,
+            text_size=(None, None),
+            halign='left',
+            valign='top',
+            color=(0.2, 0.2, 0.2, 1)
+        )
+        self.bind(title=title_label.setter('text'))
+        
+        # Content preview
+        content_label = Label(
+            font_size='14sp',
+            markup=True,
+            text_size=(None, None),
+            halign='left',
+            valign='top',
+            color=(0.4, 0.4, 0.4, 1)
+        )
+        self.bind(preview=content_label.setter('text'))
+        
+        # Date
+        date_label = Label(
+            font_size='12sp',
+            color=(0.6, 0.6, 0.6, 1),
+            text_size=(None, None),
+            halign='left',
+            valign='bottom'
+        )
+        self.bind(date_text=date_label.setter('text'))
+        
+        # First attached photo, if any
+        self.thumbnail = Thumbnail(size_hint_x=None, width=0, opacity=0)
+        self.bind(cover=self.on_cover)
+        
+        text_layout = BoxLayout(orientation='vertical', spacing=dp(5))
+        text_layout.add_widget(title_label)
+        text_layout.add_widget(content_label)
+        text_layout.add_widget(date_label)
+        
+        body_layout = BoxLayout(orientation='horizontal', spacing=dp(10))
+        body_layout.add_widget(text_layout)
+        body_layout.add_widget(self.thumbnail)
+        
+        # Buttons
+        btn_layout = BoxLayout(orientation='horizontal', size_hint_y=None, height=dp(30))
+        
+        view_btn = Button(
+            text='View',
+            size_hint_x=0.33,
+            background_color=(0.2, 0.6, 1, 1)
+        )
+        view_btn.bind(on_press=self.on_view)
+        
+        edit_btn = Button(
+            text='Edit',
+            size_hint_x=0.33,
+            background_color=(0.8, 0.6, 0.2, 1)
+        )
+        edit_btn.bind(on_press=self.on_edit)
+        
+        delete_btn = Button(
+            text='Delete',
+            size_hint_x=0.34,
+            background_color=(0.8, 0.2, 0.2, 1)
+        )
+        delete_btn.bind(on_press=self.on_delete)
+        
+        btn_layout.add_widget(view_btn)
+        btn_layout.add_widget(edit_btn)
+        btn_layout.add_widget(delete_btn)
+        
+        self.add_widget(body_layout)
+        self.add_widget(btn_layout)
+    
+    def refresh_view_attrs(self, rv, index, data):
+        self.list_view = rv
+        return super().refresh_view_attrs(rv, index, data)
+    
+    def on_cover(self, instance, cover):
+        # Cards are reused while scrolling; the thumbnail follows the row
+        self.thumbnail.name = cover
+        self.thumbnail.width = dp(80) if cover else 0
+        self.thumbnail.opacity = 1 if cover else 0
+    
+    def on_view(self, instance):
+        self.list_view.screen.view_entry(self.entry_id)
+    
+    def on_edit(self, instance):
+        self.list_view.screen.edit_entry(self.entry_id)
+    
+    def on_delete(self, instance):
+        self.list_view.screen.confirm_delete(self.entry_id)
+
+class EntryListView(RecycleView):
+    def __init__(self, screen, **kwargs):
+        super().__init__(**kwargs)
+        self.screen = screen
+        
+        self.layout = RecycleBoxLayout(
+            orientation='vertical',
+            spacing=dp(10),
+            size_hint_y=None,
+            default_size=(None, dp(120)),
+            default_size_hint=(1, None)
+        )
+        self.layout.bind(minimum_height=self.layout.setter('height'))
+        self.add_widget(self.layout)
+        self.viewclass = EntryCard
 
 class HomeScreen(Screen):
+    PAGE_SIZE = 50
+    
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.db = DatabaseManager()
+        self.db = AppDatabaseWorker.shared()
+        self.pending_changes = {}
+        self.page_request = None
+        self.list_generation = 0
+        self.entry_keys = []
+        self.last_entry = None
+        self.has_more_entries = False
+        self.pending_scroll_offset = None
+        self.search_query = ''
+        # [(tag id, name)] the list is limited to, and whether an entry needs
+        # all of them or any one
+        self.tag_filter = []
+        self.match_all_tags = False
+        self.load_started = None
+        self.search_trigger = Clock.create_trigger(self.run_search, 0.3)
+        self.db.add_listener(self.on_entry_changed)
         self.build_ui()
     
     def build_ui(self):
@@ -104,12 +328,44 @@ class HomeScreen(Screen):
         header_layout.add_widget(title_label)
         header_layout.add_widget(menu_btn)
         
+        # Search and tag filter
+        search_layout = BoxLayout(
+            orientation='horizontal', size_hint_y=None, height=dp(40), spacing=dp(10)
+        )
+        
+        self.search_input = TextInput(
+            hint_text='Search entries',
+            multiline=False,
+            size_hint_x=0.7,
+            font_size='16sp'
+        )
+        self.search_input.bind(text=lambda instance, text: self.search_trigger())
+        
+        self.tags_btn = Button(
+            text='Tags',
+            size_hint_x=0.3,
+            shorten=True,
+            background_color=(0.5, 0.5, 0.5, 1)
+        )
+        self.tags_btn.bind(on_press=self.show_tag_picker)
+        
+        search_layout.add_widget(self.search_input)
+        search_layout.add_widget(self.tags_btn)
+        
         # Entries list
-        self.scroll = ScrollView()
-        self.entries_layout = GridLayout(cols=1, spacing=dp(10), size_hint_y=None)
-        self.entries_layout.bind(minimum_height=self.entries_layout.setter('height'))
+        self.list_container = BoxLayout()
+        self.entries_view = EntryListView(self)
+        self.entries_view.bind(scroll_y=self.on_scroll)
+        self.entries_view.layout.bind(height=self.on_entries_height)
         
-        self.scroll.add_widget(self.entries_layout)
+        self.empty_label = Label(
+            text='Loading entries...',
+            text_size=(None, None),
+            halign='center',
+            valign='middle',
+            font_size='16sp',
+            color=(0.5, 0.5, 0.5, 1)
+        )
         
         # Add entry button
         add_btn = Button(
@@ -123,130 +379,272 @@ class HomeScreen(Screen):
         add_btn.bind(on_press=self.add_entry)
         
         main_layout.add_widget(header_layout)
-        main_layout.add_widget(self.scroll)
+        main_layout.add_widget(search_layout)
+        main_layout.add_widget(self.list_container)
         main_layout.add_widget(add_btn)
         
+        self.list_container.add_widget(self.empty_label)
+        
         self.add_widget(main_layout)
-        self.load_entries()
     
     def load_entries(self):
-        self.entries_layout.clear_widgets()
-        entries = self.db.get_all_entries()
+        self.load_started = time.perf_counter()
+        if self.page_request is not None:
+            self.page_request.cancel()
+            self.page_request = None
+        # Lets replies to requests made for the previous list be ignored
+        self.list_generation += 1
+        
+        self.entries_view.data = []
+        self.entry_keys = []
+        self.pending_changes.clear()
+        self.last_entry = None
+        self.has_more_entries = True
+        self.pending_scroll_offset = None
+        self.entries_view.scroll_y = 1
+        self.load_next_page()
+        self.update_list_state()
+    
+    def update_list_state(self):
+        if self.entries_view.data:
+            widget = self.entries_view
+        else:
+            widget = self.empty_label
+            if self.page_request is not None:
+                self.empty_label.text = 'Loading entries...'
+            elif self.search_query:
+                self.empty_label.text = 'No entries match "{}"'.format(self.search_query)
+            elif self.tag_filter:
+                self.empty_label.text = 'No entries tagged {}'.format(
+                    ' and '.join(name for tag_id, name in self.tag_filter)
+                    if self.match_all_tags else
+                    ' or '.join(name for tag_id, name in self.tag_filter)
+                )
+            else:
+                self.empty_label.text = 'No diary entries yet\nTap "Add New Entry" to start writing'
+        
+        if widget.parent is not self.list_container:
+            self.list_container.clear_widgets()
+            self.list_container.add_widget(widget)
+    
+    def run_search(self, dt):
+        query = self.search_input.text.strip()
+        if query != self.search_query:
+            self.search_query = query
+            self.load_entries()
+    
+    def load_next_page(self):
+        if self.page_request is not None:
+            return
         
-        if not entries:
-            empty_label = Label(
-                text='No diary entries yet\nTap "Add New Entry" to start writing',
-                text_size=(None, None),
-                halign='center',
-                valign='middle',
-                font_size='16sp',
-                color=(0.5, 0.5, 0.5, 1)
+        tag_ids = [tag_id for tag_id, name in self.tag_filter]
+        if self.search_query:
+            self.page_request = self.db.call(
+                'search_entries',
+                self.search_query,
+                limit=self.PAGE_SIZE,
+                offset=len(self.entries_view.data),
+                tag_ids=tag_ids,
+                match_all=self.match_all_tags,
+                on_result=self.on_search_page_loaded,
+                on_error=self.on_page_failed
+            )
+        elif self.last_entry is None:
+            self.page_request = self.db.call(
+                'get_entries_page',
+                limit=self.PAGE_SIZE,
+                tag_ids=tag_ids,
+                match_all=self.match_all_tags,
+                on_result=self.on_page_loaded,
+                on_error=self.on_page_failed
             )
-            self.entries_layout.add_widget(empty_label)
         else:
-            for entry in entries:
-                entry_widget = self.create_entry_widget(entry)
-                self.entries_layout.add_widget(entry_widget)
-    
-    def create_entry_widget(self, entry):
-        entry_id, title, content, date_str = entry
-        
-        # Parse date
-        try:
-            date_obj = datetime.fromisoformat(date_str)
-            formatted_date = date_obj.strftime('%b %d, %Y - %I:%M %p')
-        except:
-            formatted_date = date_str
-        
-        # Create entry layout
-        entry_layout = BoxLayout(
-            orientation='vertical',
-            size_hint_y=None,
-            height=dp(120),
-            padding=dp(10),
-            spacing=dp(5)
-        )
-        
-        # Title
-        title_label = Label(
-            text=title,
-            font_size='16sp',
-            bold=True,
-            text_size=(None, None),
-            halign='left',
-            valign='top',
-            color=(0.2, 0.2, 0.2, 1)
-        )
-        
-        # Content preview
-        content_preview = content[:100] + '...' if len(content) > 100 else content
-        content_label = Label(
-            text=content_preview,
-            font_size='14sp',
-            text_size=(None, None),
-            halign='left',
-            valign='top',
-            color=(0.4, 0.4, 0.4, 1)
-        )
-        
-        # Date
-        date_label = Label(
-            text=formatted_date,
-            font_size='12sp',
-            color=(0.6, 0.6, 0.6, 1),
-            text_size=(None, None),
-            halign='left',
-            valign='bottom'
-        )
-        
-        # Buttons
-        btn_layout = BoxLayout(orientation='horizontal', size_hint_y=None, height=dp(30))
-        
-        view_btn = Button(
-            text='View',
-            size_hint_x=0.33,
-            background_color=(0.2, 0.6, 1, 1)
-        )
-        view_btn.bind(on_press=lambda x: self.view_entry(entry))
-        
-        edit_btn = Button(
-            text='Edit',
-            size_hint_x=0.33,
-            background_color=(0.8, 0.6, 0.2, 1)
-        )
-        edit_btn.bind(on_press=lambda x: self.edit_entry(entry))
+            self.page_request = self.db.call(
+                'get_entries_page',
+                before_time=self.last_entry.created_at,
+                before_id=self.last_entry.id,
+                limit=self.PAGE_SIZE,
+                tag_ids=tag_ids,
+                match_all=self.match_all_tags,
+                on_result=self.on_page_loaded,
+                on_error=self.on_page_failed
+            )
+    
+    def on_page_loaded(self, entries):
+        startup_timer.report('first page')
+        self.page_request = None
+        self.has_more_entries = len(entries) == self.PAGE_SIZE
+        if entries:
+            self.last_entry = entries[-1]
+        else:
+            self.pending_scroll_offset = None
+        self.entry_keys.extend(entry.sort_key for entry in entries)
+        with profiled('list', 'build page data', '{} rows'.format(len(entries))):
+            self.entries_view.data.extend(self.entry_view_data(entry) for entry in entries)
+        self.update_list_state()
+        self.report_load_time()
+    
+    def on_search_page_loaded(self, results):
+        self.page_request = None
+        self.has_more_entries = len(results) == self.PAGE_SIZE
+        if not results:
+            self.pending_scroll_offset = None
+        self.entry_keys.extend(result.sort_key for result in results)
+        self.entries_view.data.extend(self.search_view_data(result) for result in results)
+        self.update_list_state()
+        self.report_load_time()
+    
+    def on_page_failed(self, error):
+        self.page_request = None
+        self.has_more_entries = False
+        self.pending_scroll_offset = None
+        self.update_list_state()
+        if isinstance(error, DiaryLocked):
+            self.manager.current = 'unlock'
+    
+    def report_load_time(self):
+        # From load_entries() until its first page is in the list data
+        if profiler is None or self.load_started is None:
+            return
+        profiler.record('list', 'load_entries', time.perf_counter() - self.load_started,
+                        'search' if self.search_query else '')
+        self.load_started = None
+    
+    def on_entry_changed(self, change, entry_id):
+        if change == 'restored':
+            # The whole diary was replaced from a backup
+            self.pending_changes.clear()
+            self.load_entries()
+            return
         
-        delete_btn = Button(
-            text='Delete',
-            size_hint_x=0.34,
-            background_color=(0.8, 0.2, 0.2, 1)
-        )
-        delete_btn.bind(on_press=lambda x: self.confirm_delete(entry_id))
+        # Remember what changed and patch the list when it is next shown;
+        # an id only ever needs its net change applied.
+        previous = self.pending_changes.get(entry_id)
+        if previous == 'added':
+            if change == 'deleted':
+                del self.pending_changes[entry_id]
+        else:
+            self.pending_changes[entry_id] = change
         
-        btn_layout.add_widget(view_btn)
-        btn_layout.add_widget(edit_btn)
-        btn_layout.add_widget(delete_btn)
+        if self.manager is not None and self.manager.current_screen is self:
+            self.apply_pending_changes()
+    
+    def apply_pending_changes(self):
+        if self.search_query or self.tag_filter:
+            # Ranking or tags may have changed; simply run the query again
+            self.load_entries()
+            return
         
-        entry_layout.add_widget(title_label)
-        entry_layout.add_widget(content_label)
-        entry_layout.add_widget(date_label)
-        entry_layout.add_widget(btn_layout)
+        changes = list(self.pending_changes.items())
+        self.pending_changes.clear()
+        for entry_id, change in changes:
+            if change == 'deleted':
+                index = self.find_entry_index(entry_id)
+                if index is not None:
+                    del self.entry_keys[index]
+                    del self.entries_view.data[index]
+            else:
+                self.db.call(
+                    'get_entry_summary',
+                    entry_id,
+                    on_result=partial(self.on_changed_entry_loaded, self.list_generation)
+                )
+        
+        if changes:
+            self.update_list_state()
+    
+    def on_changed_entry_loaded(self, generation, entry):
+        if generation != self.list_generation or entry is None:
+            return
+        index = self.find_entry_index(entry.id)
+        if index is not None:
+            self.entries_view.data[index] = self.entry_view_data(entry)
+        else:
+            self.insert_entry(entry)
+        self.update_list_state()
+    
+    def find_entry_index(self, entry_id):
+        for index, (created_at, key_id) in enumerate(self.entry_keys):
+            if key_id == entry_id:
+                return index
+        return None
+    
+    def insert_entry(self, entry):
+        key = entry.sort_key
+        last_key = self.last_entry.sort_key if self.last_entry else None
+        if self.has_more_entries and last_key is not None and key < last_key:
+            # Older than everything loaded so far; paging will reach it
+            return
         
-        return entry_layout
+        index = 0
+        while index < len(self.entry_keys) and self.entry_keys[index] > key:
+            index += 1
+        self.entry_keys.insert(index, key)
+        self.entries_view.data.insert(index, self.entry_view_data(entry))
+    
+    def on_scroll(self, instance, scroll_y):
+        # Fetch the next page once the user nears the bottom of the list
+        if scroll_y > 0.05 or not self.has_more_entries:
+            return
+        if self.page_request is not None or self.pending_scroll_offset is not None:
+            return
+        self.pending_scroll_offset = self.scroll_offset()
+        self.load_next_page()
+    
+    def scroll_offset(self):
+        # Distance in pixels between the top of the list and the viewport
+        scrollable = max(self.entries_view.layout.height - self.entries_view.height, 0)
+        return (1 - self.entries_view.scroll_y) * scrollable
+    
+    def on_entries_height(self, instance, height):
+        # ScrollView keeps scroll_y as a fraction, so appending a page would
+        # make the viewport jump; restore the previous pixel offset instead.
+        if self.pending_scroll_offset is None:
+            return
+        scrollable = max(height - self.entries_view.height, 1)
+        offset = self.pending_scroll_offset
+        self.pending_scroll_offset = None
+        self.entries_view.scroll_y = max(0, 1 - offset / scrollable)
+    
+    def entry_view_data(self, entry):
+        # Only the strings an EntryCard shows are kept in the list data
+        formatted_date = entry.format_date('%b %d, %Y - %I:%M %p')
+        
+        return {
+            'entry_id': entry.id,
+            'title': escape_markup(entry.title),
+            'preview': escape_markup(entry.preview),
+            'date_text': '{}  ·  {} words'.format(formatted_date, entry.word_count),
+            'cover': entry.cover or '',
+        }
+    
+    def search_view_data(self, result):
+        data = self.entry_view_data(result)
+        data['title'] = self.highlight_matches(result.title)
+        data['preview'] = self.highlight_matches(result.preview)
+        return data
+    
+    def highlight_matches(self, text):
+        text = escape_markup(text)
+        text = text.replace(MATCH_START, '[b][color=3399ff]')
+        return text.replace(MATCH_END, '[/color][/b]')
     
     def add_entry(self, instance):
         self.manager.current = 'add_edit'
         self.manager.get_screen('add_edit').setup_for_new_entry()
     
-    def edit_entry(self, entry):
+    def edit_entry(self, entry_id):
         self.manager.current = 'add_edit'
-        self.manager.get_screen('add_edit').setup_for_edit(entry)
+        self.manager.get_screen('add_edit').setup_for_edit(entry_id)
     
-    def view_entry(self, entry):
+    def view_entry(self, entry_id):
         self.manager.current = 'view'
-        self.manager.get_screen('view').display_entry(entry)
+        self.manager.get_screen('view').display_entry(entry_id)
     
     def confirm_delete(self, entry_id):
+        # Popups are rare; keep their import off the startup path
+        from kivy.uix.popup import Popup
+        
         content = BoxLayout(orientation='vertical', spacing=dp(10))
         content.add_widget(Label(text='Are you sure you want to delete this entry?'))
         
@@ -265,58 +663,978 @@ class HomeScreen(Screen):
             size_hint=(0.8, 0.4)
         )
         
-        cancel_btn.bind(on_press=popup.dismiss)
-        delete_btn.bind(on_press=lambda x: self.delete_entry(entry_id, popup))
+        cancel_btn.bind(on_press=popup.dismiss)
+        delete_btn.bind(on_press=lambda x: self.delete_entry(entry_id, popup))
+        
+        popup.open()
+    
+    def delete_entry(self, entry_id, popup):
+        self.db.call('delete_entry', entry_id)
+        popup.dismiss()
+    
+    def show_menu(self, instance):
+        from kivy.uix.popup import Popup
+        
+        content = BoxLayout(orientation='vertical', spacing=dp(10))
+        
+        stats_btn = Button(text='Calendar & Stats', background_color=(0.2, 0.6, 1, 1))
+        about_btn = Button(text='About', background_color=(0.2, 0.6, 1, 1))
+        privacy_btn = Button(text='Privacy Policy', background_color=(0.2, 0.6, 1, 1))
+        contact_btn = Button(text='Contact Us', background_color=(0.2, 0.6, 1, 1))
+        terms_btn = Button(text='Terms of Service', background_color=(0.2, 0.6, 1, 1))
+        encryption_btn = Button(text='Encryption', background_color=(0.2, 0.6, 1, 1))
+        backups_btn = Button(text='Backups', background_color=(0.2, 0.6, 1, 1))
+        close_btn = Button(text='Close', background_color=(0.5, 0.5, 0.5, 1))
+        
+        content.add_widget(stats_btn)
+        content.add_widget(about_btn)
+        content.add_widget(privacy_btn)
+        content.add_widget(contact_btn)
+        content.add_widget(terms_btn)
+        content.add_widget(encryption_btn)
+        content.add_widget(backups_btn)
+        content.add_widget(close_btn)
+        
+        popup = Popup(
+            title='Menu',
+            content=content,
+            size_hint=(0.8, 0.8)
+        )
+        
+        stats_btn.bind(on_press=lambda x: self.navigate_to('stats', popup))
+        about_btn.bind(on_press=lambda x: self.navigate_to('about', popup))
+        privacy_btn.bind(on_press=lambda x: self.navigate_to('privacy', popup))
+        contact_btn.bind(on_press=lambda x: self.navigate_to('contact', popup))
+        terms_btn.bind(on_press=lambda x: self.navigate_to('terms', popup))
+        encryption_btn.bind(on_press=lambda x: self.show_encryption(popup))
+        backups_btn.bind(on_press=lambda x: self.show_backups(popup))
+        close_btn.bind(on_press=popup.dismiss)
+        
+        popup.open()
+    
+    def navigate_to(self, screen_name, popup):
+        popup.dismiss()
+        self.manager.current = screen_name
+    
+    def show_encryption(self, menu_popup):
+        menu_popup.dismiss()
+        self.db.call('get_setting', 'encryption_salt', on_result=self.open_encryption)
+    
+    def open_encryption(self, salt):
+        from kivy.uix.popup import Popup
+        
+        if salt is not None:
+            self.show_message('Your diary is encrypted.\nIt asks for your passphrase on every start.',
+                              'Encryption')
+            return
+        if not encryption_available():
+            self.show_message('Encryption is not available in this build.', 'Encryption')
+            return
+        
+        content = BoxLayout(orientation='vertical', spacing=dp(10))
+        content.add_widget(Label(
+            text='Entries will only open with this passphrase.\n'
+                 'It cannot be recovered if you forget it.',
+            halign='center'
+        ))
+        passphrase_input = TextInput(hint_text='Passphrase', password=True, multiline=False,
+                                     size_hint_y=None, height=dp(40))
+        repeat_input = TextInput(hint_text='Repeat passphrase', password=True, multiline=False,
+                                 size_hint_y=None, height=dp(40))
+        status_label = Label(size_hint_y=None, height=dp(30), color=(1, 0.4, 0.4, 1))
+        
+        btn_layout = BoxLayout(orientation='horizontal', spacing=dp(10),
+                               size_hint_y=None, height=dp(40))
+        cancel_btn = Button(text='Cancel', background_color=(0.5, 0.5, 0.5, 1))
+        encrypt_btn = Button(text='Encrypt', background_color=(0.2, 0.8, 0.2, 1))
+        btn_layout.add_widget(cancel_btn)
+        btn_layout.add_widget(encrypt_btn)
+        
+        content.add_widget(passphrase_input)
+        content.add_widget(repeat_input)
+        content.add_widget(status_label)
+        content.add_widget(btn_layout)
+        
+        popup = Popup(
+            title='Encrypt Diary',
+            content=content,
+            size_hint=(0.9, 0.6)
+        )
+        
+        def encrypt(instance):
+            passphrase = passphrase_input.text
+            if len(passphrase) < 8:
+                status_label.text = 'Use at least 8 characters'
+            elif passphrase != repeat_input.text:
+                status_label.text = 'The passphrases differ'
+            else:
+                popup.dismiss()
+                self.db.call('enable_encryption', passphrase,
+                             on_result=lambda result: App.get_running_app().encrypt_entries())
+        
+        cancel_btn.bind(on_press=popup.dismiss)
+        encrypt_btn.bind(on_press=encrypt)
+        
+        popup.open()
+    
+    def show_backups(self, menu_popup):
+        menu_popup.dismiss()
+        AppBackupWorker.shared().call('list_backups', on_result=self.open_backups)
+    
+    def open_backups(self, backups):
+        from kivy.uix.popup import Popup
+        
+        content = BoxLayout(orientation='vertical', spacing=dp(10))
+        
+        if backups:
+            backup_list = GridLayout(cols=1, spacing=dp(5), size_hint_y=None)
+            backup_list.bind(minimum_height=backup_list.setter('height'))
+            for path, made_at, size in backups:
+                row = BoxLayout(orientation='horizontal', spacing=dp(5),
+                                size_hint_y=None, height=dp(40))
+                row.add_widget(Label(
+                    text='{}  ·  {:.1f} MB'.format(
+                        time.strftime('%b %d, %Y - %I:%M %p', time.localtime(made_at)),
+                        size / (1024 * 1024)
+                    ),
+                    font_size='14sp'
+                ))
+                restore_btn = Button(text='Restore', size_hint_x=None, width=dp(90),
+                                     background_color=(0.8, 0.6, 0.2, 1))
+                restore_btn.bind(on_press=partial(self.confirm_restore, path))
+                row.add_widget(restore_btn)
+                backup_list.add_widget(row)
+            scroll = ScrollView()
+            scroll.add_widget(backup_list)
+            content.add_widget(scroll)
+        else:
+            content.add_widget(Label(text='No backups yet\nOne is made every day',
+                                     halign='center'))
+        
+        btn_layout = BoxLayout(orientation='horizontal', spacing=dp(10),
+                               size_hint_y=None, height=dp(40))
+        close_btn = Button(text='Close', background_color=(0.5, 0.5, 0.5, 1))
+        backup_btn = Button(text='Back Up Now', background_color=(0.2, 0.8, 0.2, 1))
+        btn_layout.add_widget(close_btn)
+        btn_layout.add_widget(backup_btn)
+        content.add_widget(btn_layout)
+        
+        popup = Popup(
+            title='Backups',
+            content=content,
+            size_hint=(0.9, 0.7)
+        )
+        
+        def back_up(instance):
+            popup.dismiss()
+            App.get_running_app().create_backup(
+                on_result=lambda path: self.show_message('Backup saved', 'Backups'),
+                on_error=lambda error: self.show_message(
+                    'Could not back up:\n{}'.format(error), 'Backups'
+                )
+            )
+        
+        close_btn.bind(on_press=popup.dismiss)
+        backup_btn.bind(on_press=back_up)
+        self.backups_popup = popup
+        
+        popup.open()
+    
+    def confirm_restore(self, path, instance):
+        from kivy.uix.popup import Popup
+        
+        content = BoxLayout(orientation='vertical', spacing=dp(10))
+        content.add_widget(Label(
+            text='Replace your diary with this backup?\n'
+                 'Anything written since it was made is lost.',
+            halign='center'
+        ))
+        
+        btn_layout = BoxLayout(orientation='horizontal', spacing=dp(10),
+                               size_hint_y=None, height=dp(40))
+        cancel_btn = Button(text='Cancel', background_color=(0.5, 0.5, 0.5, 1))
+        restore_btn = Button(text='Restore', background_color=(0.8, 0.2, 0.2, 1))
+        btn_layout.add_widget(cancel_btn)
+        btn_layout.add_widget(restore_btn)
+        content.add_widget(btn_layout)
+        
+        popup = Popup(
+            title='Confirm Restore',
+            content=content,
+            size_hint=(0.8, 0.4)
+        )
+        
+        def restore(instance):
+            popup.dismiss()
+            self.backups_popup.dismiss()
+            self.restore_backup(path)
+        
+        cancel_btn.bind(on_press=popup.dismiss)
+        restore_btn.bind(on_press=restore)
+        
+        popup.open()
+    
+    def restore_backup(self, path, allow_unencrypted=False):
+        # Checked and copied on the database thread; the list reloads when
+        # it reports the change
+        def on_error(error):
+            if isinstance(error, UnencryptedBackup):
+                self.confirm_unencrypted_restore(path)
+            else:
+                self.show_message('Could not restore:\n{}'.format(error), 'Backups')
+        
+        def on_result(missing):
+            message = 'Diary restored'
+            if missing:
+                message += '\n{} attached photos are missing'.format(len(missing))
+            self.show_message(message, 'Backups')
+        
+        self.db.call(
+            'restore_backup', path, allow_unencrypted=allow_unencrypted,
+            on_result=on_result, on_error=on_error
+        )
+    
+    def confirm_unencrypted_restore(self, path):
+        from kivy.uix.popup import Popup
+        
+        content = BoxLayout(orientation='vertical', spacing=dp(10))
+        content.add_widget(Label(
+            text='This backup was made before your diary was encrypted.\n'
+                 'Restoring it turns encryption off.',
+            halign='center'
+        ))
+        
+        btn_layout = BoxLayout(orientation='horizontal', spacing=dp(10),
+                               size_hint_y=None, height=dp(40))
+        cancel_btn = Button(text='Cancel', background_color=(0.5, 0.5, 0.5, 1))
+        restore_btn = Button(text='Restore Anyway', background_color=(0.8, 0.2, 0.2, 1))
+        btn_layout.add_widget(cancel_btn)
+        btn_layout.add_widget(restore_btn)
+        content.add_widget(btn_layout)
+        
+        popup = Popup(
+            title='Unencrypted Backup',
+            content=content,
+            size_hint=(0.8, 0.4)
+        )
+        
+        def restore(instance):
+            popup.dismiss()
+            self.restore_backup(path, allow_unencrypted=True)
+        
+        cancel_btn.bind(on_press=popup.dismiss)
+        restore_btn.bind(on_press=restore)
+        
+        popup.open()
+    
+    def show_message(self, message, title):
+        from kivy.uix.popup import Popup
+        
+        content = BoxLayout(orientation='vertical', spacing=dp(10))
+        content.add_widget(Label(text=message, halign='center'))
+        close_btn = Button(text='Close', size_hint_y=None, height=dp(40),
+                           background_color=(0.5, 0.5, 0.5, 1))
+        content.add_widget(close_btn)
+        
+        popup = Popup(title=title, content=content, size_hint=(0.8, 0.4))
+        close_btn.bind(on_press=popup.dismiss)
+        popup.open()
+    
+    def show_tag_picker(self, instance):
+        # Tag counts are kept by the database, so this is a single small read
+        self.db.call('get_tags', on_result=self.open_tag_picker)
+    
+    def open_tag_picker(self, tags):
+        from kivy.uix.popup import Popup
+        from kivy.uix.togglebutton import ToggleButton
+        
+        content = BoxLayout(orientation='vertical', spacing=dp(10))
+        selected = set(tag_id for tag_id, name in self.tag_filter)
+        tag_buttons = []
+        
+        if tags:
+            tag_list = GridLayout(cols=1, spacing=dp(5), size_hint_y=None)
+            tag_list.bind(minimum_height=tag_list.setter('height'))
+            for tag_id, name, entry_count in tags:
+                tag_btn = ToggleButton(
+                    text='{} ({})'.format(name, entry_count),
+                    state='down' if tag_id in selected else 'normal',
+                    size_hint_y=None,
+                    height=dp(40)
+                )
+                tag_buttons.append((tag_btn, tag_id, name))
+                tag_list.add_widget(tag_btn)
+            scroll = ScrollView()
+            scroll.add_widget(tag_list)
+            content.add_widget(scroll)
+        else:
+            content.add_widget(Label(text='No tags yet\nAdd some while editing an entry',
+                                     halign='center'))
+        
+        match_all_btn = ToggleButton(
+            text='Entries need every selected tag',
+            state='down' if self.match_all_tags else 'normal',
+            size_hint_y=None,
+            height=dp(40)
+        )
+        
+        btn_layout = BoxLayout(orientation='horizontal', spacing=dp(10),
+                               size_hint_y=None, height=dp(40))
+        clear_btn = Button(text='Show All', background_color=(0.5, 0.5, 0.5, 1))
+        apply_btn = Button(text='Apply', background_color=(0.2, 0.6, 1, 1))
+        btn_layout.add_widget(clear_btn)
+        btn_layout.add_widget(apply_btn)
+        
+        content.add_widget(match_all_btn)
+        content.add_widget(btn_layout)
+        
+        popup = Popup(
+            title='Filter by Tags',
+            content=content,
+            size_hint=(0.8, 0.7)
+        )
+        
+        def apply(instance):
+            popup.dismiss()
+            self.set_tag_filter(
+                [(tag_id, name) for tag_btn, tag_id, name in tag_buttons if tag_btn.state == 'down'],
+                match_all_btn.state == 'down'
+            )
+        
+        def clear(instance):
+            popup.dismiss()
+            self.set_tag_filter([], match_all_btn.state == 'down')
+        
+        apply_btn.bind(on_press=apply)
+        clear_btn.bind(on_press=clear)
+        
+        popup.open()
+    
+    def set_tag_filter(self, tags, match_all):
+        changed = tags != self.tag_filter or (len(tags) > 1 and match_all != self.match_all_tags)
+        self.tag_filter = tags
+        self.match_all_tags = match_all
+        if tags:
+            self.tags_btn.text = ', '.join(name for tag_id, name in tags)
+            self.tags_btn.background_color = (0.2, 0.6, 1, 1)
+        else:
+            self.tags_btn.text = 'Tags'
+            self.tags_btn.background_color = (0.5, 0.5, 0.5, 1)
+        if changed:
+            self.load_entries()
+    
+    def on_enter(self):
+        if self.pending_changes:
+            with profiled('screen', 'home on_enter', '{} changes'.format(len(self.pending_changes))):
+                self.apply_pending_changes()
+
+class AddEditScreen(Screen):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.db = AppDatabaseWorker.shared()
+        self.current_entry_id = None
+        self.entry_request = None
+        self.tags_request = None
+        self.attachments_request = None
+        # [(name, size)] of the attached photos; None until loaded
+        self.attachments = []
+        self.draft_request = None
+        self.draft_changed = False
+        self.filling_fields = False
+        # A trigger does not reschedule while pending, so all keystrokes in
+        # one DRAFT_SAVE_DELAY window end up in a single draft write.
+        self.draft_trigger = Clock.create_trigger(self.flush_draft, DRAFT_SAVE_DELAY)
+        self.build_ui()
+    
+    def build_ui(self):
+        main_layout = BoxLayout(orientation='vertical', padding=dp(10), spacing=dp(10))
+        
+        # Header
+        header_layout = BoxLayout(orientation='horizontal', size_hint_y=None, height=dp(60))
+        
+        back_btn = Button(
+            text='← Back',
+            size_hint_x=0.3,
+            background_color=(0.5, 0.5, 0.5, 1)
+        )
+        back_btn.bind(on_press=self.go_back)
+        
+        self.title_label = Label(
+            text='New Entry',
+            font_size='18sp',
+            bold=True,
+            size_hint_x=0.4
+        )
+        
+        self.save_btn = Button(
+            text='Save',
+            size_hint_x=0.3,
+            background_color=(0.2, 0.8, 0.2, 1)
+        )
+        self.save_btn.bind(on_press=self.save_entry)
+        
+        header_layout.add_widget(back_btn)
+        header_layout.add_widget(self.title_label)
+        header_layout.add_widget(self.save_btn)
+        
+        # Title input
+        title_label = Label(
+            text='Title:',
+            size_hint_y=None,
+            height=dp(30),
+            text_size=(None, None),
+            halign='left'
+        )
+        
+        self.title_input = TextInput(
+            multiline=False,
+            size_hint_y=None,
+            height=dp(40),
+            font_size='16sp'
+        )
+        
+        # Tags input
+        self.tags_input = TextInput(
+            hint_text='Tags, separated by commas',
+            multiline=False,
+            size_hint_y=None,
+            height=dp(40),
+            font_size='16sp'
+        )
+        
+        # Attached photos
+        attachment_bar = BoxLayout(orientation='horizontal', size_hint_y=None, height=dp(60),
+                                   spacing=dp(5))
+        
+        self.attach_btn = Button(
+            text='+ Photo',
+            size_hint_x=None,
+            width=dp(80),
+            background_color=(0.2, 0.6, 1, 1)
+        )
+        self.attach_btn.bind(on_press=self.choose_photo)
+        
+        self.photos_layout = BoxLayout(orientation='horizontal', spacing=dp(5))
+        
+        self.remove_photos_btn = Button(
+            text='Remove',
+            size_hint_x=None,
+            width=dp(80),
+            background_color=(0.8, 0.2, 0.2, 1)
+        )
+        self.remove_photos_btn.bind(on_press=lambda x: self.set_attachments([]))
+        
+        attachment_bar.add_widget(self.attach_btn)
+        attachment_bar.add_widget(self.photos_layout)
+        attachment_bar.add_widget(self.remove_photos_btn)
+        
+        # Content input
+        content_label = Label(
+            text='Write your thoughts:',
+            size_hint_y=None,
+            height=dp(30),
+            text_size=(None, None),
+            halign='left'
+        )
+        
+        self.content_input = TextInput(
+            multiline=True,
+            font_size='16sp'
+        )
+        
+        self.title_input.bind(text=self.on_text_changed)
+        self.content_input.bind(text=self.on_text_changed)
+        
+        main_layout.add_widget(header_layout)
+        main_layout.add_widget(title_label)
+        main_layout.add_widget(self.title_input)
+        main_layout.add_widget(self.tags_input)
+        main_layout.add_widget(attachment_bar)
+        main_layout.add_widget(content_label)
+        main_layout.add_widget(self.content_input)
+        
+        self.add_widget(main_layout)
+    
+    def setup_for_new_entry(self):
+        self.flush_draft()
+        self.cancel_entry_request()
+        self.current_entry_id = None
+        self.title_label.text = 'New Entry'
+        self.fill_fields('', '')
+        self.tags_input.text = ''
+        self.set_attachments([])
+        self.set_loading(False)
+        self.request_draft()
+    
+    def setup_for_edit(self, entry_id):
+        # The list only holds previews; fetch the full entry by id
+        self.flush_draft()
+        self.cancel_entry_request()
+        self.current_entry_id = entry_id
+        self.title_label.text = 'Edit Entry'
+        self.fill_fields('', '')
+        self.tags_input.text = ''
+        self.set_loading(True)
+        self.entry_request = self.db.call(
+            'get_entry', entry_id, on_result=self.on_entry_loaded, on_error=self.on_load_failed
+        )
+        self.tags_request = self.db.call(
+            'get_entry_tags', entry_id, on_result=self.on_tags_loaded, on_error=self.on_load_failed
+        )
+        self.set_attachments(None)
+        self.attachments_request = self.db.call(
+            'get_entry_attachments', entry_id,
+            on_result=self.on_attachments_loaded, on_error=self.on_load_failed
+        )
+        self.request_draft()
+    
+    def on_entry_loaded(self, entry):
+        self.entry_request = None
+        if entry is None:
+            # Deleted meanwhile; whatever is written now becomes a new entry
+            self.setup_for_new_entry()
+            return
+        self.fill_fields(entry.title, entry.content)
+        self.finish_loading()
+    
+    def on_tags_loaded(self, names):
+        self.tags_request = None
+        self.tags_input.text = ', '.join(names)
+        self.finish_loading()
+    
+    def on_attachments_loaded(self, attachments):
+        self.attachments_request = None
+        self.set_attachments(attachments)
+        self.finish_loading()
+    
+    def finish_loading(self):
+        # Saving before the tags or photos are in would replace them with
+        # the empty fields, so the form stays disabled until all are loaded
+        requests = (self.entry_request, self.tags_request, self.attachments_request)
+        if all(request is None for request in requests):
+            self.set_loading(False)
+    
+    def on_load_failed(self, error):
+        # Left disabled; only one message for the requests still queued
+        self.cancel_entry_request()
+        self.show_message('Could not open entry:\n{}'.format(error), title='Error')
+    
+    def set_attachments(self, attachments):
+        self.attachments = attachments
+        self.photos_layout.clear_widgets()
+        for name, size in attachments or []:
+            self.photos_layout.add_widget(Thumbnail(name=name, size_hint_x=None, width=dp(60)))
+        self.remove_photos_btn.disabled = not attachments
+        self.attach_btn.disabled = attachments is None or self.content_input.disabled
+    
+    def choose_photo(self, instance):
+        from kivy.uix.popup import Popup
+        from kivy.uix.filechooser import FileChooserListView
+        
+        content = BoxLayout(orientation='vertical', spacing=dp(10))
+        chooser = FileChooserListView(
+            path=photo_directory(),
+            filters=['*' + extension for extension in IMAGE_EXTENSIONS] +
+                    ['*' + extension.upper() for extension in IMAGE_EXTENSIONS],
+            multiselect=True
+        )
+        
+        btn_layout = BoxLayout(orientation='horizontal', spacing=dp(10),
+                               size_hint_y=None, height=dp(40))
+        cancel_btn = Button(text='Cancel', background_color=(0.5, 0.5, 0.5, 1))
+        attach_btn = Button(text='Attach', background_color=(0.2, 0.8, 0.2, 1))
+        btn_layout.add_widget(cancel_btn)
+        btn_layout.add_widget(attach_btn)
+        
+        content.add_widget(chooser)
+        content.add_widget(btn_layout)
+        
+        popup = Popup(
+            title='Attach Photos',
+            content=content,
+            size_hint=(0.95, 0.9)
+        )
+        
+        def attach(instance):
+            popup.dismiss()
+            # Hashing and copying happen on the attachment worker
+            for path in chooser.selection:
+                AppAttachmentWorker.shared().call(
+                    'import_file', path,
+                    on_result=self.on_photo_imported,
+                    on_error=lambda error: self.show_message(
+                        'Could not attach photo:\n{}'.format(error), title='Error'
+                    )
+                )
+        
+        cancel_btn.bind(on_press=popup.dismiss)
+        attach_btn.bind(on_press=attach)
+        
+        popup.open()
+    
+    def on_photo_imported(self, attachment):
+        if self.attachments is None or attachment in self.attachments:
+            return
+        self.set_attachments(self.attachments + [attachment])
+    
+    def request_draft(self):
+        # Queued after get_entry, so a draft lands on top of the saved text
+        self.db.call(
+            'get_draft',
+            self.draft_key(),
+            on_result=partial(self.on_draft_loaded, self.draft_key())
+        )
+    
+    def on_draft_loaded(self, key, draft):
+        if draft is None or key != self.draft_key():
+            return
+        self.fill_fields(*draft)
+        self.show_message('Restored your unsaved draft', title='Draft')
+    
+    def draft_key(self):
+        if self.current_entry_id is None:
+            return NEW_ENTRY_DRAFT
+        return self.current_entry_id
+    
+    def fill_fields(self, title, content):
+        self.filling_fields = True
+        self.title_input.text = title
+        self.content_input.text = content
+        self.filling_fields = False
+        self.draft_changed = False
+    
+    def on_text_changed(self, instance, text):
+        if self.filling_fields:
+            return
+        self.draft_changed = True
+        self.draft_trigger()
+    
+    def flush_draft(self, dt=None):
+        self.draft_trigger.cancel()
+        if not self.draft_changed:
+            return
+        self.draft_changed = False
+        # A draft write still waiting in the queue is superseded by this one
+        if self.draft_request is not None:
+            self.draft_request.cancel()
+        self.draft_request = self.db.call(
+            'save_draft',
+            self.draft_key(),
+            self.title_input.text,
+            self.content_input.text
+        )
+    
+    def discard_draft(self):
+        self.draft_trigger.cancel()
+        self.draft_changed = False
+        if self.draft_request is not None:
+            self.draft_request.cancel()
+            self.draft_request = None
+        self.db.call('delete_draft', self.draft_key())
+    
+    def cancel_entry_request(self):
+        if self.entry_request is not None:
+            self.entry_request.cancel()
+            self.entry_request = None
+        if self.tags_request is not None:
+            self.tags_request.cancel()
+            self.tags_request = None
+        if self.attachments_request is not None:
+            self.attachments_request.cancel()
+            self.attachments_request = None
+    
+    def set_loading(self, loading):
+        self.title_input.disabled = loading
+        self.tags_input.disabled = loading
+        self.attach_btn.disabled = loading or self.attachments is None
+        self.content_input.disabled = loading
+        self.save_btn.disabled = loading
+    
+    def save_entry(self, instance):
+        title = self.title_input.text.strip()
+        content = self.content_input.text.strip()
+        tags = parse_tags(self.tags_input.text)
+        
+        if not title or not content:
+            self.show_message('Please fill in both title and content')
+            return
+        
+        # Saving happens on the database thread; block a second tap meanwhile
+        self.save_btn.disabled = True
+        self.draft_trigger.cancel()
+        if self.current_entry_id is not None:
+            # Update existing entry
+            self.db.call(
+                'update_entry', self.current_entry_id, title, content, tags, self.attachments,
+                on_result=lambda result: self.on_saved('Entry updated successfully'),
+                on_error=self.on_save_failed
+            )
+        else:
+            # Create new entry
+            self.db.call(
+                'add_entry', title, content, tags, self.attachments or [],
+                on_result=lambda entry_id: self.on_saved('Entry saved successfully'),
+                on_error=self.on_save_failed
+            )
+    
+    def on_saved(self, message):
+        self.save_btn.disabled = False
+        self.discard_draft()
+        self.show_message(message)
+        Clock.schedule_once(lambda dt: self.go_back(None), 1)
+    
+    def on_save_failed(self, error):
+        self.save_btn.disabled = False
+        self.show_message('Could not save entry:\n{}'.format(error), title='Error')
+    
+    def show_message(self, message, title='Success'):
+        from kivy.uix.popup import Popup
+        
+        popup = Popup(
+            title=title,
+            content=Label(text=message),
+            size_hint=(0.8, 0.3)
+        )
+        popup.open()
+        Clock.schedule_once(lambda dt: popup.dismiss(), 1.5)
+    
+    def go_back(self, instance):
+        # Unsaved text stays as a draft for the next time this entry opens
+        self.flush_draft()
+        self.manager.current = 'home'
+
+class EntryTextChunk(RecycleDataViewBehavior, Label):
+    # One row of an open entry: the title, the date or a chunk of the body.
+    # Only rows near the viewport exist as widgets, so only they hold a
+    # texture, and each texture covers at most CHUNK_LENGTH characters.
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.halign = 'left'
+        self.valign = 'top'
+        self.index = None
+        self.list_view = None
+    
+    def refresh_view_attrs(self, rv, index, data):
+        self.index = index
+        self.list_view = rv
+        return super().refresh_view_attrs(rv, index, data)
+    
+    def on_texture_size(self, instance, size):
+        # Row heights start as estimates; report the real one once laid out
+        if self.list_view is not None:
+            self.list_view.screen.row_measured(self.index, self.text, size[1])
+
+class EntryTextView(RecycleView):
+    def __init__(self, screen, **kwargs):
+        super().__init__(**kwargs)
+        self.screen = screen
+        
+        self.layout = RecycleBoxLayout(
+            orientation='vertical',
+            size_hint_y=None,
+            default_size=(None, dp(40)),
+            default_size_hint=(1, None)
+        )
+        self.layout.bind(minimum_height=self.layout.setter('height'))
+        self.add_widget(self.layout)
+        self.viewclass = EntryTextChunk
+        # Photo rows name their own view class
+        self.layout.key_viewclass = 'viewclass'
+
+class EntryImageRow(RecycleDataViewBehavior, Thumbnail):
+    # A photo attached to an open entry
+    def __init__(self, **kwargs):
+        super().__init__(thumbnail_size=VIEW_THUMBNAIL_SIZE, **kwargs)
+
+class ViewScreen(Screen):
+    # Rows built for recently opened entries, keyed by (entry id, width)
+    CACHED_ENTRIES = 8
+    
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.db = AppDatabaseWorker.shared()
+        self.current_entry_id = None
+        self.entry_request = None
+        self.attachments_request = None
+        self.row_cache = OrderedDict()
+        self.relayout_trigger = Clock.create_trigger(self.relayout)
+        self.db.add_listener(self.on_entry_changed)
+        Window.bind(width=self.on_window_width)
+        self.build_ui()
+    
+    def build_ui(self):
+        main_layout = BoxLayout(orientation='vertical', padding=dp(10), spacing=dp(10))
+        
+        # Header
+        header_layout = BoxLayout(orientation='horizontal', size_hint_y=None, height=dp(60))
+        
+        back_btn = Button(
+            text='← Back',
+            size_hint_x=0.3,
+            background_color=(0.5, 0.5, 0.5, 1)
+        )
+        back_btn.bind(on_press=self.go_back)
+        
+        title_label = Label(
+            text='View Entry',
+            font_size='18sp',
+            bold=True,
+            size_hint_x=0.3
+        )
+        
+        history_btn = Button(
+            text='History',
+            size_hint_x=0.2,
+            background_color=(0.2, 0.6, 1, 1)
+        )
+        history_btn.bind(on_press=self.show_history)
+        
+        edit_btn = Button(
+            text='Edit',
+            size_hint_x=0.2,
+            background_color=(0.8, 0.6, 0.2, 1)
+        )
+        edit_btn.bind(on_press=self.edit_entry)
+        
+        header_layout.add_widget(back_btn)
+        header_layout.add_widget(title_label)
+        header_layout.add_widget(history_btn)
+        header_layout.add_widget(edit_btn)
+        
+        # Content area
+        self.text_view = EntryTextView(self)
         
-        popup.open()
+        main_layout.add_widget(header_layout)
+        main_layout.add_widget(self.text_view)
+        
+        self.add_widget(main_layout)
     
-    def delete_entry(self, entry_id, popup):
-        self.db.delete_entry(entry_id)
-        popup.dismiss()
-        self.load_entries()
+    def display_entry(self, entry_id):
+        # The full body is only read from the database when it is opened
+        self.current_entry_id = entry_id
+        self.show_message('Loading entry...')
+        
+        if self.entry_request is not None:
+            self.entry_request.cancel()
+        self.entry_request = self.db.call('get_entry', entry_id, on_result=self.show_entry)
     
-    def show_menu(self, instance):
-        content = BoxLayout(orientation='vertical', spacing=dp(10))
-        
-        about_btn = Button(text='About', background_color=(0.2, 0.6, 1, 1))
-        privacy_btn = Button(text='Privacy Policy', background_color=(0.2, 0.6, 1, 1))
-        contact_btn = Button(text='Contact Us', background_color=(0.2, 0.6, 1, 1))
-        terms_btn = Button(text='Terms of Service', background_color=(0.2, 0.6, 1, 1))
-        close_btn = Button(text='Close', background_color=(0.5, 0.5, 0.5, 1))
-        
-        content.add_widget(about_btn)
-        content.add_widget(privacy_btn)
-        content.add_widget(contact_btn)
-        content.add_widget(terms_btn)
-        content.add_widget(close_btn)
+    def show_entry(self, entry):
+        self.entry_request = None
+        if entry is None:
+            self.show_message('This entry no longer exists')
+            return
         
-        popup = Popup(
-            title='Menu',
-            content=content,
-            size_hint=(0.8, 0.6)
+        with profiled('view', 'show entry', '{} words'.format(entry.word_count)):
+            self.text_view.data = self.entry_rows(entry)
+        self.text_view.scroll_y = 1
+        # The rows hold the text now; the screen keeps no reference to it
+        entry.release_content()
+        self.load_attachments(entry.id)
+    
+    def load_attachments(self, entry_id):
+        if self.attachments_request is not None:
+            self.attachments_request.cancel()
+        self.attachments_request = self.db.call(
+            'get_entry_attachments', entry_id, on_result=self.show_attachments
         )
-        
-        about_btn.bind(on_press=lambda x: self.navigate_to('about', popup))
-        privacy_btn.bind(on_press=lambda x: self.navigate_to('privacy', popup))
-        contact_btn.bind(on_press=lambda x: self.navigate_to('contact', popup))
-        terms_btn.bind(on_press=lambda x: self.navigate_to('terms', popup))
-        close_btn.bind(on_press=popup.dismiss)
-        
-        popup.open()
     
-    def navigate_to(self, screen_name, popup):
-        popup.dismiss()
-        self.manager.current = screen_name
+    def show_attachments(self, attachments):
+        self.attachments_request = None
+        # Photos go between the heading rows and the text
+        for name, size in reversed(attachments):
+            self.text_view.data.insert(
+                3, {'viewclass': 'EntryImageRow', 'name': name, 'height': dp(240)}
+            )
     
-    def on_enter(self):
-        self.load_entries()
+    def show_message(self, message):
+        self.text_view.data = [self.text_row(message, '16sp', color=(0.6, 0.6, 0.6, 1))]
+    
+    def entry_rows(self, entry):
+        key = (entry.id, self.text_width())
+        rows = self.row_cache.get(key)
+        if rows is not None:
+            self.row_cache.move_to_end(key)
+            return rows
+        
+        formatted_date = entry.format_date('%B %d, %Y - %I:%M %p')
+        rows = [
+            self.text_row(entry.title, '20sp', bold=True, padding=(0, dp(5))),
+            self.text_row(formatted_date, '14sp', color=(0.6, 0.6, 0.6, 1), padding=(0, dp(5))),
+            self.text_row('─' * 50, '14sp', padding=(0, dp(5))),
+        ]
+        rows.extend(self.text_row(chunk, '16sp') for chunk in split_into_chunks(entry.content))
+        
+        # The row dicts are shared with the list data, so measured heights
+        # are kept for the next time this entry is opened at this width.
+        self.row_cache[key] = rows
+        while len(self.row_cache) > self.CACHED_ENTRIES:
+            self.row_cache.popitem(last=False)
+        return rows
+    
+    def text_row(self, text, font_size, bold=False, color=(1, 1, 1, 1), padding=(0, 0)):
+        width = self.text_width()
+        return {
+            'text': text,
+            'font_size': font_size,
+            'bold': bold,
+            'color': color,
+            'padding': padding,
+            'text_size': (width, None),
+            'height': self.estimate_height(text, sp(float(font_size[:-2])), width) + padding[1] * 2,
+        }
+    
+    def text_width(self):
+        return int(Window.width - dp(40))
+    
+    def estimate_height(self, text, font_size, width):
+        # Rough line count for an average glyph about half as wide as the
+        # font size; the real height replaces it once the row is rendered.
+        per_line = max(int(width / (font_size * 0.5)), 1)
+        lines = sum(len(line) // per_line + 1 for line in text.split('\n'))
+        return lines * font_size * 1.2
+    
+    def row_measured(self, index, text, height):
+        data = self.text_view.data
+        if index is None or index >= len(data) or data[index].get('text') != text:
+            return
+        if abs(data[index]['height'] - height) >= 1:
+            data[index]['height'] = height
+            self.relayout_trigger()
+    
+    def relayout(self, dt):
+        self.text_view.refresh_from_data()
+    
+    def on_window_width(self, window, width):
+        # Rows are wrapped for one width; rebuild them after a rotation
+        if self.current_entry_id is not None and self.entry_request is None:
+            self.display_entry(self.current_entry_id)
+    
+    def on_entry_changed(self, change, entry_id):
+        if change == 'restored':
+            self.row_cache.clear()
+        for key in [key for key in self.row_cache if key[0] == entry_id]:
+            del self.row_cache[key]
+    
+    def edit_entry(self, instance):
+        self.manager.current = 'add_edit'
+        self.manager.get_screen('add_edit').setup_for_edit(self.current_entry_id)
+    
+    def show_history(self, instance):
+        self.manager.current = 'history'
+        self.manager.get_screen('history').display_entry(self.current_entry_id)
+    
+    def go_back(self, instance):
+        self.manager.current = 'home'
 
-class AddEditScreen(Screen):
+class HistoryScreen(ViewScreen):
+    # Earlier versions of one entry, newest first. The list comes from
+    # stored titles and counts only; a version's text is rebuilt when it
+    # is picked, and can then be restored.
+    CACHED_ENTRIES = 0
+    
     def __init__(self, **kwargs):
+        self.selected_revision = None
         super().__init__(**kwargs)
-        self.db = DatabaseManager()
-        self.current_entry = None
-        self.build_ui()
     
     def build_ui(self):
         main_layout = BoxLayout(orientation='vertical', padding=dp(10), spacing=dp(10))
@@ -331,109 +1649,204 @@ class AddEditScreen(Screen):
         )
         back_btn.bind(on_press=self.go_back)
         
-        self.title_label = Label(
-            text='New Entry',
+        title_label = Label(
+            text='History',
             font_size='18sp',
             bold=True,
             size_hint_x=0.4
         )
         
-        save_btn = Button(
-            text='Save',
+        self.restore_btn = Button(
+            text='Restore',
             size_hint_x=0.3,
+            disabled=True,
             background_color=(0.2, 0.8, 0.2, 1)
         )
-        save_btn.bind(on_press=self.save_entry)
+        self.restore_btn.bind(on_press=self.restore_revision)
         
         header_layout.add_widget(back_btn)
-        header_layout.add_widget(self.title_label)
-        header_layout.add_widget(save_btn)
+        header_layout.add_widget(title_label)
+        header_layout.add_widget(self.restore_btn)
+        
+        # Versions
+        scroll = ScrollView(size_hint_y=0.35)
+        self.revision_list = GridLayout(cols=1, spacing=dp(5), size_hint_y=None)
+        self.revision_list.bind(minimum_height=self.revision_list.setter('height'))
+        scroll.add_widget(self.revision_list)
+        
+        # Text of the picked version
+        self.text_view = EntryTextView(self)
+        
+        main_layout.add_widget(header_layout)
+        main_layout.add_widget(scroll)
+        main_layout.add_widget(self.text_view)
+        
+        self.add_widget(main_layout)
+    
+    def display_entry(self, entry_id):
+        self.current_entry_id = entry_id
+        self.selected_revision = None
+        self.restore_btn.disabled = True
+        self.revision_list.clear_widgets()
+        self.show_message('Loading history...')
+        self.db.call('get_revisions', entry_id, on_result=partial(self.show_revisions, entry_id))
+    
+    def show_revisions(self, entry_id, revisions):
+        if entry_id != self.current_entry_id:
+            return
+        if not revisions:
+            self.show_message('No earlier versions yet\nEvery save keeps the version it replaces')
+            return
+        for revision, saved_at, title, word_count, size in revisions:
+            revision_btn = Button(
+                text='{}  ·  {}\n{} words'.format(
+                    time.strftime('%b %d, %Y - %I:%M %p', time.localtime(saved_at)),
+                    title, word_count
+                ),
+                halign='center',
+                shorten=True,
+                size_hint_y=None,
+                height=dp(50),
+                background_color=(0.3, 0.3, 0.3, 1)
+            )
+            revision_btn.bind(on_press=partial(self.show_revision, revision))
+            self.revision_list.add_widget(revision_btn)
+        self.show_message('Pick a version to read it')
+    
+    def show_revision(self, revision, instance):
+        self.selected_revision = None
+        self.restore_btn.disabled = True
+        self.show_message('Loading version...')
+        if self.entry_request is not None:
+            self.entry_request.cancel()
+        self.entry_request = self.db.call(
+            'get_revision', self.current_entry_id, revision,
+            on_result=partial(self.on_revision_loaded, revision)
+        )
+    
+    def load_attachments(self, entry_id):
+        # Attachments are not versioned
+        pass
+    
+    def on_revision_loaded(self, revision, entry):
+        self.show_entry(entry)
+        if entry is not None:
+            self.selected_revision = revision
+            self.restore_btn.disabled = False
+    
+    def restore_revision(self, instance):
+        if self.selected_revision is None:
+            return
+        self.restore_btn.disabled = True
+        self.db.call('restore_revision', self.current_entry_id, self.selected_revision,
+                     on_result=self.on_restored)
+    
+    def on_restored(self, restored):
+        self.go_back(None)
+    
+    def on_window_width(self, window, width):
+        # Only the picked version's rows depend on the width
+        if self.selected_revision is not None and self.entry_request is None:
+            self.show_revision(self.selected_revision, None)
+    
+    def on_entry_changed(self, change, entry_id):
+        # An edit or restore adds a version; show the list as it is now
+        if entry_id == self.current_entry_id and self.manager is not None \
+                and self.manager.current_screen is self:
+            self.display_entry(entry_id)
+    
+    def go_back(self, instance):
+        self.manager.current = 'view'
+        self.manager.get_screen('view').display_entry(self.current_entry_id)
+
+class UnlockScreen(Screen):
+    # Shown instead of the list while an encrypted diary is locked
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.db = AppDatabaseWorker.shared()
+        self.build_ui()
+    
+    def build_ui(self):
+        main_layout = BoxLayout(orientation='vertical', padding=dp(30), spacing=dp(10))
         
-        # Title input
         title_label = Label(
-            text='Title:',
+            text='My Personal Diary',
+            font_size='20sp',
+            bold=True,
             size_hint_y=None,
-            height=dp(30),
-            text_size=(None, None),
-            halign='left'
+            height=dp(60)
         )
         
-        self.title_input = TextInput(
+        self.passphrase_input = TextInput(
+            hint_text='Passphrase',
+            password=True,
             multiline=False,
             size_hint_y=None,
             height=dp(40),
             font_size='16sp'
         )
+        self.passphrase_input.bind(on_text_validate=self.unlock)
         
-        # Content input
-        content_label = Label(
-            text='Write your thoughts:',
+        self.unlock_btn = Button(
+            text='Unlock',
             size_hint_y=None,
-            height=dp(30),
-            text_size=(None, None),
-            halign='left'
+            height=dp(50),
+            background_color=(0.2, 0.6, 1, 1)
         )
+        self.unlock_btn.bind(on_press=self.unlock)
         
-        self.content_input = TextInput(
-            multiline=True,
-            font_size='16sp'
+        self.status_label = Label(
+            text='This diary is encrypted',
+            size_hint_y=None,
+            height=dp(30),
+            color=(0.6, 0.6, 0.6, 1)
         )
         
-        main_layout.add_widget(header_layout)
+        main_layout.add_widget(Label())
         main_layout.add_widget(title_label)
-        main_layout.add_widget(self.title_input)
-        main_layout.add_widget(content_label)
-        main_layout.add_widget(self.content_input)
+        main_layout.add_widget(self.status_label)
+        main_layout.add_widget(self.passphrase_input)
+        main_layout.add_widget(self.unlock_btn)
+        main_layout.add_widget(Label())
         
         self.add_widget(main_layout)
     
-    def setup_for_new_entry(self):
-        self.current_entry = None
-        self.title_label.text = 'New Entry'
-        self.title_input.text = ''
-        self.content_input.text = ''
-    
-    def setup_for_edit(self, entry):
-        self.current_entry = entry
-        self.title_label.text = 'Edit Entry'
-        self.title_input.text = entry[1]  # title
-        self.content_input.text = entry[2]  # content
-    
-    def save_entry(self, instance):
-        title = self.title_input.text.strip()
-        content = self.content_input.text.strip()
-        
-        if not title or not content:
-            self.show_message('Please fill in both title and content')
+    def unlock(self, instance):
+        if not self.passphrase_input.text:
             return
-        
-        if self.current_entry:
-            # Update existing entry
-            self.db.update_entry(self.current_entry[0], title, content)
-            message = 'Entry updated successfully'
-        else:
-            # Create new entry
-            self.db.add_entry(title, content)
-            message = 'Entry saved successfully'
-        
-        self.show_message(message)
-        Clock.schedule_once(lambda dt: self.go_back(None), 1)
-    
-    def show_message(self, message):
-        popup = Popup(
-            title='Success',
-            content=Label(text=message),
-            size_hint=(0.8, 0.3)
-        )
-        popup.open()
-        Clock.schedule_once(lambda dt: popup.dismiss(), 1.5)
+        # Deriving the key takes a moment; it runs on the database thread
+        self.unlock_btn.disabled = True
+        self.status_label.text = 'Unlocking...'
+        self.db.call('unlock', self.passphrase_input.text,
+                     on_result=self.on_unlocked, on_error=self.on_unlock_failed)
     
-    def go_back(self, instance):
+    def on_unlocked(self, unlocked):
+        self.unlock_btn.disabled = False
+        self.passphrase_input.text = ''
+        if not unlocked:
+            self.status_label.text = 'Wrong passphrase'
+            return
+        self.status_label.text = 'This diary is encrypted'
         self.manager.current = 'home'
+        self.manager.get_screen('home').load_entries()
+        # Finish encrypting if the app stopped halfway last time
+        App.get_running_app().encrypt_entries()
+    
+    def on_unlock_failed(self, error):
+        self.unlock_btn.disabled = False
+        self.status_label.text = str(error)
 
-class ViewScreen(Screen):
+class StatsScreen(Screen):
+    # Calendar of the entries written each day of a month, with totals,
+    # streaks and entries from the same day in earlier years. Everything
+    # comes from daily_stats and the month-day index, not from scanning.
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+        self.db = AppDatabaseWorker.shared()
+        today = date.today()
+        self.year = today.year
+        self.month = today.month
+        self.db.add_listener(self.on_entry_changed)
         self.build_ui()
     
     def build_ui(self):
@@ -450,94 +1863,176 @@ class ViewScreen(Screen):
         back_btn.bind(on_press=self.go_back)
         
         title_label = Label(
-            text='View Entry',
+            text='Calendar & Stats',
             font_size='18sp',
             bold=True,
-            size_hint_x=0.4
-        )
-        
-        edit_btn = Button(
-            text='Edit',
-            size_hint_x=0.3,
-            background_color=(0.8, 0.6, 0.2, 1)
+            size_hint_x=0.7
         )
-        edit_btn.bind(on_press=self.edit_entry)
         
         header_layout.add_widget(back_btn)
         header_layout.add_widget(title_label)
-        header_layout.add_widget(edit_btn)
-        
-        # Content area
-        scroll = ScrollView()
-        self.content_layout = BoxLayout(orientation='vertical', spacing=dp(10), size_hint_y=None)
-        self.content_layout.bind(minimum_height=self.content_layout.setter('height'))
-        
-        scroll.add_widget(self.content_layout)
-        
-        main_layout.add_widget(header_layout)
-        main_layout.add_widget(scroll)
-        
-        self.add_widget(main_layout)
-    
-    def display_entry(self, entry):
-        self.current_entry = entry
-        self.content_layout.clear_widgets()
-        
-        entry_id, title, content, date_str = entry
         
-        # Parse date
-        try:
-            date_obj = datetime.fromisoformat(date_str)
-            formatted_date = date_obj.strftime('%B %d, %Y - %I:%M %p')
-        except:
-            formatted_date = date_str
+        # Month navigation
+        month_layout = BoxLayout(orientation='horizontal', size_hint_y=None, height=dp(40))
+        
+        previous_btn = Button(text='<', size_hint_x=0.2, background_color=(0.2, 0.6, 1, 1))
+        previous_btn.bind(on_press=lambda x: self.change_month(-1))
+        
+        self.month_label = Label(font_size='16sp', bold=True, size_hint_x=0.6)
+        
+        next_btn = Button(text='>', size_hint_x=0.2, background_color=(0.2, 0.6, 1, 1))
+        next_btn.bind(on_press=lambda x: self.change_month(1))
+        
+        month_layout.add_widget(previous_btn)
+        month_layout.add_widget(self.month_label)
+        month_layout.add_widget(next_btn)
+        
+        # Calendar: weekday names, then six weeks of day cells
+        calendar_layout = GridLayout(cols=7, size_hint_y=None, height=dp(24 + 6 * 40))
+        for name in calendar.day_abbr:
+            calendar_layout.add_widget(Label(
+                text=name[:2],
+                font_size='12sp',
+                color=(0.6, 0.6, 0.6, 1),
+                size_hint_y=None,
+                height=dp(24)
+            ))
+        self.day_labels = []
+        for index in range(42):
+            day_label = Label(
+                markup=True,
+                font_size='14sp',
+                halign='center',
+                size_hint_y=None,
+                height=dp(40)
+            )
+            calendar_layout.add_widget(day_label)
+            self.day_labels.append(day_label)
         
-        # Title
-        title_label = Label(
-            text=title,
-            font_size='20sp',
-            bold=True,
-            text_size=(Window.width - dp(40), None),
-            halign='left',
-            valign='top',
-            size_hint_y=None
+        self.month_summary = Label(
+            font_size='14sp',
+            color=(0.8, 0.8, 0.8, 1),
+            size_hint_y=None,
+            height=dp(24)
         )
-        title_label.bind(texture_size=title_label.setter('size'))
         
-        # Date
-        date_label = Label(
-            text=formatted_date,
+        self.totals_label = Label(
+            text='Loading...',
             font_size='14sp',
-            color=(0.6, 0.6, 0.6, 1),
-            text_size=(Window.width - dp(40), None),
             halign='left',
             valign='top',
-            size_hint_y=None
+            size_hint_y=None,
+            height=dp(60)
         )
-        date_label.bind(texture_size=date_label.setter('size'))
+        self.totals_label.bind(width=lambda instance, width: setattr(instance, 'text_size', (width, None)))
         
-        # Separator
-        separator = Label(text='─' * 50, size_hint_y=None, height=dp(20))
-        
-        # Content
-        content_label = Label(
-            text=content,
+        # On this day in earlier years
+        on_this_day_label = Label(
+            text='On this day',
             font_size='16sp',
-            text_size=(Window.width - dp(40), None),
-            halign='left',
-            valign='top',
-            size_hint_y=None
+            bold=True,
+            size_hint_y=None,
+            height=dp(30)
         )
-        content_label.bind(texture_size=content_label.setter('size'))
+        scroll = ScrollView()
+        self.on_this_day_layout = BoxLayout(orientation='vertical', spacing=dp(5), size_hint_y=None)
+        self.on_this_day_layout.bind(minimum_height=self.on_this_day_layout.setter('height'))
+        scroll.add_widget(self.on_this_day_layout)
         
-        self.content_layout.add_widget(title_label)
-        self.content_layout.add_widget(date_label)
-        self.content_layout.add_widget(separator)
-        self.content_layout.add_widget(content_label)
+        main_layout.add_widget(header_layout)
+        main_layout.add_widget(month_layout)
+        main_layout.add_widget(calendar_layout)
+        main_layout.add_widget(self.month_summary)
+        main_layout.add_widget(self.totals_label)
+        main_layout.add_widget(on_this_day_label)
+        main_layout.add_widget(scroll)
+        
+        self.add_widget(main_layout)
     
-    def edit_entry(self, instance):
-        self.manager.current = 'add_edit'
-        self.manager.get_screen('add_edit').setup_for_edit(self.current_entry)
+    def on_enter(self):
+        self.load()
+    
+    def load(self):
+        self.show_month()
+        self.db.call('get_writing_stats', on_result=self.show_totals)
+        today = date.today()
+        self.db.call(
+            'get_entries_on_this_day', today.month, today.day, today.year,
+            on_result=self.show_on_this_day
+        )
+    
+    def change_month(self, delta):
+        month = self.year * 12 + self.month - 1 + delta
+        self.year, self.month = divmod(month, 12)
+        self.month += 1
+        self.show_month()
+    
+    def show_month(self):
+        self.month_label.text = date(self.year, self.month, 1).strftime('%B %Y')
+        self.db.call(
+            'get_month_stats', self.year, self.month,
+            on_result=partial(self.on_month_loaded, (self.year, self.month))
+        )
+    
+    def on_month_loaded(self, month, days):
+        if month != (self.year, self.month):
+            return
+        counts = {int(day[8:]): entry_count for day, entry_count, word_count in days}
+        weeks = calendar.monthcalendar(self.year, self.month)
+        cells = [day for week in weeks for day in week]
+        for index, day_label in enumerate(self.day_labels):
+            day = cells[index] if index < len(cells) else 0
+            if not day:
+                day_label.text = ''
+            elif day in counts:
+                day_label.text = '[b][color=3399ff]{}[/color][/b]\n[size=11sp]{}[/size]'.format(
+                    day, counts[day]
+                )
+            else:
+                day_label.text = str(day)
+        
+        self.month_summary.text = '{} entries  ·  {} words this month'.format(
+            sum(row[1] for row in days), sum(row[2] for row in days)
+        )
+    
+    def show_totals(self, totals):
+        self.totals_label.text = (
+            '{entries} entries  ·  {words} words  ·  {days} days written\n'
+            'Current streak: {current_streak} days\n'
+            'Longest streak: {longest_streak} days'
+        ).format(**totals)
+    
+    def show_on_this_day(self, entries):
+        self.on_this_day_layout.clear_widgets()
+        if not entries:
+            self.on_this_day_layout.add_widget(Label(
+                text='Nothing written on this day in earlier years',
+                font_size='14sp',
+                color=(0.6, 0.6, 0.6, 1),
+                size_hint_y=None,
+                height=dp(30)
+            ))
+            return
+        for entry in entries:
+            entry_btn = Button(
+                text='{}  {}'.format(entry.format_date('%Y'), entry.title),
+                font_size='14sp',
+                shorten=True,
+                size_hint_y=None,
+                height=dp(36),
+                background_color=(0.3, 0.3, 0.3, 1)
+            )
+            entry_btn.bind(width=lambda instance, width: setattr(instance, 'text_size', (width - dp(10), None)))
+            entry_btn.bind(on_press=partial(self.view_entry, entry.id))
+            self.on_this_day_layout.add_widget(entry_btn)
+    
+    def view_entry(self, entry_id, instance):
+        self.manager.current = 'view'
+        self.manager.get_screen('view').display_entry(entry_id)
+    
+    def on_entry_changed(self, change, entry_id):
+        if self.manager is not None and self.manager.current_screen is self:
+            self.load()
     
     def go_back(self, instance):
         self.manager.current = 'home'
@@ -664,6 +2159,8 @@ All diary entries, including titles, content, and timestamps, are stored locally
 Data Security:
 Since all data is stored locally on your device, the security of your diary entries depends on your device's security measures. We recommend using device lock screens and keeping your device secure.
 
+You can also encrypt your diary with a passphrase (Menu > Encryption). Titles, previews and entry text are then stored encrypted and can only be read after unlocking the app. Dates, word counts and tag names stay unencrypted. The passphrase is never stored and cannot be recovered if you forget it.
+
 Third-Party Services:
 Personal Diary does not integrate with any third-party services that collect personal information. We do not use analytics, advertising, or tracking services.
 
@@ -857,20 +2354,153 @@ For questions about these Terms of Service, please contact us at tangsabas@gmail
     def go_back(self, instance):
         self.manager.current = 'home'
 
+class LazyScreenManager(ScreenManager):
+    # Screens registered with a factory are only built the first time
+    # something navigates to them or asks for them by name.
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.screen_factories = {}
+    
+    def register_screen(self, name, factory):
+        self.screen_factories[name] = factory
+    
+    def get_screen(self, name):
+        factory = self.screen_factories.pop(name, None)
+        if factory is not None:
+            started = time.perf_counter()
+            self.add_widget(factory(name=name))
+            Logger.info('Screens: built {} in {:.0f} ms'.format(
+                name, (time.perf_counter() - started) * 1000
+            ))
+        return super().get_screen(name)
+    
+    def on_current(self, instance, value):
+        if profiler is None:
+            super().on_current(instance, value)
+            return
+        started = time.perf_counter()
+        
+        def on_complete(transition):
+            transition.unbind(on_complete=on_complete)
+            profiler.record('screen', 'transition to ' + value, time.perf_counter() - started)
+        
+        # Bound first: NoTransition completes inside on_current itself
+        self.transition.bind(on_complete=on_complete)
+        super().on_current(instance, value)
+        # The synchronous part, including building the screen on first use
+        profiler.record('screen', 'switch to ' + value, time.perf_counter() - started)
+    
+    def has_screen(self, name):
+        return name in self.screen_factories or super().has_screen(name)
+
 class PersonalDiaryApp(App):
     def build(self):
-        sm = ScreenManager()
+        sm = LazyScreenManager()
         
-        # Add all screens
+        # Only the home screen is built up front
         sm.add_widget(HomeScreen(name='home'))
-        sm.add_widget(AddEditScreen(name='add_edit'))
-        sm.add_widget(ViewScreen(name='view'))
-        sm.add_widget(AboutScreen(name='about'))
-        sm.add_widget(PrivacyScreen(name='privacy'))
-        sm.add_widget(ContactScreen(name='contact'))
-        sm.add_widget(TermsScreen(name='terms'))
-        
+        sm.register_screen('add_edit', AddEditScreen)
+        sm.register_screen('view', ViewScreen)
+        sm.register_screen('history', HistoryScreen)
+        sm.register_screen('stats', StatsScreen)
+        sm.register_screen('unlock', UnlockScreen)
+        sm.register_screen('about', AboutScreen)
+        sm.register_screen('privacy', PrivacyScreen)
+        sm.register_screen('contact', ContactScreen)
+        sm.register_screen('terms', TermsScreen)
+        
+        startup_timer.mark('home built')
         return sm
+    
+    def on_start(self):
+        Window.bind(on_flip=self.on_first_frame)
+        if profiler is not None:
+            # Clock only keeps weak references to its callbacks
+            self.frame_monitor = FrameMonitor()
+            self.frame_monitor.start()
+    
+    def on_first_frame(self, window):
+        # Entries are requested only after the empty home screen is drawn
+        window.unbind(on_flip=self.on_first_frame)
+        startup_timer.mark('first frame')
+        self.root.get_screen('home').load_entries()
+        self.compress_entries()
+        self.purge_plaintext()
+        self.prune_attachments()
+        self.back_up_if_due()
+        Clock.schedule_interval(self.back_up_if_due, BACKUP_CHECK_INTERVAL)
+    
+    def back_up_if_due(self, dt=None):
+        # A backup a day, copied on the backup thread while the app is used
+        AppBackupWorker.shared().call(
+            'backup_due',
+            on_result=lambda due: self.create_backup() if due else None
+        )
+    
+    def create_backup(self, on_result=None, on_error=None):
+        AppBackupWorker.shared().call('create', on_result=on_result, on_error=on_error)
+    
+    def prune_attachments(self):
+        # Photos of deleted entries, and ones attached but never saved, are
+        # removed from disk once per start, unless a kept backup still
+        # refers to them
+        def keep(names, backup_names):
+            AppAttachmentWorker.shared().call('keep_only', set(names) | backup_names)
+        
+        AppDatabaseWorker.shared().call(
+            'prune_attachments',
+            on_result=lambda names: AppBackupWorker.shared().call(
+                'attachment_names', on_result=partial(keep, names)
+            )
+        )
+    
+    def compress_entries(self, dt=None):
+        # Existing bodies are compressed a batch at a time, leaving room in
+        # the worker queue for whatever the screens ask for meanwhile.
+        AppDatabaseWorker.shared().call('compress_entries', on_result=self.on_entries_compressed)
+    
+    def on_entries_compressed(self, count):
+        if count:
+            Clock.schedule_once(self.compress_entries, 0.5)
+    
+    def encrypt_entries(self, dt=None):
+        # Same batching as compression; once every row is encrypted the
+        # file is rewritten so no plain text is left in free pages.
+        AppDatabaseWorker.shared().call('encrypt_entries', on_result=self.on_entries_encrypted)
+    
+    def on_entries_encrypted(self, count):
+        if count:
+            Clock.schedule_once(self.encrypt_entries, 0.1)
+        else:
+            self.purge_plaintext()
+    
+    def purge_plaintext(self):
+        # Backups made so far hold the diary unencrypted; once no plain text
+        # is left in the file they are replaced by a fresh one. Until both
+        # are done the diary says so, and the next start or unlock retries.
+        db = AppDatabaseWorker.shared()
+        
+        def replace_backups(result):
+            AppBackupWorker.shared().call('replace_all', on_result=lambda path: db.call('purge_done'))
+        
+        db.call('purge_pending', on_result=lambda pending: db.call(
+            'purge_plaintext', on_result=replace_backups
+        ) if pending else None)
+    
+    def on_pause(self):
+        # Android may kill a paused app; get pending draft text to disk first
+        self.flush_drafts()
+        return True
+    
+    def on_stop(self):
+        self.flush_drafts()
+        AppDatabaseWorker.shared().stop()
+        AppAttachmentWorker.shared().stop()
+        AppBackupWorker.shared().stop()
+    
+    def flush_drafts(self):
+        if 'add_edit' in self.root.screen_names:
+            self.root.get_screen('add_edit').flush_draft()
 
 if __name__ == '__main__':
     PersonalDiaryApp().run()
\ No newline at end of file
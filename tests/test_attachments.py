@@ -0,0 +1,76 @@
+import os
+
+import pytest
+
+from diary import AttachmentStore, DatabaseManager, ThumbnailCache
+
+def make_store(tmp_path, thumbnail_bytes=1024 * 1024):
+    return AttachmentStore(str(tmp_path / 'attachments'), str(tmp_path / 'thumbnails'),
+                           thumbnail_bytes)
+
+def write_file(path, data):
+    path.write_bytes(data)
+    return str(path)
+
+def test_same_file_is_stored_once(tmp_path):
+    store = make_store(tmp_path)
+    one = store.import_file(write_file(tmp_path / 'one.JPG', b'same bytes'))
+    two = store.import_file(write_file(tmp_path / 'two.jpg', b'same bytes'))
+    other = store.import_file(write_file(tmp_path / 'other.png', b'other bytes'))
+    assert one == two
+    assert one[0].endswith('.jpg') and one[1] == len(b'same bytes')
+    assert other != one
+    assert os.path.exists(store.file_path(one[0]))
+    with pytest.raises(ValueError):
+        store.import_file(write_file(tmp_path / 'notes.txt', b'text'))
+
+def test_keep_only_removes_unused_files(tmp_path):
+    store = make_store(tmp_path)
+    kept = store.import_file(write_file(tmp_path / 'kept.png', b'kept'))[0]
+    dropped = store.import_file(write_file(tmp_path / 'dropped.png', b'dropped'))[0]
+    assert store.keep_only([kept]) == 1
+    assert os.path.exists(store.file_path(kept))
+    assert not os.path.exists(store.file_path(dropped))
+    assert store.keep_only([kept]) == 0
+
+def test_thumbnails(tmp_path):
+    Image = pytest.importorskip('PIL.Image')
+    source = str(tmp_path / 'photo.png')
+    Image.new('RGB', (400, 200), (200, 30, 30)).save(source)
+    store = make_store(tmp_path)
+    name = store.import_file(source)[0]
+    path = store.thumbnail(name, 100)
+    with Image.open(path) as thumbnail:
+        assert thumbnail.size == (100, 50)
+        assert thumbnail.format == 'JPEG'
+    assert store.thumbnail(name, 100) == path
+    # Thumbnails go with their attachment
+    store.keep_only([])
+    assert not os.path.exists(path)
+
+def test_thumbnail_cache_drops_least_recently_used(tmp_path):
+    cache = ThumbnailCache(str(tmp_path / 'thumbnails'), max_bytes=250)
+    for name in ('a', 'b', 'c'):
+        write_file(tmp_path / 'thumbnails' / name, b'x' * 100)
+        if name == 'c':
+            # Used since, so b is the oldest
+            assert cache.get('a') is not None
+        cache.put(name)
+    assert sorted(cache.files) == ['a', 'c']
+    assert not os.path.exists(cache.path('b'))
+    assert cache.size == 200
+    # The order survives a restart through the file times
+    again = ThumbnailCache(str(tmp_path / 'thumbnails'), max_bytes=250)
+    assert sorted(again.files) == ['a', 'c'] and again.size == 200
+
+def test_entry_attachments_and_pruning(tmp_path):
+    db = DatabaseManager(str(tmp_path / 'diary.db'))
+    photos = [('a' * 64 + '.jpg', 10), ('b' * 64 + '.png', 20)]
+    entry_id = db.add_entry('Photos', 'two', attachments=photos)
+    assert db.get_entry_attachments(entry_id) == photos
+    assert db.get_entry(entry_id).cover == photos[0][0]
+    db.update_entry(entry_id, 'Photos', 'one', attachments=photos[1:])
+    assert db.get_entry_summary(entry_id).cover == photos[1][0]
+    assert db.prune_attachments() == [photos[1][0]]
+    db.delete_entry(entry_id)
+    assert db.prune_attachments() == []
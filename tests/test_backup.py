@@ -0,0 +1,144 @@
+import os
+import shutil
+import sqlite3
+
+import pytest
+
+from diary import AttachmentStore, BackupStore, DatabaseManager, DiaryInUse, UnencryptedBackup
+from diary.attachments import attachments_dir, thumbnails_dir
+from diary.backup import verify_database
+
+def open_diary(tmp_path):
+    return DatabaseManager(str(tmp_path / 'diary.db'))
+
+def contents(db):
+    return sorted((entry.title, entry.content) for entry in db.iter_entries())
+
+def older_copies(store, path, *stamps):
+    # Copies of a backup under the names of backups made at stamps
+    for stamp in stamps:
+        shutil.copy(path, os.path.join(store.directory, 'diary-{}.db'.format(stamp)))
+
+def test_create_list_and_rotate(tmp_path):
+    db = open_diary(tmp_path)
+    db.add_entry('Kept', 'in every backup')
+    store = BackupStore(db.db_path, keep=3)
+    assert store.backup_due()
+    path = store.create(pause=0)
+    verify_database(path)
+    assert not store.backup_due()
+    older_copies(store, path, '20200101-100000', '20200102-100000', '20200103-100000')
+    assert [backup[0] for backup in store.list_backups()][0] == path
+    assert len(store.list_backups()) == 4
+    assert store.rotate() == 1
+    names = [os.path.basename(backup[0]) for backup in store.list_backups()]
+    assert names == [os.path.basename(path), 'diary-20200103-100000.db', 'diary-20200102-100000.db']
+
+def test_verify_database_rejects_what_is_no_diary(tmp_path):
+    with pytest.raises(ValueError):
+        verify_database(str(tmp_path / 'missing.db'))
+    garbage = tmp_path / 'garbage.db'
+    garbage.write_bytes(b'not a database at all' * 100)
+    with pytest.raises(ValueError):
+        verify_database(str(garbage))
+    other = sqlite3.connect(str(tmp_path / 'other.db'))
+    other.execute('CREATE TABLE notes (text TEXT)')
+    other.commit()
+    other.close()
+    with pytest.raises(ValueError):
+        verify_database(str(tmp_path / 'other.db'))
+
+def test_restore_brings_the_diary_back(tmp_path):
+    db = open_diary(tmp_path)
+    first = db.add_entry('First', 'as backed up')
+    backup = BackupStore(db.db_path).create(pause=0)
+    db.update_entry(first, 'First', 'changed later')
+    db.add_entry('Second', 'added later')
+    changes = []
+    db.add_listener(lambda change, entry_id: changes.append((change, entry_id)))
+    assert db.restore_backup(backup) == []
+    assert changes == [('restored', None)]
+    assert contents(db) == [('First', 'as backed up')]
+    assert db.get_entry(first).content == 'as backed up'
+    # Still usable for new entries afterwards
+    db.add_entry('Third', 'after the restore')
+    assert contents(db) == [('First', 'as backed up'), ('Third', 'after the restore')]
+
+def test_restore_refuses_a_damaged_backup(tmp_path):
+    db = open_diary(tmp_path)
+    db.add_entry('First', 'stays')
+    damaged = tmp_path / 'damaged.db'
+    damaged.write_bytes(b'SQLite format 3\x00' + b'\xff' * 4000)
+    with pytest.raises(ValueError):
+        db.restore_backup(str(damaged))
+    assert contents(db) == [('First', 'stays')]
+
+def test_encrypted_diary_asks_before_an_unencrypted_restore(tmp_path):
+    pytest.importorskip('cryptography')
+    db = open_diary(tmp_path)
+    db.add_entry('First', 'before encryption')
+    store = BackupStore(db.db_path)
+    older_copies(store, store.create(pause=0), '20200101-100000', '20200102-100000')
+    plain = os.path.join(store.directory, 'diary-20200102-100000.db')
+    db.enable_encryption('correct horse')
+    while db.encrypt_entries():
+        pass
+    db.purge_plaintext()
+    db.add_entry('Second', 'after encryption')
+    with pytest.raises(UnencryptedBackup):
+        db.restore_backup(plain)
+    kept = str(tmp_path / 'kept.db')
+    shutil.copy(plain, kept)
+    assert contents(db) == [('First', 'before encryption'), ('Second', 'after encryption')]
+    # Backups from before the encryption are gone once it is done
+    encrypted = store.replace_all()
+    assert [backup[0] for backup in store.list_backups()] == [encrypted]
+    db.add_entry('Third', 'lost with the restore')
+    db.restore_backup(encrypted)
+    assert db.is_locked()
+    assert db.unlock('correct horse')
+    assert contents(db) == [('First', 'before encryption'), ('Second', 'after encryption')]
+    # Unless told to go ahead
+    db.restore_backup(kept, allow_unencrypted=True)
+    assert not db.encrypted
+    assert contents(db) == [('First', 'before encryption')]
+
+def test_restore_reports_missing_attachments(tmp_path):
+    db = open_diary(tmp_path)
+    store = AttachmentStore(attachments_dir(db.db_path), thumbnails_dir(db.db_path))
+    photos = []
+    for name in ('one.png', 'two.png'):
+        source = tmp_path / name
+        source.write_bytes(name.encode('ascii') * 50)
+        photos.append(store.import_file(str(source)))
+    entry_id = db.add_entry('Photos', 'two of them', attachments=photos)
+    backups = BackupStore(db.db_path)
+    backup = backups.create(pause=0)
+    assert backups.attachment_names() == {name for name, size in photos}
+    db.update_entry(entry_id, 'Photos', 'none left', attachments=[])
+    assert db.prune_attachments() == []
+    os.remove(store.file_path(photos[1][0]))
+    assert db.restore_backup(backup) == [photos[1][0]]
+    assert db.get_entry_attachments(entry_id) == photos
+
+def test_restore_waits_for_other_connections_to_close(tmp_path):
+    db = open_diary(tmp_path)
+    db.add_entry('First', 'as backed up')
+    backup = BackupStore(db.db_path).create(pause=0)
+    db.add_entry('Second', 'added later')
+    db.conn.execute('PRAGMA busy_timeout = 100')
+    app = open_diary(tmp_path)
+    device = app.device_id
+    with pytest.raises(DiaryInUse):
+        db.restore_backup(backup)
+    assert contents(app) == contents(db) == [('First', 'as backed up'), ('Second', 'added later')]
+    # Both still work after the refusal
+    app.add_entry('Third', 'from the app')
+    assert app.device_id == db.device_id == device
+    app.close()
+    db.restore_backup(backup)
+    assert contents(db) == [('First', 'as backed up')]
+    # And the restored diary can be opened again at once
+    app = open_diary(tmp_path)
+    assert app.device_id == db.device_id != device
+    assert contents(app) == [('First', 'as backed up')]
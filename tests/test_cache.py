@@ -0,0 +1,49 @@
+from diary import DatabaseManager, Entry, EntryCache
+
+def open_diary(tmp_path, cache_bytes=64 * 1024):
+    return DatabaseManager(str(tmp_path / 'diary.db'), cache_bytes)
+
+def test_cache_writes_through(tmp_path):
+    db = open_diary(tmp_path)
+    entry_id = db.add_entry('Title', 'first text')
+    db.cache.hits = db.cache.misses = 0
+    assert db.get_entry(entry_id).content == 'first text'
+    assert db.cache_stats()['hits'] == 1
+    db.update_entry(entry_id, 'Title', 'second text')
+    assert db.get_entry(entry_id).content == 'second text'
+    assert db.cache_stats()['misses'] == 0
+    db.delete_entry(entry_id)
+    assert db.get_entry(entry_id) is None
+    assert db.cache_stats()['entries'] == 0
+
+def test_cached_entries_are_copies(tmp_path):
+    db = open_diary(tmp_path)
+    db.set_compress_threshold(64)
+    entry_id = db.add_entry('Title', 'A body long enough to be compressed on disk. ' * 10)
+    first = db.get_entry(entry_id)
+    first.title = 'Changed by a screen'
+    assert first.content
+    first.release_content()
+    second = db.get_entry(entry_id)
+    assert second is not first
+    assert second.title == 'Title'
+    assert second.content == 'A body long enough to be compressed on disk. ' * 10
+    # Decoded text is never kept in the cache, where it would go uncounted
+    assert db.cache.peek(entry_id).decoded is None
+
+def test_cache_drops_least_recently_used_entries():
+    cache = EntryCache(3 * (EntryCache.ENTRY_OVERHEAD + 20))
+    for entry_id in range(1, 4):
+        cache.put(Entry(entry_id, 'T', body='x' * 19))
+    assert cache.get(1) is not None
+    cache.put(Entry(4, 'T', body='x' * 19))
+    assert sorted(cache.entries) == [1, 3, 4]
+    assert cache.size == 3 * (EntryCache.ENTRY_OVERHEAD + 20)
+    # Entries larger than the whole cache are not kept at all
+    cache.put(Entry(5, 'T', body='x' * 1000))
+    assert cache.peek(5) is None
+    assert sorted(cache.entries) == [1, 3, 4]
+    cache.discard(3)
+    assert cache.stats() == {
+        'hits': 1, 'misses': 0, 'entries': 2, 'bytes': 2 * (EntryCache.ENTRY_OVERHEAD + 20)
+    }
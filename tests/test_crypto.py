@@ -0,0 +1,157 @@
+import os
+
+import pytest
+
+pytest.importorskip('cryptography')
+
+from diary import DatabaseManager, DiaryLocked, EntryCipher
+from diary.crypto import row_field
+
+def test_cipher_round_trip():
+    cipher = EntryCipher(os.urandom(32))
+    blob = cipher.encrypt_text('Dear diary', b'title:1')
+    assert b'Dear diary' not in blob
+    assert cipher.decrypt_text(blob, b'title:1') == 'Dear diary'
+    # A fresh nonce every time
+    assert cipher.encrypt_text('Dear diary', b'title:1') != blob
+
+def test_cipher_rejects_wrong_key_tampering_and_other_fields():
+    cipher = EntryCipher(os.urandom(32))
+    blob = cipher.encrypt(b'secret', b'content:1')
+    with pytest.raises(ValueError):
+        EntryCipher(os.urandom(32)).decrypt(blob, b'content:1')
+    tampered = bytearray(blob)
+    tampered[-1] ^= 1
+    with pytest.raises(ValueError):
+        cipher.decrypt(bytes(tampered), b'content:1')
+    with pytest.raises(ValueError):
+        cipher.decrypt(blob, b'content:2')
+    with pytest.raises(ValueError):
+        cipher.decrypt(blob, b'title:1')
+
+def encrypted_diary(path):
+    db = DatabaseManager(str(path))
+    db.set_compress_threshold(64)
+    first = db.add_entry('Plain first', 'Written before encryption. ' * 10)
+    db.update_entry(first, 'Plain first', 'Edited before encryption. ' * 10)
+    db.save_draft(first, 'Draft title', 'Draft text')
+    db.enable_encryption('correct horse')
+    while db.encrypt_entries():
+        pass
+    db.purge_plaintext()
+    second = db.add_entry('Sealed second', 'Written after encryption.')
+    db.close()
+    return first, second
+
+def test_lock_and_unlock(tmp_path):
+    first, second = encrypted_diary(tmp_path / 'diary.db')
+    db = DatabaseManager(str(tmp_path / 'diary.db'))
+    assert db.is_locked()
+    with pytest.raises(DiaryLocked):
+        db.get_entry(first)
+    assert not db.unlock('wrong horse')
+    assert db.is_locked()
+    assert db.unlock('correct horse')
+    assert db.get_entry(first).content == 'Edited before encryption. ' * 10
+    assert db.get_entry(second).title == 'Sealed second'
+    assert db.get_revision(first, 1).content == 'Written before encryption. ' * 10
+    assert db.get_draft(first) == ('Draft title', 'Draft text')
+    db.close()
+    with open(str(tmp_path / 'diary.db'), 'rb') as source:
+        data = source.read()
+    for text in (b'Plain first', b'Sealed second', b'Draft text', b'Written', b'Edited'):
+        assert text not in data
+
+def test_tampered_and_moved_values_are_rejected(tmp_path):
+    first, second = encrypted_diary(tmp_path / 'diary.db')
+    db = DatabaseManager(str(tmp_path / 'diary.db'))
+    assert db.unlock('correct horse')
+    title, content = db.conn.execute(
+        'SELECT title, content FROM diary_entries WHERE id = ?', (first,)
+    ).fetchone()
+    tampered = bytearray(content)
+    tampered[-1] ^= 1
+    with db.conn:
+        db.conn.execute('UPDATE diary_entries SET content = ? WHERE id = ?', (bytes(tampered), first))
+        # A value copied from another row no longer decrypts there
+        db.conn.execute('UPDATE diary_entries SET title = ? WHERE id = ?', (title, second))
+    db.cache.entries.clear()
+    with pytest.raises(ValueError):
+        db.get_entry(first)
+    with pytest.raises(ValueError):
+        db.get_entry(second)
+
+def unbind(db):
+    # Seals every value the way diaries did before values were bound to
+    # their rows, with the field name alone as associated data
+    def seal(blob, field, *keys):
+        return db.cipher.encrypt(db.cipher.decrypt(blob, row_field(field, *keys)), field)
+    
+    with db.conn:
+        for entry_id, title, preview, content in db.conn.execute(
+            'SELECT id, title, preview, content FROM diary_entries'
+        ).fetchall():
+            db.conn.execute(
+                'UPDATE diary_entries SET title = ?, preview = ?, content = ? WHERE id = ?',
+                (seal(title, b'title', entry_id), seal(preview, b'preview', entry_id),
+                 seal(content, b'content', entry_id), entry_id)
+            )
+        for entry_id, title, content in db.conn.execute(
+            'SELECT entry_id, title, content FROM drafts'
+        ).fetchall():
+            db.conn.execute(
+                'UPDATE drafts SET title = ?, content = ? WHERE entry_id = ?',
+                (seal(title, b'draft title', entry_id), seal(content, b'draft content', entry_id),
+                 entry_id)
+            )
+        for entry_id, revision, title, data in db.conn.execute(
+            'SELECT entry_id, revision, title, data FROM entry_revisions'
+        ).fetchall():
+            db.conn.execute(
+                'UPDATE entry_revisions SET title = ?, data = ? WHERE entry_id = ? AND revision = ?',
+                (seal(title, b'revision title', entry_id, revision),
+                 seal(data, b'revision', entry_id, revision), entry_id, revision)
+            )
+        db.conn.execute("DELETE FROM settings WHERE key = 'encryption_binding'")
+
+def test_values_of_older_diaries_are_bound_on_unlock(tmp_path):
+    first, second = encrypted_diary(tmp_path / 'diary.db')
+    db = DatabaseManager(str(tmp_path / 'diary.db'))
+    assert db.unlock('correct horse')
+    unbind(db)
+    db.close()
+    db = DatabaseManager(str(tmp_path / 'diary.db'))
+    assert db.unlock('correct horse')
+    assert db.get_setting('encryption_binding') == 'row'
+    assert db.get_entry(first).content == 'Edited before encryption. ' * 10
+    assert db.get_entry(second).title == 'Sealed second'
+    assert db.get_revision(first, 1).content == 'Written before encryption. ' * 10
+    assert db.get_draft(first) == ('Draft title', 'Draft text')
+    row = db.conn.execute('SELECT title FROM diary_entries WHERE id = ?', (second,)).fetchone()
+    assert db.cipher.decrypt_text(row[0], row_field(b'title', second)) == 'Sealed second'
+
+def test_purge_stays_pending_until_done(tmp_path):
+    db = DatabaseManager(str(tmp_path / 'diary.db'))
+    db.enable_encryption('correct horse')
+    # Nothing to encrypt, yet the purge is still due
+    assert db.encrypt_entries() == 0
+    assert db.purge_pending()
+    db.close()
+    db = DatabaseManager(str(tmp_path / 'diary.db'))
+    assert db.purge_pending()
+    db.purge_plaintext()
+    db.purge_done()
+    assert not db.purge_pending()
+    db.close()
+    first, second = encrypted_diary(tmp_path / 'other.db')
+    db = DatabaseManager(str(tmp_path / 'other.db'))
+    assert db.purge_pending()
+
+def test_purge_waits_for_every_row(tmp_path):
+    db = DatabaseManager(str(tmp_path / 'diary.db'))
+    db.add_entry('Plain', 'not encrypted yet')
+    db.enable_encryption('correct horse')
+    assert not db.purge_pending()
+    while db.encrypt_entries():
+        pass
+    assert db.purge_pending()
@@ -0,0 +1,44 @@
+import threading
+
+from diary import DatabaseManager, DatabaseWorker
+
+def test_draft_is_replaced_and_deleted(tmp_path):
+    db = DatabaseManager(str(tmp_path / 'diary.db'))
+    entry_id = db.add_entry('Saved', 'saved text')
+    assert db.get_draft(entry_id) is None
+    db.save_draft(entry_id, 'Saved', 'typing')
+    db.save_draft(entry_id, 'Saved', 'typing more')
+    assert db.get_draft(entry_id) == ('Saved', 'typing more')
+    assert db.conn.execute('SELECT count(*) FROM drafts').fetchone()[0] == 1
+    # The saved entry is untouched
+    assert db.get_entry(entry_id).content == 'saved text'
+    db.delete_draft(entry_id)
+    assert db.get_draft(entry_id) is None
+
+def test_draft_goes_with_its_entry(tmp_path):
+    db = DatabaseManager(str(tmp_path / 'diary.db'))
+    entry_id = db.add_entry('Saved', 'saved text')
+    db.save_draft(entry_id, 'Saved', 'unsaved')
+    # A new entry's draft has no entry yet
+    db.save_draft(0, 'New', 'not saved yet')
+    db.delete_entry(entry_id)
+    assert db.get_draft(entry_id) is None
+    assert db.get_draft(0) == ('New', 'not saved yet')
+
+def test_superseded_draft_write_is_skipped(tmp_path):
+    worker = DatabaseWorker(str(tmp_path / 'diary.db'))
+    try:
+        # Hold the worker thread so the calls below stay queued
+        release = threading.Event()
+        worker.call('get_draft', 0, on_result=lambda draft: release.wait(5))
+        drafts = []
+        worker.call('save_draft', 0, 'New', 'first').cancel()
+        worker.call('get_draft', 0, on_result=drafts.append)
+        worker.call('save_draft', 0, 'New', 'second')
+        finished = threading.Event()
+        worker.call('get_draft', 0, on_result=lambda draft: (drafts.append(draft), finished.set()))
+        release.set()
+        assert finished.wait(5)
+        assert drafts == [None, ('New', 'second')]
+    finally:
+        worker.stop()
@@ -0,0 +1,82 @@
+import pytest
+
+import diary_cli
+from diary import DatabaseManager
+
+def open_diary(tmp_path):
+    return DatabaseManager(str(tmp_path / 'diary.db'))
+
+def generated(count, start=0):
+    for number in range(start, start + count):
+        yield ('Entry {}'.format(number), 'Words of entry number{} here'.format(number),
+               1500000000 + number * 3600, 3600)
+
+def test_import_in_batches(tmp_path):
+    db = open_diary(tmp_path)
+    db.add_entry('Already there', 'before the import')
+    progress = []
+    assert db.import_entries(generated(2500), batch_size=1000, progress=progress.append) == 2500
+    assert progress == [1000, 2000, 2500]
+    assert db.conn.execute('SELECT count(*) FROM diary_entries').fetchone()[0] == 2501
+    entry = db.get_entry_summary(db.search_entries('number1234')[0].id)
+    assert entry.title == 'Entry 1234'
+    assert (entry.created_at, entry.utc_offset) == (1500000000 + 1234 * 3600, 3600)
+    # Batches after the first one go to the index as well, and the insert
+    # trigger is back afterwards
+    assert [result.title for result in db.search_entries('number2499')] == ['Entry 2499']
+    later = db.add_entry('Added later', 'afterwards')
+    assert [result.id for result in db.search_entries('afterwards')] == [later]
+    if db.has_search_index:
+        db.conn.execute("INSERT INTO entries_fts (entries_fts) VALUES ('integrity-check')")
+    # Every imported entry is journaled for sync under a uid of its own
+    assert db.conn.execute('SELECT count(DISTINCT uid) FROM diary_entries').fetchone()[0] == 2502
+    assert db.conn.execute('SELECT count(*) FROM change_log').fetchone()[0] == 2502
+
+def test_import_takes_any_iterable_and_compresses(tmp_path):
+    db = open_diary(tmp_path)
+    db.set_compress_threshold(64)
+    long_text = 'A long imported entry that is worth compressing. ' * 10
+    entries = [('Long', long_text, None, None), ('Short', 'tiny', None, None)]
+    assert db.import_entries(iter(entries)) == 2
+    assert db.import_entries(iter([])) == 0
+    long_entry, = db.search_entries('compressing')
+    assert db.get_entry(long_entry.id).content == long_text
+    assert db.conn.execute(
+        'SELECT count(*) FROM diary_entries WHERE content_flags != 0'
+    ).fetchone()[0] == 1
+    if db.has_search_index:
+        db.conn.execute("INSERT INTO entries_fts (entries_fts) VALUES ('integrity-check')")
+    # Undated entries are dated now, and counted in the day's statistics
+    assert sum(count for day, count, words in db.conn.execute('SELECT * FROM daily_stats')) == 2
+
+def test_markdown_round_trip_keeps_heading_like_lines(tmp_path):
+    db = open_diary(tmp_path)
+    tricky = ('Notes from the meeting\n'
+              '## Not a new entry\n'
+              '<!-- diary-entry created_at=1 utc_offset=0 -->\n'
+              '\\<!-- diary-entry already escaped -->\n'
+              '_the end_')
+    db.add_entry('Tricky', tricky)
+    db.add_entry('Plain', 'Nothing special')
+    db.close()
+    exported = str(tmp_path / 'diary.md')
+    assert diary_cli.main(['--db', str(tmp_path / 'diary.db'), 'export', exported]) == 0
+    copy = str(tmp_path / 'copy.db')
+    assert diary_cli.main(['--db', copy, 'import', exported]) == 0
+    db = DatabaseManager(copy)
+    entries = sorted((entry.title, entry.content) for entry in db.iter_entries())
+    assert entries == [('Plain', 'Nothing special'), ('Tricky', tricky)]
+
+def test_import_rejects_empty_entries(tmp_path):
+    source = tmp_path / 'entries.jsonl'
+    source.write_text('{"title": "Fine", "content": "words"}\n'
+                      '{"title": "Blank", "content": "  "}\n', encoding='utf-8')
+    assert diary_cli.main(['--db', str(tmp_path / 'diary.db'), 'import', str(source)]) == 1
+    markdown = tmp_path / 'entries.md'
+    markdown.write_text('## \n' + diary_cli.MARKDOWN_MARKER.format(0, 0) + '\n\nwords\n',
+                        encoding='utf-8')
+    with open(str(markdown), encoding='utf-8') as lines, pytest.raises(ValueError):
+        list(diary_cli.require_text(diary_cli.read_markdown(lines)))
+    db = open_diary(tmp_path)
+    # The batch the empty entry was in is not written
+    assert list(db.iter_entries()) == []
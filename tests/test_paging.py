@@ -0,0 +1,34 @@
+from diary import DatabaseManager
+
+def walk(db, limit):
+    # Every page from the newest entry on, the way the home list loads them
+    pages = [db.get_entries_page(limit=limit)]
+    while len(pages[-1]) == limit:
+        last = pages[-1][-1]
+        pages.append(db.get_entries_page(last.created_at, last.id, limit=limit))
+    return pages
+
+def test_pages_cover_entries_with_the_same_time(tmp_path):
+    db = DatabaseManager(str(tmp_path / 'diary.db'))
+    # Imports often give many entries one timestamp
+    times = [1600000000] * 7 + [1500000000, 1700000000] + [1650000000] * 4
+    db.import_entries(
+        ('Entry {}'.format(number), 'text', created_at, 0)
+        for number, created_at in enumerate(times)
+    )
+    expected = [
+        entry_id for created_at, entry_id in sorted(
+            db.conn.execute('SELECT created_at, id FROM diary_entries'), reverse=True
+        )
+    ]
+    for limit in (1, 2, 3, 7, 50):
+        pages = walk(db, limit)
+        assert all(len(page) <= limit for page in pages)
+        assert [entry.id for page in pages for entry in page] == expected
+
+def test_page_entries_carry_no_body(tmp_path):
+    db = DatabaseManager(str(tmp_path / 'diary.db'))
+    db.add_entry('Title', 'A body long enough to be cut short in the preview. ' * 20)
+    entry, = db.get_entries_page()
+    assert entry.body is None
+    assert entry.preview and len(entry.preview) < len(db.get_entry(entry.id).content)
@@ -0,0 +1,64 @@
+import pytest
+
+from diary import DatabaseManager
+from diary.revisions import (
+    REVISION_DELTA, REVISION_SNAPSHOT, SNAPSHOT_INTERVAL, apply_delta, make_delta, split_pieces
+)
+
+TEXTS = [
+    '',
+    'One sentence.',
+    'Morning walk. Coffee by the river!\nEvening rain? Early night.',
+    'No punctuation at all',
+    '...\n\n!!\nTrailing space. ',
+    'Ünïcödé déjà vu. 日記を書いた。Emoji 🙂 too.',
+]
+
+@pytest.mark.parametrize('base', TEXTS)
+@pytest.mark.parametrize('text', TEXTS)
+def test_delta_rebuilds_the_text(text, base):
+    assert apply_delta(make_delta(text, base), base) == text
+
+def test_pieces_cover_the_text():
+    for text in TEXTS:
+        assert ''.join(split_pieces(text)) == text
+
+def test_delta_copies_unchanged_sentences():
+    base = ' '.join('Sentence number {} of a long entry.'.format(i) for i in range(200))
+    text = base.replace('number 100 ', 'number one hundred ')
+    assert len(make_delta(text, base)) < len(text) // 20
+
+def version(number):
+    # Each version changes one sentence of the previous one and adds one
+    sentences = ['Day {} went well.'.format(i) for i in range(number + 1)]
+    sentences[number // 2] = 'Changed in version {}.'.format(number)
+    return ' '.join(sentences)
+
+@pytest.mark.parametrize('threshold', [0, 64])
+def test_every_revision_is_rebuilt(tmp_path, threshold):
+    db = DatabaseManager(str(tmp_path / 'diary.db'))
+    db.set_compress_threshold(threshold)
+    count = SNAPSHOT_INTERVAL * 2 + 5
+    entry_id = db.add_entry('Version 0', version(0))
+    for number in range(1, count):
+        db.update_entry(entry_id, 'Version {}'.format(number), version(number))
+    kinds = set(kind for (kind,) in db.conn.execute('SELECT kind FROM entry_revisions'))
+    assert kinds == {REVISION_DELTA, REVISION_SNAPSHOT}
+    revisions = db.get_revisions(entry_id)
+    assert [revision[0] for revision in revisions] == list(range(count - 1, 0, -1))
+    for revision in range(1, count):
+        entry = db.get_revision(entry_id, revision)
+        assert entry.title == 'Version {}'.format(revision - 1)
+        assert entry.content == version(revision - 1)
+    assert db.get_revision(entry_id, count) is None
+
+def test_restore_revision_can_be_undone(tmp_path):
+    db = DatabaseManager(str(tmp_path / 'diary.db'))
+    entry_id = db.add_entry('Title', 'First text.')
+    db.update_entry(entry_id, 'Title', 'Second text.')
+    assert db.restore_revision(entry_id, 1)
+    assert db.get_entry(entry_id).content == 'First text.'
+    # The version the restore replaced is now the newest revision
+    assert db.get_revision(entry_id, 2).content == 'Second text.'
+    assert db.restore_revision(entry_id, 2)
+    assert db.get_entry(entry_id).content == 'Second text.'
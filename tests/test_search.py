@@ -0,0 +1,121 @@
+import sqlite3
+
+import pytest
+
+from diary import BODY_ZLIB, MATCH_END, MATCH_START, DatabaseManager
+
+LONG = 'A long entry about the lighthouse, repeated until it is worth compressing. ' * 5
+
+def open_diary(tmp_path):
+    db = DatabaseManager(str(tmp_path / 'diary.db'))
+    if not db.has_search_index:
+        pytest.skip('SQLite without FTS5')
+    return db
+
+def check_index(conn):
+    # Raises sqlite3.DatabaseError when the index is out of step
+    conn.execute("INSERT INTO entries_fts (entries_fts) VALUES ('integrity-check')")
+
+def found(db, query):
+    return sorted(entry.id for entry in db.search_entries(query))
+
+def flags(db, entry_id):
+    return db.conn.execute(
+        'SELECT content_flags FROM diary_entries WHERE id = ?', (entry_id,)
+    ).fetchone()[0]
+
+def test_search_matches_every_word_as_a_prefix(tmp_path):
+    db = open_diary(tmp_path)
+    walk = db.add_entry('Walk by the sea', 'Windy, but the gulls were out.')
+    gulls = db.add_entry('Birds', 'Counted gulls and terns at the sea wall.')
+    db.add_entry('Work', 'Meetings all day.')
+    assert found(db, 'sea') == [walk, gulls]
+    assert found(db, 'gull') == [walk, gulls]
+    assert found(db, 'sea gulls') == [walk, gulls]
+    assert found(db, 'sea meetings') == []
+    assert found(db, 'SEA, gulls!') == [walk, gulls]
+    # Words only, so nothing in the query is read as FTS syntax
+    assert db.search_entries('"*) OR (') == []
+    assert db.search_entries('') == []
+
+def test_search_ranks_titles_first_and_marks_matches(tmp_path):
+    db = open_diary(tmp_path)
+    body = db.add_entry('Monday', 'Went to the garden centre after work.')
+    title = db.add_entry('Garden', 'Planted beans.')
+    results = db.search_entries('garden')
+    assert [entry.id for entry in results] == [title, body]
+    assert results[0].title == MATCH_START + 'Garden' + MATCH_END
+    assert MATCH_START + 'garden' + MATCH_END in results[1].preview
+    assert [entry.id for entry in db.search_entries('garden', limit=1, offset=1)] == [body]
+
+def test_search_within_tags(tmp_path):
+    db = open_diary(tmp_path)
+    home = db.add_entry('Rain', 'Rain all day', tags=['home'])
+    trip = db.add_entry('Rain again', 'Rain on the trip', tags=['trip', 'home'])
+    db.add_entry('More rain', 'Rain, untagged')
+    tags = {name: tag_id for tag_id, name, count in db.get_tags()}
+    in_home = db.search_entries('rain', tag_ids=[tags['home']])
+    assert sorted(entry.id for entry in in_home) == [home, trip]
+    in_both = db.search_entries('rain', tag_ids=[tags['home'], tags['trip']], match_all=True)
+    assert [entry.id for entry in in_both] == [trip]
+
+def test_search_without_an_index(tmp_path):
+    db = open_diary(tmp_path)
+    db.set_compress_threshold(64)
+    packed = db.add_entry('Packed', LONG)
+    plain = db.add_entry('Plain', 'about a lighthouse too')
+    db.has_search_index = False
+    assert found(db, 'lighthouse') == [packed, plain]
+    assert found(db, 'windmill') == []
+
+def test_index_follows_compressed_rows(tmp_path):
+    db = open_diary(tmp_path)
+    before = db.add_entry('Before', LONG)
+    short = db.add_entry('Short', 'a quick note on the harbour')
+    db.set_compress_threshold(64)
+    while db.compress_entries():
+        pass
+    after = db.add_entry('After', LONG.replace('lighthouse', 'windmill'))
+    assert flags(db, before) == flags(db, after) == BODY_ZLIB
+    assert flags(db, short) == 0
+    check_index(db.conn)
+    assert found(db, 'lighthouse') == [before]
+    assert found(db, 'windmill') == [after]
+    assert found(db, 'harbour') == [short]
+    # Compressed to plain, plain to compressed, compressed to compressed
+    db.update_entry(before, 'Before', 'now short, about a meadow')
+    db.update_entry(short, 'Short', LONG.replace('lighthouse', 'harbour'))
+    db.update_entry(after, 'After', LONG.replace('lighthouse', 'orchard'))
+    assert flags(db, before) == 0
+    assert flags(db, short) == flags(db, after) == BODY_ZLIB
+    check_index(db.conn)
+    assert found(db, 'lighthouse') == []
+    assert found(db, 'windmill') == []
+    assert found(db, 'meadow') == [before]
+    assert found(db, 'harbour') == [short]
+    assert found(db, 'orchard') == [after]
+    db.delete_entry(short)
+    db.delete_entry(before)
+    check_index(db.conn)
+    assert found(db, 'harbour') == []
+    assert found(db, 'meadow') == []
+    assert found(db, 'compressing') == [after]
+
+def test_other_connections_cannot_change_compressed_rows(tmp_path):
+    db = open_diary(tmp_path)
+    db.set_compress_threshold(64)
+    plain = db.add_entry('Plain', 'short enough to stay text')
+    packed = db.add_entry('Packed', LONG)
+    other = sqlite3.connect(db.db_path)
+    with pytest.raises(sqlite3.DatabaseError, match='only Personal Diary'):
+        other.execute('DELETE FROM diary_entries WHERE id = ?', (packed,))
+    with pytest.raises(sqlite3.DatabaseError, match='only Personal Diary'):
+        other.execute("UPDATE diary_entries SET title = 'Changed' WHERE id = ?", (packed,))
+    # Plain rows are indexed by SQL alone, so they can still be changed
+    other.execute("UPDATE diary_entries SET title = 'Renamed' WHERE id = ?", (plain,))
+    other.execute('DELETE FROM diary_entries WHERE id = ?', (plain,))
+    other.commit()
+    other.close()
+    check_index(db.conn)
+    assert found(db, 'lighthouse') == [packed]
+    assert found(db, 'short') == []
@@ -0,0 +1,59 @@
+import calendar
+from datetime import date
+
+from diary import DatabaseManager
+
+def timestamp(day, hour=12):
+    return calendar.timegm((day.year, day.month, day.day, hour, 0, 0))
+
+def recount(db):
+    # daily_stats as counted from scratch
+    return db.conn.execute(
+        "SELECT date(created_at + utc_offset, 'unixepoch'), count(*), sum(word_count) "
+        'FROM diary_entries GROUP BY 1 ORDER BY 1'
+    ).fetchall()
+
+def stats(db):
+    return db.conn.execute(
+        'SELECT day, entry_count, word_count FROM daily_stats ORDER BY day'
+    ).fetchall()
+
+def test_daily_stats_follow_every_change(tmp_path):
+    db = DatabaseManager(str(tmp_path / 'diary.db'))
+    db.import_entries([
+        ('One', 'one two three', timestamp(date(2024, 3, 1)), 0),
+        ('Two', 'four five', timestamp(date(2024, 3, 1)), 0),
+        # 23:30 UTC is already the next day two hours east
+        ('Three', 'six', timestamp(date(2024, 3, 1), 23) + 1800, 7200),
+        ('Four', 'seven eight', timestamp(date(2024, 3, 5)), 0),
+    ])
+    assert stats(db) == recount(db) == [
+        ('2024-03-01', 2, 5), ('2024-03-02', 1, 1), ('2024-03-05', 1, 2)
+    ]
+    added = db.add_entry('Today', 'written just now')
+    assert stats(db) == recount(db)
+    db.update_entry(added, 'Today', 'written just now and then some more')
+    assert stats(db) == recount(db)
+    db.delete_entry(db.conn.execute(
+        'SELECT id FROM diary_entries WHERE created_at = ?', (timestamp(date(2024, 3, 5)),)
+    ).fetchone()[0])
+    assert stats(db) == recount(db)
+    assert '2024-03-05' not in [day for day, count, words in stats(db)]
+    db.rebuild_daily_stats()
+    assert stats(db) == recount(db)
+
+def test_month_and_writing_stats(tmp_path):
+    db = DatabaseManager(str(tmp_path / 'diary.db'))
+    days = [date(2024, 2, 28), date(2024, 2, 29), date(2024, 3, 1), date(2024, 3, 1),
+            date(2024, 3, 10), date(2024, 3, 11)]
+    db.import_entries(('Entry', 'two words', timestamp(day), 0) for day in days)
+    assert db.get_month_stats(2024, 3) == [('2024-03-01', 2, 4), ('2024-03-10', 1, 2),
+                                           ('2024-03-11', 1, 2)]
+    assert db.get_year_stats(2024) == [('2024-02', 2, 4), ('2024-03', 4, 8)]
+    totals = db.get_writing_stats(today=date(2024, 3, 12))
+    assert totals == {
+        'entries': 6, 'words': 12, 'days': 5, 'current_streak': 2, 'longest_streak': 3
+    }
+    assert db.get_writing_stats(today=date(2024, 3, 13))['current_streak'] == 0
+    on_this_day = db.get_entries_on_this_day(3, 1, 2025)
+    assert len(on_this_day) == 2
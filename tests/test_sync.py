@@ -0,0 +1,250 @@
+import io
+import os
+import shutil
+import socket
+import sqlite3
+import threading
+
+import pytest
+
+from diary import BackupStore, DatabaseManager, SyncRefused, new_pairing_code
+from diary.sync import (
+    SyncChannel, export_file, file_sealed, import_file, open_channel, pairing_key, sync_stream
+)
+
+def open_diary(tmp_path, name):
+    return DatabaseManager(str(tmp_path / name / 'diary.db'))
+
+def sync(a, b):
+    # Both directions, the way sync_stream does it over a connection
+    a_state, b_state = a.get_sync_state(), b.get_sync_state()
+    to_b = a.export_changes(b.device_id, since=b_state['received'].get(a.device_id, 0))
+    to_a = b.export_changes(a.device_id, since=a_state['received'].get(b.device_id, 0))
+    return b.apply_changes(to_b), a.apply_changes(to_a)
+
+def contents(db):
+    return sorted((entry.title, entry.content) for entry in db.iter_entries())
+
+def two_diaries(tmp_path):
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'b').mkdir()
+    return open_diary(tmp_path, 'a'), open_diary(tmp_path, 'b')
+
+def test_independent_changes_merge(tmp_path):
+    a, b = two_diaries(tmp_path)
+    a.add_entry('From a', 'written on a')
+    gone = b.add_entry('From b', 'written on b')
+    assert sync(a, b) == (1, 1)
+    assert contents(a) == contents(b) == [('From a', 'written on a'), ('From b', 'written on b')]
+    b.delete_entry(gone)
+    a.add_entry('Later', 'also on a')
+    assert sync(a, b) == (1, 1)
+    assert contents(a) == contents(b) == [('From a', 'written on a'), ('Later', 'also on a')]
+    # Nothing left to send
+    assert sync(a, b) == (0, 0)
+
+def test_last_writer_wins(tmp_path):
+    a, b = two_diaries(tmp_path)
+    first = a.add_entry('Shared', 'original')
+    second = a.add_entry('Other', 'original')
+    sync(a, b)
+    ids = {entry.title: entry.id for entry in b.iter_entries()}
+    b_first, b_second = ids['Shared'], ids['Other']
+    # The side with more changes since has the higher clock
+    a.update_entry(first, 'Shared', 'a once')
+    b.update_entry(b_first, 'Shared', 'b once')
+    b.update_entry(b_first, 'Shared', 'b twice')
+    sync(a, b)
+    assert a.get_entry(first).content == b.get_entry(b_first).content == 'b twice'
+    # Equal clocks are settled by the device id, the same way on both sides
+    a.update_entry(second, 'Other', 'from a')
+    b.update_entry(b_second, 'Other', 'from b')
+    sync(a, b)
+    winner = 'from a' if a.device_id > b.device_id else 'from b'
+    assert a.get_entry(second).content == b.get_entry(b_second).content == winner
+    assert contents(a) == contents(b)
+
+def test_changes_applied_again_change_nothing(tmp_path):
+    a, b = two_diaries(tmp_path)
+    first = a.add_entry('First', 'one')
+    a.add_entry('Second', 'two')
+    message = a.export_changes(b.device_id)
+    assert b.apply_changes(message) == 2
+    assert b.apply_changes(message) == 0
+    assert contents(b) == [('First', 'one'), ('Second', 'two')]
+    # An old batch arriving after newer changes does not roll them back
+    a.update_entry(first, 'First', 'newer')
+    sync(a, b)
+    assert b.apply_changes(message) == 0
+    assert contents(b) == [('First', 'newer'), ('Second', 'two')]
+    with pytest.raises(ValueError):
+        a.apply_changes(message)
+
+def test_sync_through_a_file(tmp_path):
+    a, b = two_diaries(tmp_path)
+    a.add_entry('Üntitled', 'ünicode and\nlines')
+    path = str(tmp_path / 'changes.sync')
+    assert export_file(a, path, b.device_id)[0] == 1
+    assert import_file(b, path) == 1
+    assert import_file(b, path) == 0
+    assert contents(b) == [('Üntitled', 'ünicode and\nlines')]
+    with open(path, 'wb') as output:
+        output.write(b'garbage')
+    with pytest.raises(ValueError):
+        import_file(b, path)
+
+def test_sealed_sync_file(tmp_path):
+    pytest.importorskip('cryptography')
+    a, b = two_diaries(tmp_path)
+    a.add_entry('Secret', 'nobody else reads this')
+    path = str(tmp_path / 'changes.sync')
+    code = new_pairing_code()
+    export_file(a, path, b.device_id, code)
+    assert file_sealed(path)
+    if os.name == 'posix':
+        assert os.stat(path).st_mode & 0o777 == 0o600
+    with pytest.raises(SyncRefused):
+        import_file(b, path)
+    with pytest.raises(SyncRefused):
+        import_file(b, path, new_pairing_code())
+    assert contents(b) == []
+    assert import_file(b, path, code.lower()) == 1
+    assert contents(b) == [('Secret', 'nobody else reads this')]
+
+def test_restore_then_sync(tmp_path):
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'b').mkdir()
+    a, b = open_diary(tmp_path, 'a'), open_diary(tmp_path, 'b')
+    first = a.add_entry('First', 'one')
+    sync(a, b)
+    backup = BackupStore(a.db_path).create(pause=0)
+    a.update_entry(first, 'First', 'two')
+    a.add_entry('Second', 'lost with the restore')
+    sync(a, b)
+    device = a.device_id
+    a.restore_backup(backup)
+    assert a.device_id != device
+    # Same number of changes as before the restore, so the same seq values
+    a.update_entry(first, 'First', 'three')
+    a.add_entry('Third', 'after the restore')
+    sync(a, b)
+    assert contents(b) == [
+        ('First', 'three'), ('Second', 'lost with the restore'), ('Third', 'after the restore')
+    ]
+    assert contents(a) == contents(b)
+
+def test_copies_of_an_old_diary_pair_up(tmp_path):
+    # A diary from before the change journal, copied to a second device
+    # and upgraded there separately
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'b').mkdir()
+    conn = sqlite3.connect(str(tmp_path / 'a' / 'diary.db'))
+    conn.execute(
+        'CREATE TABLE diary_entries (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+        'title TEXT NOT NULL, content TEXT NOT NULL, date TEXT NOT NULL)'
+    )
+    conn.executemany(
+        'INSERT INTO diary_entries (title, content, date) VALUES (?, ?, ?)',
+        [('Same', 'text', '2020-01-01T10:00:00'), ('Same', 'text', '2020-01-01T10:00:00'),
+         ('Other', 'words', '2021-05-06T07:08:09')]
+    )
+    conn.commit()
+    conn.close()
+    shutil.copy(str(tmp_path / 'a' / 'diary.db'), str(tmp_path / 'b' / 'diary.db'))
+    a, b = open_diary(tmp_path, 'a'), open_diary(tmp_path, 'b')
+    assert a.device_id != b.device_id
+    sync(a, b)
+    assert contents(a) == contents(b) == [('Other', 'words'), ('Same', 'text'), ('Same', 'text')]
+
+def test_copied_diary_needs_a_device_id_of_its_own(tmp_path):
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'b').mkdir()
+    a = open_diary(tmp_path, 'a')
+    a.add_entry('Shared', 'before the copy')
+    a.close()
+    shutil.copy(str(tmp_path / 'a' / 'diary.db'), str(tmp_path / 'b' / 'diary.db'))
+    a, b = open_diary(tmp_path, 'a'), open_diary(tmp_path, 'b')
+    b.add_entry('Copy', 'only here')
+    with pytest.raises(ValueError):
+        a.apply_changes(b.export_changes(a.device_id))
+    b.reset_device()
+    sync(a, b)
+    assert contents(a) == contents(b) == [('Copy', 'only here'), ('Shared', 'before the copy')]
+
+def sync_over_socket(tmp_path, a, code_a, code_b):
+    # a syncs with the diary in tmp_path/b, served on a thread of its own
+    # since a DatabaseManager stays on the thread that opened it
+    left, right = socket.socketpair()
+    results = {}
+    
+    def serve():
+        b = open_diary(tmp_path, 'b')
+        try:
+            with right, right.makefile('rwb') as stream:
+                channel = open_channel(stream, pairing_key(code_b), initiator=False)
+                results['b'] = sync_stream(b, channel, initiator=False)
+        except ValueError as error:
+            results['b'] = error
+        finally:
+            results['b contents'] = contents(b)
+            b.close()
+    
+    thread = threading.Thread(target=serve)
+    thread.start()
+    try:
+        with left, left.makefile('rwb') as stream:
+            channel = open_channel(stream, pairing_key(code_a), initiator=True)
+            results['a'] = sync_stream(a, channel, initiator=True)
+    except ValueError as error:
+        results['a'] = error
+    thread.join()
+    return results
+
+def test_sync_over_a_connection(tmp_path):
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'b').mkdir()
+    b = open_diary(tmp_path, 'b')
+    b.add_entry('From b', 'served')
+    b.close()
+    a = open_diary(tmp_path, 'a')
+    a.add_entry('From a', 'connecting')
+    code = new_pairing_code()
+    results = sync_over_socket(tmp_path, a, code, code.lower().replace('-', ' '))
+    assert results['a'] == (1, 1) and results['b'] == (1, 1)
+    assert contents(a) == results['b contents'] == [('From a', 'connecting'), ('From b', 'served')]
+
+def test_wrong_pairing_code_is_refused(tmp_path):
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'b').mkdir()
+    a = open_diary(tmp_path, 'a')
+    a.add_entry('Private', 'not for strangers')
+    results = sync_over_socket(tmp_path, a, 'AAAAA-AAAAA', 'BBBBB-BBBBB')
+    assert isinstance(results['b'], SyncRefused)
+    assert isinstance(results['a'], ValueError)
+    assert results['b contents'] == []
+    assert contents(a) == [('Private', 'not for strangers')]
+
+def test_channel_rejects_changed_and_replayed_messages():
+    key = pairing_key('AAAAA-AAAAA')
+    stream = io.BytesIO()
+    sender = SyncChannel(stream, key, initiator=True)
+    sender.send({'n': 1})
+    sender.send({'n': 2})
+    frames = stream.getvalue()
+    
+    receiver = SyncChannel(io.BytesIO(frames), key, initiator=False)
+    assert receiver.receive() == {'n': 1}
+    assert receiver.receive() == {'n': 2}
+    # The second frame first, as if the first one were dropped
+    receiver = SyncChannel(io.BytesIO(frames[len(frames) // 2:]), key, initiator=False)
+    with pytest.raises(ValueError):
+        receiver.receive()
+    # One flipped bit
+    changed = bytearray(frames)
+    changed[20] ^= 1
+    receiver = SyncChannel(io.BytesIO(bytes(changed)), key, initiator=False)
+    with pytest.raises(ValueError):
+        receiver.receive()
+    # Sent back to the side that wrote it
+    with pytest.raises(ValueError):
+        SyncChannel(io.BytesIO(frames), key, initiator=True).receive()
@@ -0,0 +1,49 @@
+from diary import DatabaseManager, parse_tags
+
+def counts(db):
+    return {name: count for tag_id, name, count in db.get_tags()}
+
+def recount(db):
+    return dict(db.conn.execute(
+        'SELECT t.name, count(*) FROM entry_tags et JOIN tags t ON t.id = et.tag_id GROUP BY t.id'
+    ).fetchall())
+
+def test_parse_tags():
+    assert parse_tags('work, #Travel, work, WORK , ,#') == ['work', 'Travel']
+    assert parse_tags('') == []
+
+def test_tag_counts_follow_retagging_and_deletes(tmp_path):
+    db = DatabaseManager(str(tmp_path / 'diary.db'))
+    first = db.add_entry('First', 'text', tags=['work', 'Travel'])
+    second = db.add_entry('Second', 'text', tags=['travel'])
+    third = db.add_entry('Third', 'text', tags=['home'])
+    # A tag keeps the first spelling it was given
+    assert counts(db) == recount(db) == {'home': 1, 'Travel': 2, 'work': 1}
+    assert db.get_entry_tags(second) == ['Travel']
+    db.update_entry(first, 'First', 'text', tags=['work', 'home'])
+    assert counts(db) == recount(db) == {'home': 2, 'Travel': 1, 'work': 1}
+    # Left as None, tags are not changed
+    db.update_entry(second, 'Second', 'new text')
+    assert db.get_entry_tags(second) == ['Travel']
+    db.update_entry(third, 'Third', 'text', tags=[])
+    assert counts(db) == recount(db) == {'home': 1, 'Travel': 1, 'work': 1}
+    db.delete_entry(first)
+    assert counts(db) == recount(db) == {'Travel': 1}
+    assert db.get_entry_tags(first) == []
+
+def test_pages_filtered_by_tags(tmp_path):
+    db = DatabaseManager(str(tmp_path / 'diary.db'))
+    both = db.add_entry('Both', 'text', tags=['a', 'b'])
+    only_a = db.add_entry('Only a', 'text', tags=['a'])
+    db.add_entry('Neither', 'text', tags=['c'])
+    tags = {name: tag_id for tag_id, name, count in db.get_tags()}
+    
+    def page(tag_names, match_all=False):
+        return sorted(entry.id for entry in db.get_entries_page(
+            tag_ids=[tags[name] for name in tag_names], match_all=match_all
+        ))
+    
+    assert page(['a']) == [both, only_a]
+    assert page(['a', 'b']) == [both, only_a]
+    assert page(['a', 'b'], match_all=True) == [both]
+    assert page(['b', 'c'], match_all=True) == []
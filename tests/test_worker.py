@@ -0,0 +1,63 @@
+import threading
+
+from diary import DatabaseWorker, Worker
+
+class BrokenWorker(Worker):
+    def __init__(self, started):
+        self.started = started
+        super().__init__()
+    
+    def open(self):
+        # Fails only once the test has queued its first calls
+        self.started.wait(5)
+        raise OSError('cannot open the diary')
+
+def wait_for(worker, method, *args):
+    # (result, error) of one call
+    outcome = []
+    done = threading.Event()
+    worker.call(method, *args,
+                on_result=lambda result: (outcome.append((result, None)), done.set()),
+                on_error=lambda error: (outcome.append((None, error)), done.set()))
+    assert done.wait(5)
+    return outcome[0]
+
+def test_calls_run_on_the_worker(tmp_path):
+    worker = DatabaseWorker(str(tmp_path / 'diary.db'))
+    try:
+        entry_id, error = wait_for(worker, 'add_entry', 'Title', 'text')
+        assert error is None
+        entry, error = wait_for(worker, 'get_entry', entry_id)
+        assert entry.content == 'text'
+        result, error = wait_for(worker, 'no_such_method')
+        assert isinstance(error, AttributeError)
+    finally:
+        worker.stop()
+
+def test_calls_fail_once_open_failed():
+    started = threading.Event()
+    worker = BrokenWorker(started)
+    errors = []
+    done = threading.Event()
+    
+    def on_error(error):
+        errors.append(error)
+        if len(errors) == 3:
+            done.set()
+    
+    for number in range(3):
+        worker.call('anything', on_error=on_error)
+    started.set()
+    assert done.wait(5)
+    assert all(isinstance(error, OSError) for error in errors)
+    worker.thread.join(5)
+    # Later calls are answered at once
+    result, error = wait_for(worker, 'anything')
+    assert isinstance(error, OSError)
+    worker.stop()
+
+def test_database_worker_reports_a_diary_it_cannot_open(tmp_path):
+    worker = DatabaseWorker(str(tmp_path / 'missing' / 'diary.db'))
+    result, error = wait_for(worker, 'get_entries_page')
+    assert error is not None
+    worker.stop()